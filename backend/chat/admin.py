@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import ChatRoom, Message
+from .models import ArchivedMessage, ChatRoom, Message
 
 # Register your models here.
 admin.site.register(ChatRoom)
 admin.site.register(Message)
+admin.site.register(ArchivedMessage)
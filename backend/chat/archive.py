@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ArchivedMessage, ChatRoom, Message
+
+ARCHIVED_COLUMNS = ('id', 'chat_room_id', 'sender_id', 'content', 'created_at', 'is_read')
+
+
+def inactive_room_ids(cutoff):
+    """
+    Ids of rooms that still have messages, none of them newer than cutoff.
+    """
+    return ChatRoom.objects.annotate(
+        last_message_at=Max('messages__created_at'),
+    ).filter(last_message_at__lt=cutoff).order_by('id').values_list('id', flat=True)
+
+
+def archive_room_messages(room_id, cutoff, batch_size=1000):
+    """
+    Move the room's messages created before cutoff to ArchivedMessage, oldest
+    first, batch_size rows per transaction; return how many were moved.
+
+    Each batch is copied and deleted in one transaction, so a message is
+    always in exactly one of the tables. Messages sent while the room is
+    being archived are newer than cutoff and stay where they are, which keeps
+    every archived message of a room older than its hot ones.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Message.objects.filter(chat_room_id=room_id, created_at__lt=cutoff)
+                .order_by('id').select_for_update().values(*ARCHIVED_COLUMNS)[:batch_size]
+            )
+            if not rows:
+                return moved
+            ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+            Message.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            ChatRoom.objects.filter(id=room_id, archived_at__isnull=True).update(archived_at=timezone.now())
+        moved += len(rows)
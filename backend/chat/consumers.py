@@ -1,11 +1,47 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from pharmacy.notifications import notification_group
+from .outbound import BoundedSendMixin
+from .presence import presence_registry
+from .writer import message_writer
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
+    """
+    Room chat over WebSocket.
+
+    Membership is checked once at connect, where the room and the sender's
+    serialized payload are also loaded and kept on the consumer; after that
+    sending a message costs two INSERTs, the message and its outbox
+    notification (none, in write-behind mode), and the broadcast is built
+    without touching the database. The cached
+    sender payload reflects the profile as it was when the socket opened.
+    Outgoing frames go through a bounded queue (see BoundedSendMixin).
+
+    Presence and typing are tracked in presence_registry, not the database.
+    A new socket is first sent {"type": "presence", "online": [...],
+    "typing": [...]}; after that the room gets {"type": "presence", "user",
+    "status"} when a user's first socket opens or last one closes, and
+    rate-limited {"type": "typing", "user", "typing", "expires_in"} frames.
+    """
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
+        self.room = None
+
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+        membership = await self.load_membership(user)
+        if membership is None:
+            # Not a participant (or no such room): reject the handshake
+            await self.close()
+            return
+        self.room, self.sender_payload, self.recipient_ids = membership
 
         # Join room group
         await self.channel_layer.group_add(
@@ -14,31 +50,66 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         await self.accept()
 
+        if presence_registry.connect(self.room.id, user.id):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'presence_update',
+                'user': user.id,
+                'status': 'online',
+            })
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'online': presence_registry.online(self.room.id),
+            'typing': presence_registry.typing_users(self.room.id),
+        }))
+
     async def disconnect(self, close_code):
+        await self._outbound_shutdown()
+        if self.room is None:
+            return
+        if settings.CHAT_WRITE_BEHIND:
+            # Don't let the connection's last messages linger in the buffer
+            await message_writer.flush()
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        user_id = self.scope['user'].id
+        if presence_registry.disconnect(self.room.id, user_id):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'presence_update',
+                'user': user_id,
+                'status': 'offline',
+            })
 
     async def receive(self, text_data):
         """
         Receive a message from WebSocket, save to DB, and broadcast to the group.
+        Frames of type "read" move the user's read watermark instead, and
+        frames of type "typing" ({"typing": false} when the user stops)
+        update the typing indicator.
         """
         try:
             data = json.loads(text_data)
+            if data.get('type') == 'read':
+                await self.receive_read(data.get('message_id'))
+                return
+            if data.get('type') == 'typing':
+                await self.receive_typing(bool(data.get('typing', True)))
+                return
             content = data.get('content')
             if not content or not content.strip():
                 await self.send(text_data=json.dumps({'error': 'Empty message.'}))
                 return
             user = self.scope['user']
-            if not user.is_authenticated:
-                await self.send(text_data=json.dumps({'error': 'Authentication required.'}))
-                return
-            # Save message to DB
-            message = await self.create_message(user, content)
-            # Serialize message
-            msg_json = await self.message_to_json(message)
+            presence_registry.clear_typing(self.room.id, user.id)
+            if settings.CHAT_WRITE_BEHIND:
+                # Broadcast now under a provisional id; the writer persists it in a batch
+                msg_json = self.provisional_message_json(user, content)
+            else:
+                # Save message to DB
+                message = await self.create_message(user, content)
+                msg_json = self.message_to_json(message)
             # Broadcast message to room
             await self.channel_layer.group_send(
                 self.room_group_name,
@@ -57,24 +128,148 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message = event['message']
         await self.send(text_data=json.dumps(message))
 
+    async def receive_read(self, message_id):
+        if message_id is not None:
+            message_id = int(message_id)
+        user = self.scope['user']
+        last_read = await self.mark_read(user, message_id)
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'read_receipt',
+                'user': user.id,
+                'last_read_message_id': last_read,
+            }
+        )
+
+    async def read_receipt(self, event):
+        """
+        Tell participants how far someone has read.
+        """
+        await self.send(text_data=json.dumps({
+            'type': 'read',
+            'user': event['user'],
+            'last_read_message_id': event['last_read_message_id'],
+        }), coalesce_key=('read', event['user']))
+
+    async def receive_typing(self, is_typing):
+        user = self.scope['user']
+        if presence_registry.typing(self.room.id, user.id, is_typing):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'typing_update',
+                'user': user.id,
+                'typing': is_typing,
+            })
+
+    async def typing_update(self, event):
+        if event['user'] == self.scope['user'].id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'typing',
+            'user': event['user'],
+            'typing': event['typing'],
+            'expires_in': settings.CHAT_TYPING_TTL,
+        }), coalesce_key=('typing', event['user']))
+
+    async def presence_update(self, event):
+        if event['user'] == self.scope['user'].id:
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'user': event['user'],
+            'status': event['status'],
+        }), coalesce_key=('presence', event['user']))
+
+    async def messages_persisted(self, event):
+        """
+        Tell the client the database ids of provisionally broadcast messages.
+        """
+        await self.send(text_data=json.dumps({
+            'type': 'messages_persisted',
+            'messages': event['messages'],
+        }))
+
+    async def messages_failed(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'messages_failed',
+            'provisional_ids': event['provisional_ids'],
+        }))
+
     @database_sync_to_async
-    def create_message(self, user, content):
-        from .models import ChatRoom, Message
-        try:
-            room = ChatRoom.objects.get(id=self.room_id)
-        except ChatRoom.DoesNotExist:
-            raise Exception("Chat room does not exist.")
-        msg = Message.objects.create(chat_room=room, sender=user, content=content)
-        return msg
+    def load_membership(self, user):
+        """
+        Return (room, serialized sender, ids of the other participants) if
+        user participates in the room.
+        """
+        from users.models import User
+        from users.serializers import UserSerializer
+        from .models import ChatRoom
+        room = ChatRoom.objects.filter(id=self.room_id, participants=user).first()
+        if room is None:
+            return None
+        sender = User.objects.select_related('pharmacy_profile', 'patient_profile').get(pk=user.pk)
+        recipient_ids = list(room.participants.exclude(pk=user.pk).values_list('id', flat=True))
+        return room, UserSerializer(sender).data, recipient_ids
 
     @database_sync_to_async
+    def mark_read(self, user, message_id):
+        from .read_state import mark_read
+        return mark_read(self.room.id, user.id, message_id)
+
+    @database_sync_to_async
+    def create_message(self, user, content):
+        from outbox.events import notify_users
+        from pharmacy.notifications import chat_message_event
+        from .models import Message
+        with transaction.atomic():
+            message = Message.objects.create(chat_room=self.room, sender_id=user.id, content=content)
+            # Other participants' dashboards hear about it via the outbox
+            notify_users(self.recipient_ids, chat_message_event(message.id, self.room.id, user.id))
+        return message
+
     def message_to_json(self, message):
-        from users.serializers import UserSerializer
         return {
             'id': message.id,
-            'room': message.chat_room.id,
-            'sender': UserSerializer(message.sender).data,
+            'room': self.room.id,
+            'sender': self.sender_payload,
             'content': message.content,
             'created_at': message.created_at.isoformat(),
             'is_read': message.is_read,
-        }
\ No newline at end of file
+        }
+
+    def provisional_message_json(self, user, content):
+        provisional_id = message_writer.enqueue(self.room.id, user.id, content, self.recipient_ids)
+        return {
+            'id': provisional_id,
+            'provisional_id': provisional_id,
+            'room': self.room.id,
+            'sender': self.sender_payload,
+            'content': content,
+            'created_at': timezone.now().isoformat(),
+            'is_read': False,
+        }
+
+
+class NotificationConsumer(BoundedSendMixin, AsyncWebsocketConsumer):
+    """
+    Per-user push channel: each authenticated socket joins the user's
+    notification group and receives compact order/prescription deltas sent
+    by pharmacy.notifications after commit.
+    """
+    async def connect(self):
+        self.group_name = None
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = notification_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self._outbound_shutdown()
+        if self.group_name is not None:
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notify(self, event):
+        await self.send(text_data=json.dumps(event['event']))
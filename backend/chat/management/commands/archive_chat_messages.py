@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_room_messages, inactive_room_ids
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the messages of chat rooms with no activity in the last --days days '
+        'to the archive table, in batches. The messages endpoint keeps serving '
+        'them; run it periodically (e.g. nightly) to keep the hot table small.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only list the rooms that would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        room_ids = list(inactive_room_ids(cutoff))
+        if options['dry_run']:
+            self.stdout.write(f'{len(room_ids)} rooms inactive since {cutoff:%Y-%m-%d}: {room_ids}')
+            return
+        total = 0
+        for room_id in room_ids:
+            moved = archive_room_messages(room_id, cutoff, options['batch_size'])
+            total += moved
+            self.stdout.write(f'Room {room_id}: archived {moved} messages')
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} messages from {len(room_ids)} rooms'))
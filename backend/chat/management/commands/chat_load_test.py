@@ -0,0 +1,185 @@
+import asyncio
+import json
+import random
+import resource
+import time
+from types import SimpleNamespace
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from chat.consumers import ChatConsumer
+from chat.outbound import outbound_metrics
+
+
+class LoadTestChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer scans every channel and group for expired entries on
+    each send and receive, which is quadratic in the connection count and
+    would swamp what is being measured. Scan at most once a second instead.
+    """
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - getattr(self, '_cleaned_at', 0) >= 1:
+            self._cleaned_at = now
+            super()._clean_expired()
+
+
+class LoadTestChatConsumer(ChatConsumer):
+    """
+    ChatConsumer with membership stubbed out, so the harness needs no database.
+    """
+
+    async def load_membership(self, user):
+        return SimpleNamespace(id=int(self.room_id)), {'id': user.id, 'username': f'user{user.id}'}, []
+
+
+class SimulatedClient:
+    def __init__(self, room_id, user_id, read_delay):
+        self.room_id = room_id
+        self.user = SimpleNamespace(id=user_id, is_authenticated=True)
+        self.read_delay = read_delay
+        self.inbound = asyncio.Queue()
+        self.latencies = []
+        self.resyncs = 0
+        self.closed = False
+
+    async def receive(self):
+        return await self.inbound.get()
+
+    async def send(self, message):
+        if message['type'] == 'websocket.close':
+            self.closed = True
+        elif message['type'] == 'websocket.send':
+            data = json.loads(message['text'])
+            if data.get('type') == 'resync':
+                self.resyncs += 1
+            elif 'sent_at' in data:
+                self.latencies.append(time.monotonic() - data['sent_at'])
+            if self.read_delay:
+                # A slow reader: the transport only takes the next frame later
+                await asyncio.sleep(self.read_delay)
+
+    def start(self, application):
+        scope = {
+            'type': 'websocket',
+            'path': f'/ws/chat/rooms/{self.room_id}/',
+            'url_route': {'kwargs': {'room_id': str(self.room_id)}},
+            'user': self.user,
+        }
+        self.inbound.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.get_running_loop().create_task(application(scope, self.receive, self.send))
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate many chat rooms with a share of slow readers on the in-memory '
+        'channel layer and report delivery latency, queue drops and memory per '
+        'connection count, to find the per-process connection ceiling.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', default='500,1000,2000,4000',
+                            help='Comma-separated connection counts to try in turn')
+        parser.add_argument('--clients-per-room', type=int, default=2)
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second per room')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per level')
+        parser.add_argument('--slow-fraction', type=float, default=0.05)
+        parser.add_argument('--slow-delay', type=float, default=2.0, help='Seconds a slow reader takes per frame')
+        parser.add_argument('--max-latency-ms', type=float, default=500.0,
+                            help='p99 delivery latency to fast readers, or event loop lag, above which a level fails')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"conns":>6} {"rooms":>6} {"delivered":>10} {"p50 ms":>8} {"p99 ms":>8} '
+            f'{"lag ms":>8} {"dropped":>8} {"resyncs":>8} {"closed":>7} {"rss MiB":>8}  result'
+        )
+        for connections in [int(count) for count in options['connections'].split(',')]:
+            with override_settings(CHANNEL_LAYERS={
+                'default': {'BACKEND': f'{__name__}.LoadTestChannelLayer', 'CONFIG': {'capacity': 1000}},
+            }):
+                row = asyncio.run(self.run_level(connections, options))
+            self.stdout.write(
+                '{connections:>6} {rooms:>6} {delivered:>10} {p50:>8.1f} {p99:>8.1f} {lag:>8.1f} '
+                '{dropped:>8} {resyncs:>8} {closed:>7} {rss:>8.1f}  {result}'.format(**row)
+            )
+            if row['result'] == 'FAIL':
+                break
+
+    async def run_level(self, connections, options):
+        outbound_metrics.reset()
+        layer = get_channel_layer()
+        application = LoadTestChatConsumer.as_asgi()
+        per_room = options['clients_per_room']
+        rooms = max(1, connections // per_room)
+        clients = [
+            SimulatedClient(
+                room_id=index // per_room + 1,
+                user_id=index + 1,
+                read_delay=options['slow_delay'] if random.random() < options['slow_fraction'] else 0,
+            )
+            for index in range(rooms * per_room)
+        ]
+        for client in clients:
+            client.start(application)
+        # Wait for every consumer to join its group
+        for _ in range(600):
+            if sum(len(members) for members in layer.groups.values()) >= len(clients):
+                break
+            await asyncio.sleep(0.05)
+
+        lag = [0.0]
+        stop = asyncio.Event()
+
+        async def monitor_loop_lag():
+            while not stop.is_set():
+                started = time.monotonic()
+                await asyncio.sleep(0.05)
+                lag[0] = max(lag[0], time.monotonic() - started - 0.05)
+
+        async def publish():
+            # Publish in 100ms ticks, one message per room every 1/rate seconds
+            per_tick = max(1, round(options['rate'] * rooms * 0.1))
+            deadline = time.monotonic() + options['duration']
+            room_id = 0
+            while time.monotonic() < deadline:
+                tick = time.monotonic()
+                for _ in range(per_tick):
+                    room_id = room_id % rooms + 1
+                    await layer.group_send(f'chat_{room_id}', {
+                        'type': 'chat_message',
+                        'message': {'room': room_id, 'content': 'load test', 'sent_at': time.monotonic()},
+                    })
+                await asyncio.sleep(max(0.0, 0.1 - (time.monotonic() - tick)))
+
+        monitor = asyncio.get_running_loop().create_task(monitor_loop_lag())
+        await publish()
+        await asyncio.sleep(1.0)  # drain fast readers
+        stop.set()
+        await monitor
+
+        fast = sorted(latency for client in clients if not client.read_delay for latency in client.latencies)
+        stats = outbound_metrics.snapshot()
+        p99 = fast[min(len(fast) - 1, int(len(fast) * 0.99))] * 1000 if fast else 0.0
+        row = {
+            'connections': len(clients),
+            'rooms': rooms,
+            'delivered': stats['sent'],
+            'p50': fast[len(fast) // 2] * 1000 if fast else 0.0,
+            'p99': p99,
+            'lag': lag[0] * 1000,
+            'dropped': stats['dropped'],
+            'resyncs': sum(client.resyncs for client in clients),
+            'closed': stats['disconnected_slow'],
+            'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'result': 'ok' if fast and max(p99, lag[0] * 1000) <= options['max_latency_ms'] else 'FAIL',
+        }
+
+        for client in clients:
+            client.inbound.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait([client.task for client in clients], timeout=5)
+        for client in clients:
+            client.task.cancel()
+        return row
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:59
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_pair_keys(apps, schema_editor):
+    """
+    Key every two-person room. Where a pair already has several rooms (from
+    earlier racing accepts), only the oldest is keyed and so becomes the one
+    that is reused; the others are left as they are.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Participant = ChatRoom.participants.through
+    rooms = ChatRoom.objects.annotate(size=Count('participants')).filter(size=2).order_by('id')
+    keyed = set()
+    for room in rooms.iterator():
+        low, high = sorted(
+            Participant.objects.filter(chatroom_id=room.id).values_list('user_id', flat=True)
+        )
+        pair_key = f'{low}:{high}'
+        if pair_key in keyed:
+            continue
+        keyed.add(pair_key)
+        room.pair_key = pair_key
+        room.save(update_fields=['pair_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_chat_read_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='pair_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_pair_keys, migrations.RunPython.noop),
+    ]
@@ -1,14 +1,42 @@
-from django.db import models
+from django.db import models, transaction
 from users.models import User
 
 class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms')
+    # "<lower user id>:<higher user id>" for two-person rooms; unique, so a pair
+    # has at most one room and finding it is a single index lookup
+    pair_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
+    # Set once messages of the room have been moved to ArchivedMessage
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Chat Room {self.id}"
 
+    @staticmethod
+    def pair_key_for(user_id, other_user_id):
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return f'{low}:{high}'
+
+    @classmethod
+    def get_or_create_for_pair(cls, user, other_user):
+        """
+        Return (room, created) for the two users' room, creating it with both
+        participants if needed. Safe against concurrent callers: the unique
+        pair_key makes a racing insert fail and fall back to the winner's room,
+        which is committed together with its participants.
+        """
+        pair_key = cls.pair_key_for(user.id, other_user.id)
+        room = cls.objects.filter(pair_key=pair_key).first()
+        if room is not None:
+            return room, False
+        with transaction.atomic():
+            room, created = cls.objects.get_or_create(pair_key=pair_key)
+            if created:
+                room.participants.add(user, other_user)
+        return room, created
+
 class Message(models.Model):
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
@@ -16,5 +44,55 @@ class Message(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a room's history (see chat.pagination)
+            models.Index(fields=['chat_room', 'created_at', 'id'], name='message_room_created_idx'),
+            # Unread counts: messages past a read watermark (see chat.read_state)
+            models.Index(fields=['chat_room', 'id'], name='message_room_id_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.email} in Room {self.chat_room.id}"
+
+class ArchivedMessage(models.Model):
+    """
+    A message of an inactive room, moved out of Message by the
+    archive_chat_messages command so the hot table and its indexes only hold
+    live conversations. Rows keep their original id and created_at, and a
+    room's archived messages are always older than its hot ones, so history
+    reads simply continue from one table into the other.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archived_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_sent_messages')
+    content = models.TextField()
+    created_at = models.DateTimeField()
+    is_read = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat_room', 'created_at', 'id'], name='archived_msg_room_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.id} in Room {self.chat_room_id}"
+
+class ChatReadState(models.Model):
+    """
+    How far a participant has read a room: every message with an id up to
+    last_read_message_id counts as read for them.
+    """
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_read_states')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['chat_room', 'user'], name='chat_read_state_room_user_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} read Room {self.chat_room_id} up to {self.last_read_message_id}"
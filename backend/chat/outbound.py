@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+class OutboundMetrics:
+    """
+    Process-wide counters for WebSocket outbound queues.
+    """
+    LATENCY_SAMPLES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = 0
+            self.queued = 0
+            self.max_depth = 0
+            self.enqueued = 0
+            self.sent = 0
+            self.coalesced = 0
+            self.dropped = 0
+            self.disconnected_slow = 0
+            self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+
+    def record(self, **changes):
+        with self._lock:
+            for name, delta in changes.items():
+                setattr(self, name, getattr(self, name) + delta)
+            self.max_depth = max(self.max_depth, self.queued)
+
+    def record_sent(self, latency):
+        with self._lock:
+            self.sent += 1
+            self.queued -= 1
+            self._latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'connections': self.connections,
+                'queued': self.queued,
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+                'disconnected_slow': self.disconnected_slow,
+            }
+        stats['send_latency_ms'] = {
+            'p50': _percentile(latencies, 0.50) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+        }
+        return stats
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+outbound_metrics = OutboundMetrics()
+
+
+class BoundedSendMixin:
+    """
+    Gives a WebSocket consumer a bounded outbound queue.
+
+    send() enqueues the frame and returns at once; a per-connection task
+    writes frames to the socket in order. Group events therefore never wait
+    on a slow client, and what a slow client can hold back is bounded:
+
+    - frames sent with a coalesce_key replace a queued frame with the same
+      key (e.g. a newer read receipt from the same user);
+    - when the queue holds CHAT_OUTBOUND_QUEUE_SIZE frames the oldest one is
+      dropped, and the client is sent {"type": "resync", "dropped": n} ahead
+      of the next frame so it can reload what it missed over HTTP;
+    - after CHAT_OUTBOUND_MAX_DROPS drops the connection is closed (code
+      4008), since the client is not keeping up at all.
+
+    Handshake frames (accept/close) bypass the queue.
+    """
+    SLOW_CONSUMER_CLOSE_CODE = 4008
+
+    def _outbound_setup(self):
+        if getattr(self, '_outbound', None) is None:
+            self._outbound = OrderedDict()
+            self._outbound_ready = asyncio.Event()
+            self._outbound_dropped = 0
+            self._outbound_pending_resync = 0
+            self._outbound_sequence = 0
+            self._outbound_task = asyncio.get_running_loop().create_task(self._outbound_writer())
+            outbound_metrics.record(connections=1)
+
+    async def send(self, text_data=None, bytes_data=None, close=False, coalesce_key=None):
+        if close or getattr(self, '_outbound_closed', False):
+            return await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        self._outbound_setup()
+        if coalesce_key is not None and coalesce_key in self._outbound:
+            enqueued_at = self._outbound[coalesce_key][0]
+            self._outbound[coalesce_key] = (enqueued_at, text_data, bytes_data)
+            outbound_metrics.record(coalesced=1)
+            return
+        if len(self._outbound) >= settings.CHAT_OUTBOUND_QUEUE_SIZE:
+            self._outbound.popitem(last=False)
+            self._outbound_dropped += 1
+            self._outbound_pending_resync += 1
+            outbound_metrics.record(dropped=1, queued=-1)
+            if self._outbound_dropped >= settings.CHAT_OUTBOUND_MAX_DROPS:
+                outbound_metrics.record(disconnected_slow=1)
+                await self._outbound_shutdown()
+                await self.close(code=self.SLOW_CONSUMER_CLOSE_CODE)
+                return
+        if coalesce_key is None:
+            self._outbound_sequence += 1
+            coalesce_key = ('frame', self._outbound_sequence)
+        self._outbound[coalesce_key] = (time.monotonic(), text_data, bytes_data)
+        outbound_metrics.record(enqueued=1, queued=1)
+        self._outbound_ready.set()
+
+    async def _outbound_writer(self):
+        while True:
+            await self._outbound_ready.wait()
+            while self._outbound:
+                if self._outbound_pending_resync:
+                    dropped, self._outbound_pending_resync = self._outbound_pending_resync, 0
+                    await super().send(text_data=json.dumps({'type': 'resync', 'dropped': dropped}))
+                    continue
+                _, (enqueued_at, text_data, bytes_data) = self._outbound.popitem(last=False)
+                await super().send(text_data=text_data, bytes_data=bytes_data)
+                outbound_metrics.record_sent(time.monotonic() - enqueued_at)
+            self._outbound_ready.clear()
+
+    async def _outbound_shutdown(self):
+        """
+        Stop the writer and discard unsent frames; call on disconnect.
+        """
+        self._outbound_closed = True
+        if getattr(self, '_outbound', None) is None:
+            return
+        self._outbound_task.cancel()
+        outbound_metrics.record(connections=-1, queued=-len(self._outbound))
+        self._outbound.clear()
+        self._outbound = None
@@ -0,0 +1,120 @@
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over a room's messages on (created_at, id), newest first.
+
+    `next` pages towards older messages (?before=<cursor>) and `previous`
+    towards newer ones (?after=<cursor>); each page is one range scan of the
+    (chat_room, created_at, id) index, however deep into the history it is.
+
+    Messages can come from several querysets (e.g. hot and archived storage):
+    each is scanned for one page with the same cursor and the results merged,
+    so a page may span both.
+    """
+    before_query_param = 'before'
+    after_query_param = 'after'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None, extra_querysets=()):
+        self.request = request
+        page_size = self.get_page_size(request)
+        before = self.decode_cursor(request, self.before_query_param)
+        after = self.decode_cursor(request, self.after_query_param)
+
+        windows = [
+            list(self.window(candidates, before, after)[:page_size + 1])
+            for candidates in (queryset, *extra_querysets)
+        ]
+        if len(windows) == 1:
+            page = windows[0]
+        else:
+            page = list(heapq.merge(
+                *windows, key=lambda message: (message.created_at, message.id), reverse=after is None
+            ))[:page_size + 1]
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if after is not None:
+            page.reverse()
+            self.has_newer, self.has_older = has_more, True
+        else:
+            self.has_newer, self.has_older = before is not None, has_more
+        self.page = page
+        return page
+
+    def window(self, queryset, before, after):
+        if after is not None:
+            created_at, pk = after
+            return queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')
+        if before is not None:
+            created_at, pk = before
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        return queryset.order_by('-created_at', '-id')
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request, param):
+        encoded = request.query_params.get(param)
+        if encoded is None:
+            return None
+        try:
+            created_at, pk = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def encode_cursor(self, message, param):
+        encoded = urlsafe_b64encode(
+            json.dumps([message.created_at.isoformat(), message.id]).encode('ascii')
+        ).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.before_query_param)
+        url = remove_query_param(url, self.after_query_param)
+        return replace_query_param(url, param, encoded)
+
+    def get_next_link(self):
+        if not self.has_older or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], self.before_query_param)
+
+    def get_previous_link(self):
+        if not self.has_newer or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], self.after_query_param)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class PresenceRegistry:
+    """
+    Process-local presence and typing state for chat rooms; never persisted.
+
+    Each room maps user ids to [open sockets, typing until, last typing
+    broadcast] (monotonic seconds). Presence changes are reported only when
+    a user's first socket in a room opens or the last one closes, so extra
+    tabs cost nothing. Typing expires CHAT_TYPING_TTL seconds after the last
+    keystroke frame, and at most one typing broadcast per user and room is
+    allowed every CHAT_TYPING_INTERVAL seconds; everything in between only
+    extends the expiry. Entries go away with the user's last socket.
+
+    The registry only knows the sockets of this process; presence and
+    typing events themselves reach every process through the room group.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._rooms = {}
+
+    def connect(self, room_id, user_id):
+        """
+        Count a socket for user in room; return True if they just came online.
+        """
+        with self._lock:
+            entry = self._rooms.setdefault(room_id, {}).setdefault(user_id, [0, 0.0, 0.0])
+            entry[0] += 1
+            return entry[0] == 1
+
+    def disconnect(self, room_id, user_id):
+        """
+        Forget a socket for user in room; return True if they just went offline.
+        """
+        with self._lock:
+            room = self._rooms.get(room_id, {})
+            entry = room.get(user_id)
+            if entry is None:
+                return False
+            entry[0] -= 1
+            if entry[0] > 0:
+                return False
+            del room[user_id]
+            if not room:
+                del self._rooms[room_id]
+            return True
+
+    def online(self, room_id):
+        with self._lock:
+            return sorted(self._rooms.get(room_id, {}))
+
+    def typing(self, room_id, user_id, is_typing=True, now=None):
+        """
+        Record a typing (or stopped typing) frame; return True if it should be
+        broadcast.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._rooms.get(room_id, {}).get(user_id)
+            if entry is None:
+                return False
+            was_typing = entry[1] > now
+            entry[1] = now + settings.CHAT_TYPING_TTL if is_typing else 0.0
+            if not is_typing and not was_typing:
+                return False
+            if now - entry[2] < settings.CHAT_TYPING_INTERVAL:
+                # Rate limited. Continued typing was announced recently enough
+                # for clients to still show it; a stop is left to expire there.
+                return False
+            entry[2] = now
+            return True
+
+    def clear_typing(self, room_id, user_id):
+        """
+        Drop typing state, e.g. once the user's message is sent; clients clear
+        the indicator when the message arrives.
+        """
+        with self._lock:
+            entry = self._rooms.get(room_id, {}).get(user_id)
+            if entry is not None:
+                entry[1] = 0.0
+
+    def typing_users(self, room_id, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return sorted(user_id for user_id, entry in self._rooms.get(room_id, {}).items() if entry[1] > now)
+
+
+presence_registry = PresenceRegistry()
@@ -0,0 +1,63 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import ArchivedMessage, ChatReadState, Message
+
+
+def mark_read(room_id, user_id, message_id=None):
+    """
+    Move the user's read watermark in the room forward to message_id (or to
+    the room's latest message) and return the resulting watermark.
+
+    The watermark never moves backwards and never past the room's latest
+    message; this is one indexed MAX lookup and one single-row upsert,
+    whatever the size of the room.
+    """
+    latest = Message.objects.filter(chat_room_id=room_id).aggregate(latest=Max('id'))['latest']
+    if latest is None:
+        # Nothing hot: the room may be fully archived
+        latest = ArchivedMessage.objects.filter(chat_room_id=room_id).aggregate(latest=Max('id'))['latest'] or 0
+    message_id = latest if message_id is None else min(int(message_id), latest)
+
+    updated = ChatReadState.objects.filter(chat_room_id=room_id, user_id=user_id).update(
+        last_read_message_id=Greatest('last_read_message_id', message_id),
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                ChatReadState.objects.create(chat_room_id=room_id, user_id=user_id, last_read_message_id=message_id)
+        except IntegrityError:
+            # A concurrent request created it first
+            return mark_read(room_id, user_id, message_id)
+        return message_id
+    return ChatReadState.objects.filter(
+        chat_room_id=room_id, user_id=user_id
+    ).values_list('last_read_message_id', flat=True).get()
+
+
+def read_watermark(user, room=OuterRef('pk')):
+    """
+    Expression for the user's watermark in room (0 when nothing is read).
+    """
+    return Coalesce(
+        Subquery(
+            ChatReadState.objects.filter(chat_room=room, user=user).values('last_read_message_id')[:1],
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def unread_count(user, room=OuterRef('pk'), watermark=OuterRef('last_read_message_id')):
+    """
+    Expression counting messages from others past the watermark, a range scan
+    of the (chat_room, id) index. By default both room and watermark refer to
+    the outer queryset (a room annotated with `last_read_message_id`).
+    """
+    unread = Message.objects.filter(
+        chat_room=room, id__gt=watermark
+    ).exclude(sender=user).order_by().values('chat_room').annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(unread, output_field=IntegerField()), 0)
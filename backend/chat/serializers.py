@@ -1,14 +1,50 @@
 from rest_framework import serializers
 from .models import ChatRoom, Message
+from users.models import User
 from users.serializers import UserSerializer
 
+class MessageSenderField(serializers.Field):
+    """
+    Serializes the sender with UserSerializer, reusing the per-page sender
+    cache set up by MessageListSerializer when there is one.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, message):
+        senders = self.context.get('senders')
+        if senders is not None and message.sender_id in senders:
+            return senders[message.sender_id]
+        return UserSerializer(message.sender).data
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """
+    Loads and serializes each distinct sender once for the whole list, instead
+    of once per message.
+    """
+
+    def to_representation(self, data):
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        sender_ids = {message.sender_id for message in messages}
+        users = User.objects.filter(id__in=sender_ids).select_related('pharmacy_profile', 'patient_profile')
+        self.context['senders'] = {user.id: UserSerializer(user).data for user in users}
+        return super().to_representation(messages)
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
-    
+    sender = MessageSenderField()
+
     class Meta:
         model = Message
         fields = '__all__'
         read_only_fields = ('sender', 'chat_room')
+        list_serializer_class = MessageListSerializer
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
@@ -16,4 +52,42 @@ class ChatRoomSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ChatRoom
-        fields = '__all__' 
\ No newline at end of file
+        fields = '__all__'
+
+
+class ChatParticipantSerializer(serializers.ModelSerializer):
+    business_name = serializers.CharField(source='pharmacy_profile.business_name', default=None, read_only=True)
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name', 'user_type', 'business_name')
+
+
+class ChatRoomListSerializer(serializers.ModelSerializer):
+    """
+    Room summary for the chat dashboard: participants, a preview of the last
+    message and the unread count, read from annotations added by
+    ChatRoomViewSet.get_queryset(); the history itself is served by the
+    messages endpoint.
+    """
+    participants = ChatParticipantSerializer(many=True, read_only=True)
+    last_message = serializers.SerializerMethodField()
+    last_read_message_id = serializers.IntegerField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = ChatRoom
+        fields = (
+            'id', 'participants', 'last_message', 'last_read_message_id', 'unread_count',
+            'created_at', 'updated_at',
+        )
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'sender': obj.last_message_sender_id,
+            'content': obj.last_message_content,
+            'created_at': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
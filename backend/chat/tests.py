@@ -1,3 +1,539 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.auth import AuthMiddlewareStack
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from medconnect.ws_auth import JWTAuthMiddleware
+from pharmacy.notifications import push_notification
+from users.models import User
+from .models import ChatReadState, ChatRoom, Message
+from .outbound import BoundedSendMixin, outbound_metrics
+from .pagination import MessageCursorPagination
+from .presence import PresenceRegistry, presence_registry
+from .routing import websocket_urlpatterns
+
+
+def create_user(username, user_type='patient'):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='testpass123',
+        user_type=user_type, first_name=username.title(), last_name='Test',
+    )
+
+
+class ChatRoomListTests(TestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def create_room(self, messages):
+        room = ChatRoom.objects.create()
+        room.participants.add(self.patient, self.pharmacist)
+        for sender, content in messages:
+            Message.objects.create(chat_room=room, sender=sender, content=content)
+        return room
+
+    def test_lists_summary_without_history(self):
+        room = self.create_room([
+            (self.patient, 'Hello'),
+            (self.pharmacist, 'Your order is ready'),
+            (self.pharmacist, 'Pick it up today'),
+        ])
+        response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()[0]
+        self.assertEqual(data['id'], room.id)
+        self.assertNotIn('messages', data)
+        self.assertEqual(data['last_message']['content'], 'Pick it up today')
+        self.assertEqual(data['last_message']['sender'], self.pharmacist.id)
+        self.assertEqual(data['unread_count'], 2)
+        self.assertEqual(
+            sorted(participant['user_type'] for participant in data['participants']),
+            ['patient', 'pharmacy']
+        )
+
+    def test_query_count_does_not_grow_with_rooms_or_messages(self):
+        self.create_room([(self.pharmacist, 'Hi')])
+        with self.assertNumQueries(2):
+            self.client.get('/api/chat/rooms/')
+        for _ in range(5):
+            self.create_room([(self.pharmacist, f'Message {index}') for index in range(10)])
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/chat/rooms/')
+        self.assertEqual(len(response.json()), 6)
+
+
+class ReadWatermarkTests(TestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.patient, self.pharmacist)
+        self.messages = [
+            Message.objects.create(chat_room=self.room, sender=self.pharmacist, content=f'Message {index}')
+            for index in range(4)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def unread(self):
+        return self.client.get('/api/chat/rooms/').json()[0]['unread_count']
+
+    def test_mark_read_moves_watermark_forward_only(self):
+        url = f'/api/chat/rooms/{self.room.id}/read/'
+        self.assertEqual(self.unread(), 4)
+
+        response = self.client.post(url, {'message_id': self.messages[1].id})
+        self.assertEqual(response.json()['last_read_message_id'], self.messages[1].id)
+        self.assertEqual(self.unread(), 2)
+
+        response = self.client.post(url, {'message_id': self.messages[0].id})
+        self.assertEqual(response.json()['last_read_message_id'], self.messages[1].id)
+
+        response = self.client.post(url)
+        self.assertEqual(response.json()['last_read_message_id'], self.messages[-1].id)
+        self.assertEqual(self.unread(), 0)
+
+    def test_watermark_is_clamped_to_latest_message(self):
+        self.client.post(f'/api/chat/rooms/{self.room.id}/read/', {'message_id': 10 ** 12})
+        later = Message.objects.create(chat_room=self.room, sender=self.pharmacist, content='Later')
+        self.assertEqual(self.unread(), 1)
+        self.assertEqual(
+            ChatReadState.objects.get(chat_room=self.room, user=self.patient).last_read_message_id,
+            self.messages[-1].id
+        )
+        self.assertLess(self.messages[-1].id, later.id)
+
+    def test_total_unread_across_rooms(self):
+        other = ChatRoom.objects.create()
+        other.participants.add(self.patient, self.pharmacist)
+        Message.objects.create(chat_room=other, sender=self.pharmacist, content='Hi')
+        Message.objects.create(chat_room=other, sender=self.patient, content='Own message')
+        self.assertEqual(self.client.get('/api/chat/rooms/unread-count/').json(), {'count': 5})
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.patient, self.pharmacist)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.url = f'/api/chat/rooms/{self.room.id}/messages/'
+
+    def add_messages(self, count):
+        senders = (self.patient, self.pharmacist)
+        Message.objects.bulk_create(
+            Message(chat_room=self.room, sender=senders[index % 2], content=f'Message {index}')
+            for index in range(count)
+        )
+
+    def test_pages_walk_history_newest_first(self):
+        self.add_messages(25)
+        expected = list(self.room.messages.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, url, params = [], self.url, {'page_size': 10}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(message['id'] for message in response.json()['results'])
+            url, params = response.json()['next'], None
+        self.assertEqual(seen, expected)
+
+        # Walking back towards newer messages from the last page
+        previous = response.json()['previous']
+        response = self.client.get(previous)
+        self.assertEqual([message['id'] for message in response.json()['results']], expected[10:20])
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_messages(60)
+        # Room lookup, message page and senders
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'page_size': 50})
+        results = response.json()['results']
+        self.assertEqual(len(results), 50)
+        self.assertEqual(results[0]['sender']['username'], 'pharmacist')
+
+    def test_page_size_is_capped(self):
+        self.add_messages(MessageCursorPagination.max_page_size + 5)
+        response = self.client.get(self.url, {'page_size': 100000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), MessageCursorPagination.max_page_size)
+        self.assertIsNotNone(response.json()['next'])
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.patient, self.pharmacist)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.url = f'/api/chat/rooms/{self.room.id}/messages/'
+
+    def add_messages(self, room, count, days_ago=0):
+        start = timezone.now() - timedelta(days=days_ago)
+        for index in range(count):
+            message = Message.objects.create(chat_room=room, sender=self.pharmacist, content=f'Message {index}')
+            Message.objects.filter(pk=message.pk).update(created_at=start + timedelta(seconds=index))
+
+    def test_archives_inactive_rooms_in_batches(self):
+        self.add_messages(self.room, 7, days_ago=200)
+        active = ChatRoom.objects.create()
+        active.participants.add(self.patient, self.pharmacist)
+        self.add_messages(active, 2, days_ago=200)
+        self.add_messages(active, 1)
+        ids = list(self.room.messages.values_list('id', flat=True))
+
+        call_command('archive_chat_messages', days=90, batch_size=3, stdout=StringIO())
+        self.room.refresh_from_db()
+        self.assertIsNotNone(self.room.archived_at)
+        self.assertFalse(self.room.messages.exists())
+        self.assertEqual(sorted(self.room.archived_messages.values_list('id', flat=True)), sorted(ids))
+        self.assertEqual(active.messages.count(), 3)
+        self.assertFalse(active.archived_messages.exists())
+
+    def test_history_reads_across_hot_and_archived_messages(self):
+        self.add_messages(self.room, 15, days_ago=200)
+        call_command('archive_chat_messages', days=90, stdout=StringIO())
+        self.add_messages(self.room, 8)
+        expected = list(self.room.messages.order_by('-created_at', '-id').values_list('id', flat=True))
+        expected += list(self.room.archived_messages.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, url, params = [], self.url, {'page_size': 5}
+        while url:
+            response = self.client.get(url, params)
+            seen.extend(message['id'] for message in response.json()['results'])
+            url, params = response.json()['next'], None
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get(response.json()['previous']).json()['results'][0]['id'], expected[15])
+
+        streamed = self.client.get(self.url, {'stream': 1})
+        self.assertEqual([message['id'] for message in json.loads(b''.join(streamed.streaming_content))], expected)
+
+    def test_fully_archived_room_keeps_its_summary(self):
+        self.add_messages(self.room, 3, days_ago=200)
+        last_id = self.room.messages.latest('id').id
+        call_command('archive_chat_messages', days=90, stdout=StringIO())
+        room = self.client.get('/api/chat/rooms/').json()[0]
+        self.assertEqual(room['last_message']['id'], last_id)
+        response = self.client.post(f'/api/chat/rooms/{self.room.id}/read/')
+        self.assertEqual(response.json(), {'last_read_message_id': last_id})
+
+
+class PairRoomTests(TransactionTestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+
+    def test_same_room_whichever_order(self):
+        room, created = ChatRoom.get_or_create_for_pair(self.patient, self.pharmacist)
+        self.assertTrue(created)
+        self.assertEqual(set(room.participants.all()), {self.patient, self.pharmacist})
+        with self.assertNumQueries(1):
+            again, created = ChatRoom.get_or_create_for_pair(self.pharmacist, self.patient)
+        self.assertFalse(created)
+        self.assertEqual(again, room)
+
+    def test_concurrent_callers_share_one_room(self):
+        barrier = threading.Barrier(8)
+        rooms = []
+
+        def get_room():
+            try:
+                barrier.wait()
+                rooms.append(ChatRoom.get_or_create_for_pair(self.patient, self.pharmacist)[0].id)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=get_room) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(rooms), 8)
+        self.assertEqual(len(set(rooms)), 1)
+        self.assertEqual(ChatRoom.objects.count(), 1)
+        self.assertEqual(ChatRoom.objects.get().participants.count(), 2)
+
+
+async def connect_to_room(room, user):
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/rooms/{room.id}/')
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    if connected:
+        # Every socket opens with a presence snapshot
+        snapshot = await communicator.receive_json_from()
+        assert snapshot['type'] == 'presence', snapshot
+    return communicator, connected
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.patient, self.pharmacist)
+
+    async def test_rejects_non_participants(self):
+        outsider = await database_sync_to_async(create_user)('outsider')
+        communicator, connected = await connect_to_room(self.room, outsider)
+        self.assertFalse(connected)
+        communicator, connected = await connect_to_room(self.room, AnonymousUser())
+        self.assertFalse(connected)
+
+    async def test_read_event_moves_watermark_and_notifies_room(self):
+        message = await Message.objects.acreate(chat_room=self.room, sender=self.pharmacist, content='Hi')
+        patient, _ = await connect_to_room(self.room, self.patient)
+        pharmacist, _ = await connect_to_room(self.room, self.pharmacist)
+        await patient.send_json_to({'type': 'read'})
+        event = await pharmacist.receive_json_from()
+        self.assertEqual(event, {'type': 'read', 'user': self.patient.id, 'last_read_message_id': message.id})
+        state = await ChatReadState.objects.aget(chat_room=self.room, user=self.patient)
+        self.assertEqual(state.last_read_message_id, message.id)
+        await patient.disconnect()
+        await pharmacist.disconnect()
+
+    async def test_presence_and_typing_are_broadcast_without_database_writes(self):
+        patient, _ = await connect_to_room(self.room, self.patient)
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/rooms/{self.room.id}/')
+        communicator.scope['user'] = self.pharmacist
+        await communicator.connect()
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot, {
+            'type': 'presence', 'online': sorted([self.patient.id, self.pharmacist.id]), 'typing': [],
+        })
+        self.assertEqual(
+            await patient.receive_json_from(),
+            {'type': 'presence', 'user': self.pharmacist.id, 'status': 'online'},
+        )
+
+        # A burst of keystroke frames is one broadcast, not echoed to the typist
+        for _ in range(5):
+            await communicator.send_json_to({'type': 'typing'})
+        self.assertEqual(await patient.receive_json_from(), {
+            'type': 'typing', 'user': self.pharmacist.id, 'typing': True, 'expires_in': 6.0,
+        })
+        self.assertTrue(await patient.receive_nothing(timeout=0.2))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.1))
+
+        await communicator.disconnect()
+        self.assertEqual(
+            await patient.receive_json_from(),
+            {'type': 'presence', 'user': self.pharmacist.id, 'status': 'offline'},
+        )
+        await patient.disconnect()
+        self.assertEqual(presence_registry.online(self.room.id), [])
+        self.assertFalse(await Message.objects.aexists())
+
+    def test_sending_a_message_is_two_inserts(self):
+        # Thread-sensitive database work runs on this thread's connection
+        queries = CaptureQueriesContext(connections['default'])
+
+        async def scenario():
+            communicator, connected = await connect_to_room(self.room, self.patient)
+            self.assertTrue(connected)
+            await communicator.send_json_to({'content': 'Hello'})
+            await communicator.receive_json_from()
+
+            await sync_to_async(queries.__enter__)()
+            await communicator.send_json_to({'content': 'Second'})
+            event = await communicator.receive_json_from()
+            await sync_to_async(queries.__exit__)(None, None, None)
+            await communicator.disconnect()
+            return event
+
+        event = async_to_sync(scenario)()
+        self.assertEqual(event['content'], 'Second')
+        self.assertEqual(event['sender']['username'], 'patient')
+        # The message and, atomically with it, its outbox notification for the pharmacist
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['BEGIN', 'INSERT', 'INSERT', 'COMMIT'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+
+    def application(self):
+        return AuthMiddlewareStack(JWTAuthMiddleware(URLRouter(websocket_urlpatterns)))
+
+    async def test_token_authenticated_socket_receives_own_events(self):
+        token = str(AccessToken.for_user(self.patient))
+        communicator = WebsocketCommunicator(self.application(), f'/ws/notifications/?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await sync_to_async(push_notification)([self.patient.id], {'type': 'order', 'id': 1, 'status': 'shipped'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'order', 'id': 1, 'status': 'shipped'})
+        await communicator.disconnect()
+
+    async def test_rejects_anonymous_and_invalid_tokens(self):
+        for path in ('/ws/notifications/', '/ws/notifications/?token=not-a-token'):
+            communicator = WebsocketCommunicator(self.application(), path)
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+
+@override_settings(
+    CHAT_WRITE_BEHIND=True,
+    CHAT_WRITE_BEHIND_BATCH_SIZE=3,
+    CHAT_WRITE_BEHIND_FLUSH_INTERVAL=0.01,
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class WriteBehindTests(TransactionTestCase):
+    def setUp(self):
+        self.patient = create_user('patient')
+        self.pharmacist = create_user('pharmacist', user_type='pharmacy')
+        self.room = ChatRoom.objects.create()
+        self.room.participants.add(self.patient, self.pharmacist)
+
+    async def connect(self, user):
+        communicator, connected = await connect_to_room(self.room, user)
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_broadcasts_provisionally_then_persists_in_order(self):
+        communicator = await self.connect(self.patient)
+        for index in range(7):
+            await communicator.send_json_to({'content': f'Message {index}'})
+
+        # Broadcasts and persisted notifications interleave as batches are written
+        provisional_ids, persisted = [], {}
+        while len(provisional_ids) < 7 or len(persisted) < 7:
+            event = await communicator.receive_json_from()
+            if event.get('type') == 'messages_persisted':
+                # Batches are bounded by CHAT_WRITE_BEHIND_BATCH_SIZE
+                self.assertLessEqual(len(event['messages']), 3)
+                persisted.update((item['provisional_id'], item['id']) for item in event['messages'])
+            else:
+                self.assertEqual(event['content'], f'Message {len(provisional_ids)}')
+                self.assertTrue(event['id'].startswith('tmp-'))
+                provisional_ids.append(event['provisional_id'])
+
+        stored = [
+            (message.id, message.content) async for message in
+            Message.objects.filter(chat_room=self.room).order_by('id')
+        ]
+        self.assertEqual([content for _, content in stored], [f'Message {index}' for index in range(7)])
+        self.assertEqual([persisted[provisional_id] for provisional_id in provisional_ids], [pk for pk, _ in stored])
+        await communicator.disconnect()
+
+    async def test_disconnect_flushes_buffered_messages(self):
+        communicator = await self.connect(self.patient)
+        await communicator.send_json_to({'content': 'Last words'})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        self.assertTrue(await Message.objects.filter(chat_room=self.room, content='Last words').aexists())
+
+
+@override_settings(CHAT_TYPING_INTERVAL=3.0, CHAT_TYPING_TTL=6.0)
+class PresenceRegistryTests(TestCase):
+    def setUp(self):
+        self.registry = PresenceRegistry()
+
+    def test_presence_changes_on_first_and_last_socket(self):
+        self.assertTrue(self.registry.connect(1, 10))
+        self.assertFalse(self.registry.connect(1, 10))
+        self.assertEqual(self.registry.online(1), [10])
+        self.assertFalse(self.registry.disconnect(1, 10))
+        self.assertTrue(self.registry.disconnect(1, 10))
+        self.assertEqual(self.registry.online(1), [])
+        self.assertFalse(self.registry.disconnect(1, 10))
+
+    def test_typing_is_rate_limited_and_expires(self):
+        self.registry.connect(1, 10)
+        self.assertTrue(self.registry.typing(1, 10, now=100.0))
+        self.assertFalse(self.registry.typing(1, 10, now=101.0))
+        self.assertFalse(self.registry.typing(1, 10, is_typing=False, now=102.0))
+        # Restarting within the interval is not announced again
+        self.assertFalse(self.registry.typing(1, 10, now=102.5))
+        self.assertEqual(self.registry.typing_users(1, now=108.0), [10])
+        self.assertEqual(self.registry.typing_users(1, now=108.6), [])
+        # Still typing after the interval: a keep-alive broadcast
+        self.assertTrue(self.registry.typing(1, 10, now=103.0))
+        self.assertTrue(self.registry.typing(1, 10, is_typing=False, now=106.0))
+        self.assertFalse(self.registry.typing(1, 10, is_typing=False, now=110.0))
+
+    def test_ignores_users_without_a_socket(self):
+        self.assertFalse(self.registry.typing(1, 10, now=100.0))
+        self.assertEqual(self.registry.typing_users(1, now=100.0), [])
+
+
+class StalledSocket(BoundedSendMixin, AsyncWebsocketConsumer):
+    """
+    A consumer whose transport takes no frames until released.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.released = asyncio.Event()
+        self.frames = []
+
+        async def base_send(message):
+            await self.released.wait()
+            self.frames.append(message)
+        self.base_send = base_send
+
+
+@override_settings(CHAT_OUTBOUND_QUEUE_SIZE=3, CHAT_OUTBOUND_MAX_DROPS=10)
+class BoundedSendTests(TestCase):
+    def setUp(self):
+        outbound_metrics.reset()
+
+    async def drain(self, socket, count):
+        socket.released.set()
+        while len(socket.frames) < count:
+            await asyncio.sleep(0.01)
+        return [json.loads(frame['text']) for frame in socket.frames]
+
+    async def test_slow_client_drops_oldest_and_gets_resync(self):
+        socket = StalledSocket()
+        await socket.send(text_data=json.dumps({'n': 0}))
+        await asyncio.sleep(0)
+        for index in range(1, 6):
+            await socket.send(text_data=json.dumps({'n': index}))
+        # Frame 0 is already with the stalled transport; 1 and 2 were dropped
+        frames = await self.drain(socket, 5)
+        self.assertEqual(frames, [{'n': 0}, {'type': 'resync', 'dropped': 2}, {'n': 3}, {'n': 4}, {'n': 5}])
+        self.assertEqual(outbound_metrics.snapshot()['dropped'], 2)
+        await socket._outbound_shutdown()
+
+    async def test_coalesced_frames_replace_queued_frame(self):
+        socket = StalledSocket()
+        await socket.send(text_data=json.dumps({'n': 0}))
+        await asyncio.sleep(0)
+        for message_id in (1, 2, 3):
+            await socket.send(text_data=json.dumps({'read': message_id}), coalesce_key=('read', 7))
+        frames = await self.drain(socket, 2)
+        self.assertEqual(frames, [{'n': 0}, {'read': 3}])
+        self.assertEqual(outbound_metrics.snapshot()['coalesced'], 2)
+        await socket._outbound_shutdown()
+
+    async def test_client_that_never_reads_is_closed(self):
+        socket = StalledSocket()
+        socket.close = mock.AsyncMock()
+        for index in range(13):
+            await socket.send(text_data=json.dumps({'n': index}))
+        socket.close.assert_awaited_once_with(code=BoundedSendMixin.SLOW_CONSUMER_CLOSE_CODE)
+        self.assertEqual(outbound_metrics.snapshot()['disconnected_slow'], 1)
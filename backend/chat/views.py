@@ -1,13 +1,25 @@
+from itertools import chain
+
+from django.db import transaction
 from django.shortcuts import render
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import ChatRoom, Message
-from .serializers import ChatRoomSerializer, MessageSerializer
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from users.models import User
+from .models import ArchivedMessage, ChatRoom, Message
+from .serializers import ChatRoomSerializer, ChatRoomListSerializer, MessageSerializer
+from .pagination import MessageCursorPagination
+from .read_state import mark_read, read_watermark, unread_count
+from .outbound import outbound_metrics
+from outbox.events import notify_users
+from pharmacy.notifications import chat_message_event
+from medconnect.streaming import StreamingListMixin, iter_serialized, stream_requested, streaming_json_response
 
 # Create your views here.
 
-class ChatRoomViewSet(viewsets.ModelViewSet):
+class ChatRoomViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = ChatRoom.objects.all()
     serializer_class = ChatRoomSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -17,21 +29,112 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             return ChatRoom.objects.none()
         if not self.request.user.is_authenticated:
             return ChatRoom.objects.none()
-        return ChatRoom.objects.filter(participants=self.request.user)
+        rooms = ChatRoom.objects.filter(participants=self.request.user)
+        if self.action in ['list', 'retrieve']:
+            rooms = self.with_summary(rooms)
+        return rooms
+
+    def with_summary(self, rooms):
+        """
+        Annotate rooms with their last message and the user's unread count, and
+        prefetch participants, so a page of rooms costs two queries.
+        """
+        last_message = Message.objects.filter(chat_room=OuterRef('pk')).order_by('-created_at', '-id')
+        # Fully archived rooms: COALESCE only runs this for rooms without hot messages
+        last_archived = ArchivedMessage.objects.filter(chat_room=OuterRef('pk')).order_by('-created_at', '-id')
+
+        def last(column):
+            return Coalesce(Subquery(last_message.values(column)[:1]), Subquery(last_archived.values(column)[:1]))
+
+        return rooms.annotate(
+            last_message_id=last('id'),
+            last_message_sender_id=last('sender_id'),
+            last_message_content=last('content'),
+            last_message_at=last('created_at'),
+            last_read_message_id=read_watermark(self.request.user),
+        ).annotate(
+            unread_count=unread_count(self.request.user),
+        ).prefetch_related(
+            Prefetch('participants', queryset=User.objects.select_related('pharmacy_profile'))
+        ).order_by(Coalesce('last_message_at', 'updated_at').desc(), '-id')
+
+    def get_serializer_class(self):
+        if self.action in ['list', 'retrieve']:
+            return ChatRoomListSerializer
+        return ChatRoomSerializer
 
     @action(detail=True, methods=['get', 'post'])
     def messages(self, request, pk=None):
         """
-        Get all messages in the chat room (GET) or send a message (POST)
+        Get the chat room's messages newest first, a page at a time (GET), or
+        send a message (POST)
         """
         chat_room = self.get_object()
         if request.method == 'GET':
-            messages = chat_room.messages.all().order_by('-created_at')
-            serializer = MessageSerializer(messages, many=True)
-            return Response(serializer.data)
+            messages = chat_room.messages.all()
+            # Only rooms that went through archive_chat_messages have archived history
+            archived = (chat_room.archived_messages.all(),) if chat_room.archived_at else ()
+            if stream_requested(request):
+                return self.stream_messages(messages, archived)
+            paginator = MessageCursorPagination()
+            page = paginator.paginate_queryset(messages, request, view=self, extra_querysets=archived)
+            serializer = MessageSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
         elif request.method == 'POST':
             serializer = MessageSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save(sender=request.user, chat_room=chat_room)
+                with transaction.atomic():
+                    message = serializer.save(sender=request.user, chat_room=chat_room)
+                    recipient_ids = chat_room.participants.exclude(pk=request.user.pk).values_list('id', flat=True)
+                    notify_users(list(recipient_ids), chat_message_event(message.id, chat_room.id, request.user.id))
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def stream_messages(self, messages, archived):
+        """
+        Stream the whole history newest first: hot messages, then the archived
+        ones, which are all older.
+        """
+        context = self.get_serializer_context()
+
+        def serializer_factory(instances, many):
+            return MessageSerializer(instances, many=many, context=context)
+
+        return streaming_json_response(chain.from_iterable(
+            iter_serialized(queryset.order_by('-created_at', '-id'), serializer_factory)
+            for queryset in (messages, *archived)
+        ), self.request)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """
+        Mark the room read up to `message_id` (default: the latest message)
+        """
+        chat_room = self.get_object()
+        message_id = request.data.get('message_id')
+        if message_id is not None:
+            try:
+                message_id = int(message_id)
+            except (TypeError, ValueError):
+                return Response({'error': 'Invalid message_id'}, status=status.HTTP_400_BAD_REQUEST)
+        last_read = mark_read(chat_room.id, request.user.id, message_id)
+        return Response({'last_read_message_id': last_read})
+
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def total_unread(self, request):
+        """
+        Total unread messages across the user's rooms, for the inbox badge
+        """
+        total = ChatRoom.objects.filter(participants=request.user).annotate(
+            last_read_message_id=read_watermark(request.user),
+        ).annotate(
+            unread=unread_count(request.user),
+        ).aggregate(count=Sum('unread'))['count']
+        return Response({'count': total or 0})
+
+    @action(detail=False, methods=['get'], url_path='outbound-stats', permission_classes=[permissions.IsAdminUser])
+    def outbound_stats(self, request):
+        """
+        WebSocket outbound queue metrics of the process serving this request
+        """
+        return Response(outbound_metrics.snapshot())
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Per-process write-behind buffer for chat messages (CHAT_WRITE_BEHIND).
+
+    ChatConsumer broadcasts a message as soon as it is received, under a
+    provisional id, and hands it to enqueue(). A single background task per
+    event loop drains the queue and persists messages with bulk_create in
+    batches of up to CHAT_WRITE_BEHIND_BATCH_SIZE, waiting at most
+    CHAT_WRITE_BEHIND_FLUSH_INTERVAL seconds for a batch to fill. Once a
+    batch is written each room is sent one `messages_persisted` event
+    mapping provisional ids to database ids.
+
+    Ordering: messages received by this process are inserted in the order
+    they were enqueued, so their ids follow receive order within a room.
+    created_at is assigned when the batch is written, at most the flush
+    interval (plus write time) after the broadcast; the persisted event
+    carries it.
+
+    Durability: a message is broadcast before it is stored. Messages still
+    buffered when the process dies are lost; flush() is awaited when a
+    connection closes, so a clean disconnect never leaves its messages
+    behind. If a batch fails (e.g. its room was deleted), rows are retried
+    one by one and those that still fail are reported to their room with a
+    `messages_failed` event.
+    """
+    def __init__(self):
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    def enqueue(self, room_id, sender_id, content, recipient_ids=()):
+        """
+        Buffer a message for writing and return its provisional id. Once it
+        is stored, recipient_ids get a chat_message notification through the
+        outbox, written in the same transaction.
+        """
+        self._ensure_started()
+        provisional_id = f'tmp-{uuid.uuid4().hex}'
+        self._queue.put_nowait((provisional_id, room_id, sender_id, content, tuple(recipient_ids)))
+        return provisional_id
+
+    async def flush(self):
+        """
+        Wait until every message enqueued so far has been written.
+        """
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def _run(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = self._loop.time() + settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL
+            while len(batch) < settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                written, failed = await self._write(batch)
+                await self._notify(written, failed)
+            except Exception:
+                logger.exception('Chat write-behind batch of %d messages failed', len(batch))
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    @database_sync_to_async
+    def _write(self, batch):
+        from .models import Message
+        messages = [
+            Message(chat_room_id=room_id, sender_id=sender_id, content=content)
+            for _, room_id, sender_id, content, _ in batch
+        ]
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                self._record_notifications(batch, messages)
+            return list(zip(batch, messages)), []
+        except Exception:
+            logger.warning('Chat write-behind bulk insert failed, retrying row by row', exc_info=True)
+        written, failed = [], []
+        for item, message in zip(batch, messages):
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                    self._record_notifications([item], [message])
+                written.append((item, message))
+            except Exception:
+                logger.exception('Dropping chat message %s', item[0])
+                failed.append(item)
+        return written, failed
+
+    def _record_notifications(self, batch, messages):
+        from outbox.events import user_notification
+        from outbox.models import OutboxEvent
+        from pharmacy.notifications import chat_message_event
+        events = [
+            user_notification(recipient_ids, chat_message_event(message.id, room_id, sender_id))
+            for (_, room_id, sender_id, _, recipient_ids), message in zip(batch, messages)
+        ]
+        OutboxEvent.objects.bulk_create([event for event in events if event is not None])
+
+    async def _notify(self, written, failed):
+        persisted, dropped = {}, {}
+        for (provisional_id, room_id, _, _, _), message in written:
+            persisted.setdefault(room_id, []).append({
+                'provisional_id': provisional_id,
+                'id': message.id,
+                'created_at': message.created_at.isoformat(),
+            })
+        for provisional_id, room_id, _, _, _ in failed:
+            dropped.setdefault(room_id, []).append(provisional_id)
+        channel_layer = get_channel_layer()
+        for room_id, messages in persisted.items():
+            await channel_layer.group_send(f'chat_{room_id}', {
+                'type': 'messages_persisted',
+                'messages': messages,
+            })
+        for room_id, provisional_ids in dropped.items():
+            await channel_layer.group_send(f'chat_{room_id}', {
+                'type': 'messages_failed',
+                'provisional_ids': provisional_ids,
+            })
+
+
+message_writer = MessageWriter()
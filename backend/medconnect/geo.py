@@ -0,0 +1,78 @@
+import math
+
+from django.db.models import ExpressionWrapper, F, FloatField
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def unit_vector(lat, lng):
+    """
+    Return the (x, y, z) point on the unit sphere for a latitude/longitude pair,
+    or (None, None, None) when either coordinate is missing.
+    """
+    if lat is None or lng is None:
+        return None, None, None
+    lat_rad = math.radians(float(lat))
+    lng_rad = math.radians(float(lng))
+    cos_lat = math.cos(lat_rad)
+    return cos_lat * math.cos(lng_rad), cos_lat * math.sin(lng_rad), math.sin(lat_rad)
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Return (min_lat, max_lat, min_lng, max_lng) enclosing a circle of radius_km
+    around (lat, lng). The box is a cheap, indexable prefilter; exact distance
+    is still checked afterwards.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    min_lat = max(lat - lat_delta, -90.0)
+    max_lat = min(lat + lat_delta, 90.0)
+
+    # Near the poles (or for huge radii) the longitude span covers everything
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 0:
+        return min_lat, max_lat, -180.0, 180.0
+    lng_delta = lat_delta / cos_lat
+    if lng_delta >= 180.0 or lng - lng_delta < -180.0 or lng + lng_delta > 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lng - lng_delta, lng + lng_delta
+
+
+def within_bounding_box(queryset, lat, lng, radius_km, prefix=''):
+    """
+    Restrict queryset to rows whose coordinates (at prefix + 'latitude' and
+    prefix + 'longitude') fall inside the bounding box of the search circle.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    return queryset.filter(**{
+        f'{prefix}latitude__range': (min_lat, max_lat),
+        f'{prefix}longitude__range': (min_lng, max_lng),
+    })
+
+
+def within_radius(queryset, lat, lng, radius_km, prefix=''):
+    """
+    Restrict queryset to rows within radius_km of (lat, lng) and annotate each
+    row with `proximity`, the dot product of the two unit vectors.
+
+    Higher proximity means nearer (it orders exactly like chord distance), so
+    callers rank with order_by('-proximity') and only convert to kilometres
+    for the rows they return, using proximity_to_km.
+    """
+    x, y, z = unit_vector(lat, lng)
+    proximity = ExpressionWrapper(
+        F(f'{prefix}unit_x') * x + F(f'{prefix}unit_y') * y + F(f'{prefix}unit_z') * z,
+        output_field=FloatField()
+    )
+    min_proximity = math.cos(min(radius_km / EARTH_RADIUS_KM, math.pi))
+    return within_bounding_box(queryset, lat, lng, radius_km, prefix).annotate(
+        proximity=proximity
+    ).filter(proximity__gte=min_proximity)
+
+
+def proximity_to_km(proximity):
+    """
+    Convert a unit-vector dot product back to great-circle distance in km.
+    """
+    return EARTH_RADIUS_KM * math.acos(max(-1.0, min(1.0, proximity)))
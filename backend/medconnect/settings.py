@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -57,6 +58,7 @@ INSTALLED_APPS = [
     'users',
     'pharmacy',
     'chat',
+    'outbox',
 ]
 
 MIDDLEWARE = [
@@ -207,6 +209,21 @@ SIMPLE_JWT = {
 # Custom user model
 AUTH_USER_MODEL = 'users.User'
 
+# Shared cache in production (REDIS_URL), process-local memory otherwise
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -215,3 +232,28 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Chat write-behind: broadcast WebSocket messages immediately and persist them
+# in batches (see chat.writer.MessageWriter for the guarantees)
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BEHIND_BATCH_SIZE', 100))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+
+# Per-connection WebSocket outbound queue (see chat.outbound.BoundedSendMixin)
+CHAT_OUTBOUND_QUEUE_SIZE = int(os.getenv('CHAT_OUTBOUND_QUEUE_SIZE', 100))
+CHAT_OUTBOUND_MAX_DROPS = int(os.getenv('CHAT_OUTBOUND_MAX_DROPS', 1000))
+
+# Chat typing indicators: at most one broadcast per user and room every
+# CHAT_TYPING_INTERVAL seconds; clients drop an indicator after CHAT_TYPING_TTL
+CHAT_TYPING_INTERVAL = float(os.getenv('CHAT_TYPING_INTERVAL', 3.0))
+CHAT_TYPING_TTL = float(os.getenv('CHAT_TYPING_TTL', 6.0))
+
+# Celery (background jobs, see medconnect.celery). With CELERY_TASK_ALWAYS_EAGER
+# tasks run inline in the calling process, e.g. for local development without
+# a broker.
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0'))
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
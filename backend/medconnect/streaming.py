@@ -0,0 +1,105 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+STREAM_QUERY_PARAM = 'stream'
+STREAM_CHUNK_SIZE = 500
+
+
+def stream_requested(request):
+    return request.query_params.get(STREAM_QUERY_PARAM, '').lower() in ('1', 'true', 'yes')
+
+
+def iter_json_array(items):
+    """
+    Yield a JSON array of items piece by piece; items are JSON-serializable
+    (e.g. serializer .data) and are encoded one at a time.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    yield '['
+    first = True
+    for item in items:
+        yield encoder.encode(item) if first else ',' + encoder.encode(item)
+        first = False
+    yield ']'
+
+
+def iter_serialized(queryset, serializer_factory, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Serialize queryset chunk by chunk, reading it through a server-side cursor.
+    Prefetches declared on the queryset are run per chunk.
+    """
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) == chunk_size:
+            yield from serializer_factory(chunk, many=True).data
+            chunk = []
+    if chunk:
+        yield from serializer_factory(chunk, many=True).data
+
+
+def _next_pieces(pieces, count):
+    return ''.join(islice(pieces, count))
+
+
+async def aiter_json_array(items, pieces_per_chunk=STREAM_CHUNK_SIZE):
+    """
+    Async version of iter_json_array. The sync items (querysets, serializers)
+    are advanced in sync_to_async, a chunk of pieces per call, so the ASGI
+    handler can send each chunk as soon as it is encoded.
+    """
+    pieces = iter_json_array(items)
+    while True:
+        chunk = await sync_to_async(_next_pieces)(pieces, pieces_per_chunk)
+        if not chunk:
+            return
+        yield chunk
+
+
+def streaming_json_response(items, request):
+    """
+    Stream items as a JSON array. Under ASGI the response gets an async
+    iterator: given a sync one, Django's ASGI handler would collect the
+    whole body in memory before sending its first byte.
+    """
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        content = aiter_json_array(items)
+    else:
+        content = iter_json_array(items)
+    return StreamingHttpResponse(content, content_type='application/json')
+
+
+class StreamingListMixin:
+    """
+    Adds a streaming mode to list(): with ?stream=1 the full (filtered,
+    unpaginated) queryset is sent as a chunked JSON array, so neither the
+    rows nor the rendered body are held in memory at once and the first
+    bytes go out as soon as the first chunk is serialized.
+
+    Set stream_max_rows to cap what one request may stream; the cap is
+    sent in the X-Stream-Limit header.
+    """
+    stream_max_rows = None
+
+    def list(self, request, *args, **kwargs):
+        if not stream_requested(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.stream_max_rows is None:
+            return self.streaming_response(queryset)
+        response = self.streaming_response(queryset[:self.stream_max_rows])
+        response['X-Stream-Limit'] = str(self.stream_max_rows)
+        return response
+
+    def streaming_response(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        context = self.get_serializer_context()
+
+        def serializer_factory(instances, many):
+            return serializer_class(instances, many=many, context=context)
+
+        return streaming_json_response(iter_serialized(queryset, serializer_factory), self.request)
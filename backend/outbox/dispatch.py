@@ -0,0 +1,84 @@
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from celery import current_app
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 300
+
+
+def dispatch_batch(batch_size=100):
+    """
+    Deliver up to batch_size pending events, oldest first; return how many
+    were claimed.
+
+    The batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any number
+    of dispatchers can drain the outbox side by side without taking the same
+    rows. Delivered rows are deleted in the claiming transaction; a failed row
+    is pushed back with exponential backoff. Delivery is at least once (a
+    dispatcher that dies after sending but before committing leaves the row
+    to be sent again), so event handlers must tolerate repeats; the status
+    deltas sent today are idempotent.
+    """
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True).filter(
+                available_at__lte=timezone.now(), attempts__lt=OutboxEvent.MAX_ATTEMPTS,
+            ).order_by('available_at', 'id')[:batch_size]
+        )
+        if not events:
+            return 0
+        channel_layer = get_channel_layer()
+        delivered, failed = [], []
+        for event in events:
+            try:
+                deliver(event, channel_layer)
+                delivered.append(event.id)
+            except Exception as error:
+                logger.exception('Could not deliver outbox event %s', event.id)
+                event.attempts += 1
+                event.available_at = timezone.now() + timedelta(seconds=min(2 ** event.attempts, MAX_RETRY_DELAY))
+                event.last_error = repr(error)
+                failed.append(event)
+        OutboxEvent.objects.filter(id__in=delivered).delete()
+        if failed:
+            OutboxEvent.objects.bulk_update(failed, ['attempts', 'available_at', 'last_error'])
+    return len(events)
+
+
+def deliver(event, channel_layer):
+    if event.kind == OutboxEvent.GROUP:
+        for group in event.targets:
+            async_to_sync(channel_layer.group_send)(group, event.payload)
+    elif event.kind == OutboxEvent.TASK:
+        name = event.targets[0]
+        args, kwargs = event.payload.get('args', []), event.payload.get('kwargs', {})
+        task = current_app.tasks.get(name)
+        if task is not None:
+            # Honours CELERY_TASK_ALWAYS_EAGER, unlike send_task
+            task.apply_async(args=args, kwargs=kwargs)
+        else:
+            current_app.send_task(name, args=args, kwargs=kwargs)
+    else:
+        raise ValueError(f'Unknown outbox event kind {event.kind!r}')
+
+
+def dispatch_pending(batch_size=100):
+    """
+    Deliver until nothing is deliverable, including events recorded by tasks
+    that ran eagerly along the way; return how many events were claimed.
+    Failed events are pushed into the future, so this always terminates.
+    """
+    total = 0
+    while True:
+        claimed = dispatch_batch(batch_size)
+        total += claimed
+        if not claimed:
+            return total
@@ -0,0 +1,44 @@
+from .models import OutboxEvent
+
+
+def publish_to_groups(groups, message):
+    """
+    Record a channel layer message ({"type": handler, ...}) for the groups.
+    The row commits or rolls back with the surrounding transaction.
+    """
+    groups = [group for group in dict.fromkeys(groups) if group]
+    if not groups:
+        return None
+    return OutboxEvent.objects.create(kind=OutboxEvent.GROUP, targets=groups, payload=message)
+
+
+def user_notification(user_ids, event):
+    """
+    Build (unsaved, e.g. for bulk_create) the event delivering a delta to the
+    users' notification sockets (see chat.consumers.NotificationConsumer);
+    None when there is nobody to notify.
+    """
+    from pharmacy.notifications import notification_group
+    groups = list(dict.fromkeys(notification_group(user_id) for user_id in user_ids if user_id is not None))
+    if not groups:
+        return None
+    return OutboxEvent(kind=OutboxEvent.GROUP, targets=groups, payload={'type': 'notify', 'event': event})
+
+
+def notify_users(user_ids, event):
+    """
+    Record a delta event for the users' notification sockets.
+    """
+    outbox_event = user_notification(user_ids, event)
+    if outbox_event is not None:
+        outbox_event.save()
+    return outbox_event
+
+
+def enqueue_task(name, *args, **kwargs):
+    """
+    Record a Celery task to queue once the surrounding transaction commits.
+    """
+    return OutboxEvent.objects.create(
+        kind=OutboxEvent.TASK, targets=[name], payload={'args': list(args), 'kwargs': kwargs},
+    )
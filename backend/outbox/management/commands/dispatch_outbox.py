@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from outbox.dispatch import dispatch_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver outbox events to channel layer groups and Celery. Run as many '
+        'as needed: batches are claimed with SKIP LOCKED.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--poll-interval', type=float, default=0.2,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain what is pending and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        delivered = 0
+        while True:
+            claimed = dispatch_batch(batch_size)
+            delivered += claimed
+            if claimed == batch_size:
+                # More may be waiting; go again without sleeping
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(f'Dispatched {delivered} outbox events'))
@@ -0,0 +1,43 @@
+from django.db import models
+from django.utils import timezone
+
+MAX_ATTEMPTS = 10
+
+
+class OutboxEvent(models.Model):
+    """
+    A side effect recorded in the same transaction as the change that causes
+    it, and carried out after commit by the dispatch_outbox command.
+
+    GROUP events send `payload` to each channel layer group in `targets`;
+    TASK events queue the Celery task named `targets[0]` with
+    payload["args"] / payload["kwargs"]. Rows are deleted once delivered;
+    failed rows are retried later, and kept after MAX_ATTEMPTS for inspection.
+    """
+    GROUP = 'group'
+    TASK = 'task'
+    KIND_CHOICES = (
+        (GROUP, 'Channel layer groups'),
+        (TASK, 'Celery task'),
+    )
+    MAX_ATTEMPTS = MAX_ATTEMPTS
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    targets = models.JSONField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # What dispatchers poll for: deliverable rows, oldest first
+            models.Index(
+                fields=['available_at', 'id'], name='outbox_pending_idx',
+                condition=models.Q(attempts__lt=MAX_ATTEMPTS),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} event {self.id} to {', '.join(self.targets)}"
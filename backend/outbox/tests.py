@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from pharmacy.notifications import notification_group
+from .dispatch import dispatch_batch, dispatch_pending
+from .events import notify_users, publish_to_groups
+from .models import OutboxEvent
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class OutboxDispatchTests(TestCase):
+    def setUp(self):
+        self.layer = get_channel_layer()
+
+    def listen(self, group):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(group, channel)
+        return channel
+
+    def receive(self, channel):
+        async def receive():
+            return await asyncio.wait_for(self.layer.receive(channel), timeout=5)
+        return async_to_sync(receive)()
+
+    def test_rolled_back_changes_leave_no_event(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                notify_users([1], {'type': 'order', 'id': 1, 'status': 'shipped'})
+                raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_events_are_delivered_in_order_and_deleted(self):
+        channel = self.listen(notification_group(7))
+        notify_users([7, None, 7], {'type': 'order', 'id': 1, 'status': 'processing'})
+        notify_users([7], {'type': 'order', 'id': 1, 'status': 'shipped'})
+        self.assertIsNone(notify_users([None], {'type': 'order'}))
+
+        self.assertEqual(dispatch_pending(batch_size=1), 2)
+        self.assertEqual(self.receive(channel)['event']['status'], 'processing')
+        self.assertEqual(self.receive(channel)['event']['status'], 'shipped')
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        channel = self.listen('room')
+        broken = OutboxEvent.objects.create(kind='bogus', targets=['room'], payload={})
+        publish_to_groups(['room'], {'type': 'chat_message', 'message': 'hi'})
+
+        self.assertEqual(dispatch_pending(), 2)
+        self.assertEqual(self.receive(channel)['message'], 'hi')
+        broken.refresh_from_db()
+        self.assertEqual(broken.attempts, 1)
+        self.assertIn('bogus', broken.last_error)
+        self.assertGreater(broken.available_at, timezone.now())
+        # Not due yet
+        self.assertEqual(dispatch_pending(), 0)
+
+        OutboxEvent.objects.filter(pk=broken.pk).update(
+            available_at=timezone.now(), attempts=OutboxEvent.MAX_ATTEMPTS,
+        )
+        # Given up on, but kept for inspection
+        self.assertEqual(dispatch_pending(), 0)
+        self.assertTrue(OutboxEvent.objects.filter(pk=broken.pk).exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class ConcurrentDispatchTests(TransactionTestCase):
+    def test_dispatchers_skip_claimed_events(self):
+        events = [publish_to_groups(['room'], {'type': 'chat_message', 'message': index}) for index in range(6)]
+        claimed = threading.Event()
+        release = threading.Event()
+
+        def hold_first_three():
+            try:
+                with transaction.atomic():
+                    list(OutboxEvent.objects.select_for_update().filter(id__in=[event.id for event in events[:3]]))
+                    claimed.set()
+                    release.wait(timeout=10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_first_three)
+        holder.start()
+        self.assertTrue(claimed.wait(timeout=10))
+        try:
+            # Doesn't wait for the held rows, and takes only the others
+            self.assertEqual(dispatch_batch(batch_size=10), 3)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('id').values_list('id', flat=True)),
+            [event.id for event in events[:3]],
+        )
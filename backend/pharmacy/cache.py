@@ -0,0 +1,110 @@
+import hashlib
+import math
+
+from django.core.cache import cache
+
+from medconnect.geo import bounding_box
+from .search import normalize_name, nearby_medicine_rows, rank_nearby_rows
+
+# Searches are answered per grid cell: candidates are fetched once around the
+# cell centre (radius widened by the cell's half-diagonal) and then filtered
+# and sorted by each user's exact distance.
+CELL_DEGREES = 0.01
+RADIUS_BUCKETS_KM = (1, 2, 5, 10, 20, 50)
+CACHE_TIMEOUT = 120
+
+# Writes invalidate whole regions by bumping a generation counter that is part
+# of every cache key covering the region.
+REGION_DEGREES = 0.5
+MAX_REGIONS = 16
+
+KEY_PREFIX = 'nearby'
+HITS_KEY = f'{KEY_PREFIX}:stats:hits'
+MISSES_KEY = f'{KEY_PREFIX}:stats:misses'
+
+
+def _cell(lat, lng):
+    return math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES)
+
+
+def _cell_half_diagonal_km(cell_lat):
+    lat_km = CELL_DEGREES * 111.2
+    lng_km = lat_km * math.cos(math.radians(min(abs(cell_lat), 89.0)))
+    return math.hypot(lat_km, lng_km) / 2.0
+
+
+def _region(lat, lng):
+    return math.floor(lat / REGION_DEGREES), math.floor(lng / REGION_DEGREES)
+
+
+def _region_key(region):
+    return f'{KEY_PREFIX}:region:{region[0]}:{region[1]}'
+
+
+def _regions_covering(lat, lng, radius_km):
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    (lat_lo, lng_lo), (lat_hi, lng_hi) = _region(min_lat, min_lng), _region(max_lat, max_lng)
+    if (lat_hi - lat_lo + 1) * (lng_hi - lng_lo + 1) > MAX_REGIONS:
+        return None
+    return [
+        (region_lat, region_lng)
+        for region_lat in range(lat_lo, lat_hi + 1)
+        for region_lng in range(lng_lo, lng_hi + 1)
+    ]
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First use (or evicted); another process may create it concurrently
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def nearby_medicine_results(name, lat, lng, radius_km, sort='distance'):
+    """
+    Return search_nearby (sort key, result) pairs, serving the candidate set
+    from the cache.
+
+    Radii above the largest bucket bypass the cache.
+    """
+    name = normalize_name(name)
+    bucket = next((bucket for bucket in RADIUS_BUCKETS_KM if radius_km <= bucket), None)
+    if bucket is None or not name:
+        return rank_nearby_rows(nearby_medicine_rows(name, lat, lng, radius_km), lat, lng, radius_km, sort)
+
+    cell = _cell(lat, lng)
+    centre_lat, centre_lng = (cell[0] + 0.5) * CELL_DEGREES, (cell[1] + 0.5) * CELL_DEGREES
+    candidate_radius = bucket + _cell_half_diagonal_km(centre_lat)
+    regions = _regions_covering(centre_lat, centre_lng, candidate_radius)
+    if regions is None:
+        return rank_nearby_rows(nearby_medicine_rows(name, lat, lng, radius_km), lat, lng, radius_km, sort)
+
+    region_keys = [_region_key(region) for region in regions]
+    generations = cache.get_many(region_keys)
+    fingerprint = repr((name, cell, bucket, [generations.get(key, 0) for key in region_keys]))
+    key = f'{KEY_PREFIX}:{hashlib.md5(fingerprint.encode()).hexdigest()}'
+
+    rows = cache.get(key)
+    if rows is None:
+        _incr(MISSES_KEY)
+        rows = nearby_medicine_rows(name, centre_lat, centre_lng, candidate_radius)
+        cache.set(key, rows, CACHE_TIMEOUT)
+    else:
+        _incr(HITS_KEY)
+    return rank_nearby_rows(rows, lat, lng, radius_km, sort)
+
+
+def invalidate_nearby_results(latitude, longitude):
+    """
+    Expire every cached search whose candidate area covers this location.
+    """
+    if latitude is None or longitude is None:
+        return
+    _incr(_region_key(_region(float(latitude), float(longitude))))
+
+
+def cache_stats():
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': stats.get(HITS_KEY, 0), 'misses': stats.get(MISSES_KEY, 0)}
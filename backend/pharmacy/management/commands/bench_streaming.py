@@ -0,0 +1,136 @@
+import asyncio
+import resource
+import time
+import tracemalloc
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, transaction
+from rest_framework.renderers import JSONRenderer
+
+from medconnect.asgi import application
+from users.models import PharmacyProfile
+from pharmacy.models import Medicine
+from pharmacy.serializers import MedicineSerializer
+from pharmacy.views import MedicineViewSet
+
+User = get_user_model()
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare peak memory and time to first byte of the full medicine list, '
+        'buffered vs. streamed (?stream=1, served by the ASGI application as in '
+        'production). Seeds a throwaway catalog inside a transaction that is '
+        'rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        # Like the test client: the seeding transaction must outlive the requests
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        # Stream the whole seeded catalog, like the buffered mode renders it
+        stream_max_rows, MedicineViewSet.stream_max_rows = MedicineViewSet.stream_max_rows, options['rows']
+        try:
+            with transaction.atomic():
+                self.seed(options['rows'])
+                modes = [('streamed', self.streamed), ('buffered', self.buffered)]
+                timings = [self.time(body) for _, body in modes]
+                # Streamed first: ru_maxrss only ever grows within a process
+                memory = [self.memory(body) for _, body in modes]
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+            MedicineViewSet.stream_max_rows = stream_max_rows
+        for (name, _), (ttfb, total), (peak, rss_growth) in zip(modes, timings, memory):
+            self.stdout.write(
+                f'{name:9} ttfb={ttfb * 1000:8.1f}ms total={total * 1000:8.1f}ms '
+                f'peak_alloc={peak / 2**20:7.1f}MiB rss_growth={rss_growth / 2**10:7.1f}MiB'
+            )
+
+    def seed(self, rows):
+        user = User.objects.create_user(
+            username='bench-streaming', email='bench-streaming@example.com',
+            password='bench', user_type='pharmacy',
+        )
+        pharmacy = PharmacyProfile.objects.create(
+            user=user, license_number='BENCH-STREAMING', business_name='Bench Pharmacy',
+            operating_hours='8:00-20:00', latitude=Decimal('9.03'), longitude=Decimal('38.74'),
+        )
+        # Only the seeded catalog is listed; everything is rolled back afterwards
+        Medicine.objects.exclude(pharmacy=pharmacy).delete()
+        Medicine.objects.bulk_create((
+            Medicine(
+                name=f'Medicine {index}', description='Benchmark listing ' * 4,
+                price=Decimal('10.00'), stock=index % 50, pharmacy=pharmacy,
+            )
+            for index in range(rows)
+        ), batch_size=5000)
+
+    def buffered(self, on_chunk):
+        # What list() did before pagination and streaming: serialize and render everything
+        data = MedicineSerializer(Medicine.objects.all(), many=True).data
+        on_chunk(JSONRenderer().render(data))
+
+    def streamed(self, on_chunk):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': '/api/pharmacy/medicines/', 'root_path': '',
+            'query_string': b'stream=1', 'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                # Block like a connected client would until the response is sent
+                await asyncio.Event().wait()
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                on_chunk(message['body'])
+
+        async_to_sync(application)(scope, receive, send)
+
+    def time(self, body):
+        """
+        Return seconds until the first row is produced and until the end.
+        """
+        started = time.perf_counter()
+        ttfb = None
+
+        def on_chunk(chunk):
+            nonlocal ttfb
+            # Skip the opening bracket, which is sent before any row is read
+            if ttfb is None and len(chunk) > 1:
+                ttfb = time.perf_counter() - started
+        body(on_chunk)
+        return ttfb, time.perf_counter() - started
+
+    def memory(self, body):
+        """
+        Return peak traced allocation and peak RSS growth in bytes / KiB.
+        Measured separately from timing since tracemalloc slows allocation down.
+        """
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        body(lambda chunk: None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:38
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+def backfill_search_vector(apps, schema_editor):
+    Medicine = apps.get_model('pharmacy', 'Medicine')
+    Medicine.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='english')
+        + SearchVector('description', weight='B', config='english')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0006_prescription_unit_vector'),
+        ('users', '0005_pharmacyprofile_unit_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='medicine',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='medicine_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='medicine_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
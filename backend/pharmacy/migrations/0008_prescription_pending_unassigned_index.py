@@ -0,0 +1,20 @@
+# Generated by Django 5.0.2 on 2026-10-18 01:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0007_medicine_search_vector'),
+        ('users', '0005_pharmacyprofile_unit_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('pharmacy__isnull', True), ('status', 'pending')), fields=['latitude', 'longitude'], name='rx_pending_unassigned_idx'),
+        ),
+    ]
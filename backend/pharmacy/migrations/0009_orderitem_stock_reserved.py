@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0008_prescription_pending_unassigned_index'),
+    ]
+
+    operations = [
+        # Items created before stock reservation never took stock, so they hold none
+        migrations.AddField(
+            model_name='orderitem',
+            name='stock_reserved',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='stock_reserved',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 21:10
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0009_orderitem_stock_reserved'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='medicine',
+            name='medicine_search_vector_idx',
+        ),
+        migrations.RemoveField(
+            model_name='medicine',
+            name='search_vector',
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='search_vector',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('name', config='english', weight='A'), '||', django.contrib.postgres.search.SearchVector('description', config='english', weight='B'), django.contrib.postgres.search.SearchConfig('english')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='medicine_search_vector_idx'),
+        ),
+    ]
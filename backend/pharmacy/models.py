@@ -1,5 +1,8 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
 from users.models import User, PharmacyProfile
+from medconnect.geo import unit_vector
 
 class Medicine(models.Model):
     name = models.CharField(max_length=200)
@@ -8,9 +11,33 @@ class Medicine(models.Model):
     stock = models.IntegerField()
     pharmacy = models.ForeignKey(PharmacyProfile, on_delete=models.CASCADE, related_name='medicines')
     requires_prescription = models.BooleanField(default=True)
+    # Weighted full-text document over name and description, computed by
+    # Postgres as part of each INSERT/UPDATE
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('name', weight='A', config='english')
+            + SearchVector('description', weight='B', config='english')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='medicine_search_vector_idx'),
+            GinIndex(fields=['name'], name='medicine_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The listing as loaded, for keeping the name index current on save
+        if 'name' in instance.__dict__ and 'stock' in instance.__dict__:
+            instance._loaded_listing = (instance.name, instance.stock)
+        return instance
+
     def __str__(self):
         return f"{self.name} - {self.pharmacy.business_name}"
 
@@ -30,9 +57,32 @@ class Prescription(models.Model):
     notes = models.TextField(blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Unit-sphere coordinates derived from latitude/longitude on save
+    unit_x = models.FloatField(null=True, editable=False)
+    unit_y = models.FloatField(null=True, editable=False)
+    unit_z = models.FloatField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Serves the bounding-box prefilter of pharmacy inboxes, which only
+            # ever look at pending, unassigned prescriptions
+            models.Index(
+                fields=['latitude', 'longitude'], name='rx_pending_unassigned_idx',
+                condition=models.Q(status='pending', pharmacy__isnull=True),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.unit_x, self.unit_y, self.unit_z = unit_vector(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'unit_x', 'unit_y', 'unit_z'}
+        # Atomic with the outbox events written by post_save handlers
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.patient.email} - {self.medicine.name}"
 
@@ -54,6 +104,11 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        # Atomic with the outbox events written by post_save handlers
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Order {self.id} - {self.patient.email}"
 
@@ -62,6 +117,8 @@ class OrderItem(models.Model):
     medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
     quantity = models.IntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Cleared once the quantity has gone back to stock (see ordering.release_order_stock)
+    stock_reserved = models.BooleanField(default=True)
 
     def __str__(self):
         return f"{self.medicine.name} x {self.quantity}"
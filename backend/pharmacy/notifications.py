@@ -0,0 +1,79 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from outbox.events import notify_users
+
+logger = logging.getLogger(__name__)
+
+
+def notification_group(user_id):
+    """
+    Channel layer group of a user's notification sockets (see NotificationConsumer).
+    """
+    return f'notifications_{user_id}'
+
+
+def push_notification(user_ids, event):
+    """
+    Send a delta event to every notification socket of the given users right
+    away. Delivery is best effort and failures are only logged; changes made
+    in a transaction should use outbox.events.notify_users instead.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for user_id in {user_id for user_id in user_ids if user_id is not None}:
+        try:
+            async_to_sync(channel_layer.group_send)(
+                notification_group(user_id), {'type': 'notify', 'event': event}
+            )
+        except Exception:
+            logger.exception('Could not push %s event to user %s', event.get('type'), user_id)
+
+
+def prescription_event(prescription, chat_room_id=None):
+    return {
+        'type': 'prescription',
+        'id': prescription.id,
+        'status': prescription.status,
+        'pharmacy': prescription.pharmacy_id,
+        'chat_room_id': chat_room_id,
+        'updated_at': prescription.updated_at.isoformat(),
+    }
+
+
+def record_prescription_status(prescription):
+    """
+    Record, in the current transaction, the prescription's status delta for
+    its patient and pharmacy; dispatch_outbox sends it after commit.
+    """
+    pharmacy_user_id = prescription.pharmacy.user_id if prescription.pharmacy_id else None
+    chat_room_id = None
+    if pharmacy_user_id is not None:
+        from chat.models import ChatRoom
+        chat_room_id = ChatRoom.objects.filter(
+            pair_key=ChatRoom.pair_key_for(prescription.patient_id, pharmacy_user_id)
+        ).values_list('id', flat=True).first()
+    notify_users([prescription.patient_id, pharmacy_user_id], prescription_event(prescription, chat_room_id))
+
+
+def order_event(order):
+    return {
+        'type': 'order',
+        'id': order.id,
+        'status': order.status,
+        'prescription': order.prescription_id,
+        'total_amount': str(order.total_amount),
+        'updated_at': order.updated_at.isoformat(),
+    }
+
+
+def chat_message_event(message_id, room_id, sender_id):
+    return {
+        'type': 'chat_message',
+        'id': message_id,
+        'room': room_id,
+        'sender': sender_id,
+    }
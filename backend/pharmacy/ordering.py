@@ -0,0 +1,155 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .cache import invalidate_nearby_results
+from .models import Medicine, Order, OrderItem
+
+MAX_ORDER_ITEMS = 50
+OPEN_ORDER_STATUSES = ('pending', 'processing')
+
+
+class OrderNotEditable(Exception):
+    pass
+
+
+class InvalidOrderItems(Exception):
+    def __init__(self, medicine_ids):
+        super().__init__(medicine_ids)
+        self.medicine_ids = sorted(medicine_ids)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, medicine_ids):
+        super().__init__(medicine_ids)
+        self.medicine_ids = sorted(medicine_ids)
+
+
+def _by_medicine(deltas, default=0):
+    return Case(
+        *[When(id=medicine_id, then=Value(delta)) for medicine_id, delta in deltas.items()],
+        default=Value(default), output_field=IntegerField(),
+    )
+
+
+def adjust_stock(deltas):
+    """
+    Take deltas[medicine_id] units out of stock (negative deltas put units
+    back) in one conditional UPDATE. Either every medicine has enough stock
+    and all rows change, or nothing changes and InsufficientStock lists the
+    medicines that are short. Run inside a transaction.
+
+    The check and the decrement are the same statement, so concurrent orders
+    can never take the same units twice.
+    """
+    deltas = {medicine_id: delta for medicine_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = Medicine.objects.filter(id__in=deltas, stock__gte=_by_medicine(deltas)).update(
+        stock=F('stock') - _by_medicine(deltas),
+    )
+    if updated != len(deltas):
+        short = Medicine.objects.filter(id__in=deltas, stock__lt=_by_medicine(deltas)).values_list('id', flat=True)
+        raise InsufficientStock(set(short) or set(deltas))
+
+
+def _lock_open_order(order):
+    order = Order.objects.select_for_update().select_related('pharmacy').get(pk=order.pk)
+    if order.status not in OPEN_ORDER_STATUSES:
+        raise OrderNotEditable(order.status)
+    return order
+
+
+def _priced_medicines(order, medicine_ids):
+    """
+    Return {id: price} for the given medicines, which must all belong to the
+    order's pharmacy.
+    """
+    prices = dict(Medicine.objects.filter(
+        id__in=medicine_ids, pharmacy_id=order.pharmacy_id,
+    ).values_list('id', 'price'))
+    missing = set(medicine_ids) - set(prices)
+    if missing:
+        raise InvalidOrderItems(missing)
+    return prices
+
+
+def _expire_stock_listings(pharmacy):
+    latitude, longitude = pharmacy.latitude, pharmacy.longitude
+    # Bulk stock updates bypass the Medicine signals
+    transaction.on_commit(lambda: invalidate_nearby_results(latitude, longitude))
+
+
+def set_order_items(order, lines):
+    """
+    Replace the items of an open order with lines, a list of (medicine id,
+    quantity), in a constant number of queries whatever the number of lines.
+
+    Stock is reserved for what the order gains and released for what it
+    loses, items are priced at the medicines' current prices, and
+    total_amount moves by the difference between the new and old item totals
+    (so anything else it includes, e.g. for prescription orders, is kept).
+    Raises OrderNotEditable, InvalidOrderItems or InsufficientStock, leaving
+    the order unchanged.
+    """
+    quantities = Counter()
+    for medicine_id, quantity in lines:
+        quantities[medicine_id] += quantity
+    with transaction.atomic():
+        order = _lock_open_order(order)
+        prices = _priced_medicines(order, quantities)
+        previous = list(OrderItem.objects.filter(order=order).values_list(
+            'medicine_id', 'quantity', 'price', 'stock_reserved',
+        ))
+
+        deltas = Counter(quantities)
+        # Only items that still hold stock give it back
+        for medicine_id, quantity, _, reserved in previous:
+            if reserved:
+                deltas[medicine_id] -= quantity
+        adjust_stock(dict(deltas))
+
+        OrderItem.objects.filter(order=order).delete()
+        items = OrderItem.objects.bulk_create([
+            OrderItem(order=order, medicine_id=medicine_id, quantity=quantity, price=prices[medicine_id])
+            for medicine_id, quantity in quantities.items()
+        ])
+        old_total = sum((quantity * price for _, quantity, price, _ in previous), Decimal('0.00'))
+        new_total = sum((item.quantity * item.price for item in items), Decimal('0.00'))
+        Order.objects.filter(pk=order.pk).update(total_amount=F('total_amount') + (new_total - old_total))
+        _expire_stock_listings(order.pharmacy)
+    return items
+
+
+def add_order_item(order, medicine_id, quantity):
+    """
+    Add one line to an open order, reserving its stock and adding it to
+    total_amount; see set_order_items.
+    """
+    with transaction.atomic():
+        order = _lock_open_order(order)
+        price = _priced_medicines(order, [medicine_id])[medicine_id]
+        adjust_stock({medicine_id: quantity})
+        item = OrderItem.objects.create(order=order, medicine_id=medicine_id, quantity=quantity, price=price)
+        Order.objects.filter(pk=order.pk).update(total_amount=F('total_amount') + quantity * price)
+        _expire_stock_listings(order.pharmacy)
+    return item
+
+
+def release_order_stock(order):
+    """
+    Put the stock reserved by an order's items back, e.g. when it is cancelled.
+    Items are marked as released, so calling this again releases nothing.
+    """
+    with transaction.atomic():
+        reserved = OrderItem.objects.select_for_update().filter(order=order, stock_reserved=True)
+        quantities = Counter()
+        for medicine_id, quantity in reserved.values_list('medicine_id', 'quantity'):
+            quantities[medicine_id] -= quantity
+        if not quantities:
+            return
+        adjust_stock(dict(quantities))
+        reserved.update(stock_reserved=False)
+        _expire_stock_listings(order.pharmacy)
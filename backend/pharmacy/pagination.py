@@ -0,0 +1,119 @@
+import bisect
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Ints and floats compare with each other, so they count as one kind
+KEY_ELEMENT_KINDS = {int: 'number', float: 'number', str: 'str'}
+
+
+def _key_kinds(key):
+    """
+    Return the kind of each element of a sort key, or None if key is not a
+    list of scalars.
+    """
+    if not isinstance(key, (list, tuple)):
+        return None
+    kinds = tuple(KEY_ELEMENT_KINDS.get(type(value)) for value in key)
+    return None if None in kinds else kinds
+
+
+class MedicineCursorPagination(CursorPagination):
+    """
+    Keyset pagination for medicine listings; never issues a COUNT(*).
+    Search requests are paged in relevance order (see MedicineSearchFilter).
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-updated_at', '-id')
+
+
+class InboxCursorPagination(CursorPagination):
+    """
+    Keyset pagination for a pharmacy's prescription inbox: nearest first
+    (by the `proximity` annotation of geo.within_radius), newest first among
+    equally near ones.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-proximity', '-created_at', '-id')
+
+
+class SortedListCursorPagination(BasePagination):
+    """
+    Forward-only keyset pagination over an in-memory list that is already
+    sorted by a unique key, such as search_nearby results.
+
+    paginate_list() takes (key, item) pairs; the cursor carries the key of the
+    last item returned, so pages stay stable when rows ahead of the cursor
+    disappear between requests.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_list(self, pairs, request, scope=''):
+        self.request = request
+        self.scope = scope
+        page_size = self.get_page_size(request)
+        keys = [key for key, _ in pairs]
+        start = 0
+        after = self.decode_cursor(request, _key_kinds(keys[0]) if keys else None)
+        if after is not None:
+            start = bisect.bisect_right(keys, after)
+        page = pairs[start:start + page_size]
+        self.next_key = page[-1][0] if start + page_size < len(pairs) else None
+        return [item for _, item in page]
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request, kinds=None):
+        """
+        Return the key in the request's cursor. It must belong to this scope
+        and, when kinds is given, have the same length and element kinds as
+        the list's keys, so that it compares with them.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            scope, key = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            key_kinds = _key_kinds(key)
+            if scope != self.scope or key_kinds is None or (kinds is not None and key_kinds != kinds):
+                raise ValueError(key)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return tuple(key)
+
+    def encode_cursor(self, key):
+        encoded = urlsafe_b64encode(json.dumps([self.scope, list(key)]).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        return self.encode_cursor(self.next_key)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
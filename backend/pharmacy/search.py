@@ -0,0 +1,214 @@
+import re
+from decimal import Decimal
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import BooleanField, ExpressionWrapper, F, FloatField, Q, Value
+from rest_framework import filters
+from medconnect.geo import unit_vector, within_radius, proximity_to_km
+from .models import Medicine
+
+
+def normalize_name(name):
+    return ' '.join(re.findall(r'\w+', name.lower()))
+
+
+def medicine_search_query(term):
+    """
+    Build a prefix-matching full-text query, so "amox" matches "Amoxicillin".
+    Returns None when the term has no searchable words.
+    """
+    words = re.findall(r'\w+', term.lower())
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config='english')
+
+
+def medicine_match(term):
+    """
+    Return a Q matching medicines for term by full text or trigram similarity.
+    """
+    term = term.strip()
+    query = medicine_search_query(term)
+    if query is None:
+        return Q(name__trigram_word_similar=term)
+    return Q(search_vector=query) | Q(name__trigram_word_similar=term)
+
+
+def search_medicines(queryset, term):
+    """
+    Filter medicines matching term and annotate relevance.
+
+    Rows match on the stored search vector (GIN index) or on trigram word
+    similarity of the name (pg_trgm GIN index), which catches misspellings such
+    as "amoxicilin". Each row is annotated with `rank` (full-text) and
+    `similarity` (trigram); order with RELEVANCE_ORDERING.
+    """
+    term = term.strip()
+    query = medicine_search_query(term)
+    # Without searchable words (e.g. only punctuation) only the fuzzy match applies
+    rank = SearchRank(F('search_vector'), query) if query is not None else Value(0.0, output_field=FloatField())
+    return queryset.filter(medicine_match(term)).annotate(
+        rank=rank,
+        similarity=TrigramWordSimilarity(term, 'name'),
+    )
+
+
+RELEVANCE_ORDERING = ('-rank', '-similarity', 'id')
+
+# Unique, JSON-serializable sort keys; they double as pagination cursors
+NEARBY_SORTS = {
+    'distance': lambda row: (row['distance'], row['id']),
+    'price': lambda row: (float(row['price']), row['id']),
+    'relevance': lambda row: (-row['rank'], -row['similarity'], row['id']),
+}
+
+NEARBY_COLUMNS = (
+    'id', 'name', 'price', 'stock', 'requires_prescription', 'rank', 'similarity',
+    'pharmacy_id', 'pharmacy__business_name', 'pharmacy__latitude', 'pharmacy__longitude',
+    'pharmacy__unit_x', 'pharmacy__unit_y', 'pharmacy__unit_z',
+    'pharmacy__user__address', 'pharmacy__user__phone_number',
+)
+
+
+def nearby_medicine_rows(name, lat, lng, radius_km):
+    """
+    Return flat rows for medicines matching name within radius_km, in a
+    single query.
+
+    Only the columns search_nearby needs are fetched (including the pharmacy
+    user's contact fields), so the cost does not grow with the number of rows.
+    """
+    return list(within_radius(
+        search_medicines(Medicine.objects.all(), name), lat, lng, radius_km, prefix='pharmacy__'
+    ).values(*NEARBY_COLUMNS))
+
+
+def rank_nearby_rows(rows, lat, lng, radius_km, sort='distance'):
+    """
+    Measure rows from (lat, lng), drop those beyond radius_km, sort them and
+    shape them into search_nearby results.
+
+    Returns (sort key, result) pairs in order.
+    """
+    x, y, z = unit_vector(lat, lng)
+    sort_key = NEARBY_SORTS.get(sort, NEARBY_SORTS['distance'])
+    ranked = []
+    for row in rows:
+        proximity = row['pharmacy__unit_x'] * x + row['pharmacy__unit_y'] * y + row['pharmacy__unit_z'] * z
+        distance = proximity_to_km(proximity)
+        if distance <= radius_km:
+            row = dict(row, distance=distance)
+            ranked.append((sort_key(row), row))
+    ranked.sort(key=lambda pair: pair[0])
+    return [
+        (key, {
+            'id': row['id'],
+            'name': row['name'],
+            'price': row['price'],
+            'stock': row['stock'],
+            'requires_prescription': row['requires_prescription'],
+            'pharmacy': {
+                'id': row['pharmacy_id'],
+                'name': row['pharmacy__business_name'],
+                'address': row['pharmacy__user__address'],
+                'phone': row['pharmacy__user__phone_number'],
+                'latitude': row['pharmacy__latitude'],
+                'longitude': row['pharmacy__longitude'],
+            },
+            'distance': round(row['distance'], 2),
+        })
+        for key, row in ranked
+    ]
+
+
+BASKET_COLUMNS = (
+    'id', 'name', 'price', 'stock',
+    'pharmacy_id', 'pharmacy__business_name', 'pharmacy__latitude', 'pharmacy__longitude',
+    'pharmacy__unit_x', 'pharmacy__unit_y', 'pharmacy__unit_z',
+    'pharmacy__user__address', 'pharmacy__user__phone_number',
+)
+
+
+def basket_pharmacy_results(names, lat, lng, radius_km):
+    """
+    Rank pharmacies within radius_km by how many of the basket items they
+    have in stock, then by basket total and distance.
+
+    All items are matched in one query: each in-stock medicine row is flagged
+    with the basket items it matches, and rows are grouped per pharmacy here.
+    For every item a pharmacy stocks, the cheapest matching listing is used.
+    """
+    matches = {f'item_{index}': medicine_match(name) for index, name in enumerate(names)}
+    any_match = Q()
+    for match in matches.values():
+        any_match |= match
+    rows = within_radius(
+        Medicine.objects.filter(any_match, stock__gt=0), lat, lng, radius_km, prefix='pharmacy__'
+    ).annotate(**{
+        flag: ExpressionWrapper(match, output_field=BooleanField()) for flag, match in matches.items()
+    }).values(*BASKET_COLUMNS, *matches)
+
+    x, y, z = unit_vector(lat, lng)
+    pharmacies = {}
+    for row in rows:
+        pharmacy = pharmacies.get(row['pharmacy_id'])
+        if pharmacy is None:
+            proximity = row['pharmacy__unit_x'] * x + row['pharmacy__unit_y'] * y + row['pharmacy__unit_z'] * z
+            pharmacy = pharmacies[row['pharmacy_id']] = {
+                'id': row['pharmacy_id'],
+                'name': row['pharmacy__business_name'],
+                'address': row['pharmacy__user__address'],
+                'phone': row['pharmacy__user__phone_number'],
+                'latitude': row['pharmacy__latitude'],
+                'longitude': row['pharmacy__longitude'],
+                'distance': proximity_to_km(proximity),
+                'items': {},
+            }
+        for index, name in enumerate(names):
+            if not row[f'item_{index}']:
+                continue
+            best = pharmacy['items'].get(index)
+            if best is None or (row['price'], row['id']) < (best['price'], best['medicine_id']):
+                pharmacy['items'][index] = {
+                    'query': name,
+                    'medicine_id': row['id'],
+                    'name': row['name'],
+                    'price': row['price'],
+                    'stock': row['stock'],
+                }
+
+    results = []
+    for pharmacy in pharmacies.values():
+        if pharmacy['distance'] > radius_km:
+            continue
+        items = [pharmacy['items'][index] for index in sorted(pharmacy['items'])]
+        results.append(dict(
+            pharmacy,
+            distance=round(pharmacy['distance'], 2),
+            items=items,
+            matched_count=len(items),
+            missing=[name for index, name in enumerate(names) if index not in pharmacy['items']],
+            total_price=sum((item['price'] for item in items), Decimal('0.00')),
+        ))
+    results.sort(key=lambda result: (-result['matched_count'], result['total_price'], result['distance'], result['id']))
+    return results
+
+
+class MedicineSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter (same `search` parameter) that uses
+    the indexed full-text and trigram search and orders by relevance.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '')
+        if not term.strip():
+            return queryset
+        return search_medicines(queryset, term).order_by(*RELEVANCE_ORDERING)
+
+    def get_ordering(self, request, queryset, view):
+        # Lets cursor pagination page through search results by relevance,
+        # and keeps the paginator's own ordering for plain listings
+        if request.query_params.get(self.search_param, '').strip():
+            return RELEVANCE_ORDERING
+        return view.pagination_class.ordering
@@ -1,11 +1,13 @@
 from rest_framework import serializers
+from medconnect.geo import proximity_to_km
 from .models import Medicine, Prescription, Order, OrderItem
+from .ordering import MAX_ORDER_ITEMS
 from users.models import PharmacyProfile
 
 class MedicineSerializer(serializers.ModelSerializer):
     class Meta:
         model = Medicine
-        fields = '__all__'
+        exclude = ('search_vector',)
         
     def validate(self, data):
         # Validate pharmacy
@@ -55,7 +57,7 @@ class PrescriptionSerializer(serializers.ModelSerializer):
     patient = serializers.PrimaryKeyRelatedField(read_only=True)
     class Meta:
         model = Prescription
-        fields = '__all__'
+        exclude = ('unit_x', 'unit_y', 'unit_z')
 
     def create(self, validated_data):
         print('DEBUG: context:', self.context)
@@ -65,11 +67,25 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         print('DEBUG: validated_data after:', validated_data)
         return super().create(validated_data)
 
+class InboxPrescriptionSerializer(PrescriptionSerializer):
+    # Kilometres from the pharmacy, from the proximity annotation
+    distance = serializers.SerializerMethodField()
+
+    def get_distance(self, obj):
+        return round(proximity_to_km(obj.proximity), 2)
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
 
+class OrderLineSerializer(serializers.Serializer):
+    medicine = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=10000)
+
+class OrderItemsSerializer(serializers.Serializer):
+    items = serializers.ListField(child=OrderLineSerializer(), allow_empty=True, max_length=MAX_ORDER_ITEMS)
+
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     
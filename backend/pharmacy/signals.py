@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from users.models import PharmacyProfile
+from .cache import invalidate_nearby_results
+from .models import Medicine, Order, Prescription
+from outbox.events import notify_users
+from .notifications import order_event, record_prescription_status
+from .spatial import pharmacy_index
+from .suggest import medicine_name_index
+
+
+@receiver(post_save, sender=PharmacyProfile)
+def refresh_pharmacy_location(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'latitude', 'longitude'} & set(update_fields):
+        return
+    pharmacy_id, latitude, longitude = instance.id, instance.latitude, instance.longitude
+    transaction.on_commit(lambda: pharmacy_index.update(pharmacy_id, latitude, longitude))
+
+
+@receiver(post_delete, sender=PharmacyProfile)
+def drop_pharmacy_location(sender, instance, **kwargs):
+    pharmacy_id = instance.id
+    transaction.on_commit(lambda: pharmacy_index.remove(pharmacy_id))
+
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def expire_nearby_results_for_medicine(sender, instance, **kwargs):
+    pharmacy = instance.pharmacy
+    latitude, longitude = pharmacy.latitude, pharmacy.longitude
+    transaction.on_commit(lambda: invalidate_nearby_results(latitude, longitude))
+
+
+@receiver(post_save, sender=PharmacyProfile)
+def expire_nearby_results_for_pharmacy(sender, instance, **kwargs):
+    locations = {(instance.latitude, instance.longitude)}
+    # A moved pharmacy must also drop out of results around where it was
+    previous = getattr(instance, '_loaded_location', (None, None))
+    if None not in previous:
+        locations.add(previous)
+    instance._loaded_location = (instance.latitude, instance.longitude)
+
+    def expire():
+        for latitude, longitude in locations:
+            invalidate_nearby_results(latitude, longitude)
+    transaction.on_commit(expire)
+
+
+@receiver(post_save, sender=Medicine)
+def index_medicine_name(sender, instance, created, **kwargs):
+    current = (instance.name, instance.stock)
+    # As loaded by Medicine.from_db, so no query is needed
+    previous = getattr(instance, '_loaded_listing', None)
+    instance._loaded_listing = current
+    if previous is None and not created:
+        # Loaded with name or stock deferred: the old listing is unknown, so
+        # leave the index to its next periodic rebuild
+        return
+
+    def apply():
+        if previous is not None:
+            medicine_name_index.discard(previous[0], previous[1] > 0)
+        medicine_name_index.add(current[0], current[1] > 0)
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Medicine)
+def unindex_medicine_name(sender, instance, **kwargs):
+    name, in_stock = instance.name, instance.stock > 0
+    transaction.on_commit(lambda: medicine_name_index.discard(name, in_stock))
+
+
+@receiver(post_save, sender=Prescription)
+def push_prescription_status(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'status', 'pharmacy'} & set(update_fields):
+        return
+    # Written in the save's transaction (see Prescription.save)
+    record_prescription_status(instance)
+
+
+@receiver(post_save, sender=Order)
+def push_order_status(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'status', 'total_amount'} & set(update_fields):
+        return
+    notify_users([instance.patient_id, instance.pharmacy.user_id], order_event(instance))
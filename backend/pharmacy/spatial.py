@@ -0,0 +1,262 @@
+import math
+import threading
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from medconnect.geo import EARTH_RADIUS_KM, unit_vector, within_radius, proximity_to_km
+
+# Every process bumps this shared counter after applying a location change,
+# so indexes in other processes (e.g. Celery workers) know theirs is stale.
+GENERATION_KEY = 'pharmacy_index:generation'
+
+
+def _shared_generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def _bump_generation():
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        # First use (or evicted); another process may create it concurrently
+        if cache.add(GENERATION_KEY, 1, timeout=None):
+            return 1
+        return cache.incr(GENERATION_KEY)
+
+
+class PharmacyLocationIndex:
+    """
+    Process-local KD-tree over pharmacy unit-sphere coordinates.
+
+    Answers "all pharmacies within r km" without touching the database. The
+    tree is built lazily from PharmacyProfile and kept current by location
+    changes reported through update()/remove():
+    changed pharmacies are tombstoned in the tree and kept in a small pending
+    set that is scanned linearly, and the tree is rebuilt in memory once that
+    set grows past MAX_PENDING. Changes made by other processes bump
+    GENERATION_KEY in the cache, which makes this index cold until it is
+    rebuilt; it also expires after MAX_AGE seconds in any case.
+
+    build() reads the database without holding the lock; changes reported
+    while it runs are journaled and replayed onto the new tree, so none are
+    lost to a concurrent rebuild.
+    """
+    LEAF_SIZE = 16
+    MAX_PENDING = 256
+    MAX_AGE = 300
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._built_at = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._points = np.empty((0, 3), dtype=np.float64)
+            self._nodes = []
+            self._pending = {}
+            self._removed = set()
+            # (pharmacy_id, point or None) changes reported while builds run
+            self._journal = None
+            self._builds = 0
+            # Shared generation the tree was read at, and later ones that
+            # were this index's own (already applied) changes
+            self._generation = 0
+            self._own_generations = set()
+
+    @property
+    def is_warm(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at >= self.MAX_AGE:
+            return False
+        generation = _shared_generation()
+        with self._lock:
+            if generation < self._generation:
+                return False
+            if any(own not in self._own_generations for own in range(self._generation + 1, generation + 1)):
+                return False
+            # Only this index's own changes since; no need to check them again
+            self._generation = generation
+            self._own_generations = {own for own in self._own_generations if own > generation}
+            return True
+
+    def build(self):
+        """
+        (Re)build the tree from every located pharmacy in the database.
+        """
+        with self._lock:
+            if self._journal is None:
+                self._journal = []
+            self._builds += 1
+            start = len(self._journal)
+        try:
+            # Read before the rows, so changes committed meanwhile make it stale
+            generation = _shared_generation()
+            rows = self._read_locations()
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            points = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 3)
+            with self._lock:
+                self._load(ids, points)
+                # The snapshot may predate these; applying them again is harmless
+                for pharmacy_id, point in self._journal[start:]:
+                    self._apply(pharmacy_id, point)
+                self._generation = generation
+                self._own_generations = {own for own in self._own_generations if own > generation}
+        finally:
+            with self._lock:
+                self._builds -= 1
+                if not self._builds:
+                    self._journal = None
+
+    def _read_locations(self):
+        from users.models import PharmacyProfile
+        return list(
+            PharmacyProfile.objects.filter(unit_x__isnull=False)
+            .values_list('id', 'unit_x', 'unit_y', 'unit_z')
+        )
+
+    def update(self, pharmacy_id, latitude, longitude):
+        """
+        Record a pharmacy's new location, committed by this process. Applied
+        only once the tree exists or while it is being built, but always
+        published to other processes.
+        """
+        x, y, z = unit_vector(latitude, longitude)
+        self._record(pharmacy_id, None if x is None else (x, y, z))
+
+    def remove(self, pharmacy_id):
+        self._record(pharmacy_id, None)
+
+    def _record(self, pharmacy_id, point):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((pharmacy_id, point))
+            if self._built_at is not None:
+                self._apply(pharmacy_id, point)
+        generation = _bump_generation()
+        with self._lock:
+            self._own_generations.add(generation)
+
+    def _apply(self, pharmacy_id, point):
+        self._removed.add(pharmacy_id)
+        if point is None:
+            self._pending.pop(pharmacy_id, None)
+        else:
+            self._pending[pharmacy_id] = point
+        self._maybe_compact()
+
+    def within(self, lat, lng, radius_km):
+        """
+        Return [(pharmacy_id, distance_km)] within radius_km, nearest first,
+        or None when the index is cold.
+        """
+        if not self.is_warm:
+            return None
+        query = np.array(unit_vector(lat, lng))
+        # Compare squared chord lengths, which order exactly like arc length
+        chord = 2.0 * math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi) / 2.0)
+        limit = chord * chord
+        with self._lock:
+            ids, points, nodes = self._ids, self._points, self._nodes
+            pending, removed = dict(self._pending), set(self._removed)
+
+        found = {}
+        stack = [0] if nodes else []
+        while stack:
+            lo, hi, start, end, left, right = nodes[stack.pop()]
+            if _box_distance_sq(query, lo, hi) > limit:
+                continue
+            if left < 0:
+                dist_sq = np.sum((points[start:end] - query) ** 2, axis=1)
+                for index in np.nonzero(dist_sq <= limit)[0]:
+                    pharmacy_id = int(ids[start + index])
+                    if pharmacy_id not in removed:
+                        found[pharmacy_id] = float(dist_sq[index])
+            else:
+                stack.extend((left, right))
+        for pharmacy_id, point in pending.items():
+            dist_sq = float(np.sum((np.array(point) - query) ** 2))
+            if dist_sq <= limit:
+                found[pharmacy_id] = dist_sq
+        return sorted(
+            ((pharmacy_id, _chord_sq_to_km(dist_sq)) for pharmacy_id, dist_sq in found.items()),
+            key=lambda match: match[1]
+        )
+
+    def _maybe_compact(self):
+        if len(self._pending) + len(self._removed) <= self.MAX_PENDING:
+            return
+        keep = ~np.isin(self._ids, list(self._removed))
+        ids = np.concatenate([self._ids[keep], np.array(list(self._pending), dtype=np.int64)])
+        points = np.concatenate([
+            self._points[keep],
+            np.array(list(self._pending.values()), dtype=np.float64).reshape(-1, 3),
+        ])
+        self._load(ids, points, built_at=self._built_at)
+
+    def _load(self, ids, points, built_at=None):
+        order = np.arange(len(ids))
+        nodes = []
+        if len(ids):
+            self._split(points, order, 0, len(ids), nodes)
+        self._ids = ids[order]
+        self._points = points[order]
+        self._nodes = nodes
+        self._pending = {}
+        self._removed = set()
+        self._built_at = built_at if built_at is not None else time.monotonic()
+
+    def _split(self, points, order, start, end, nodes):
+        """
+        Build the subtree over order[start:end] in place; returns its node index.
+        Nodes are (lo, hi, start, end, left, right) with left == -1 for leaves.
+        """
+        segment = points[order[start:end]]
+        lo, hi = segment.min(axis=0), segment.max(axis=0)
+        node_index = len(nodes)
+        nodes.append((lo, hi, start, end, -1, -1))
+        if end - start <= self.LEAF_SIZE:
+            return node_index
+        axis = int(np.argmax(hi - lo))
+        mid = (end - start) // 2
+        order[start:end] = order[start:end][np.argpartition(segment[:, axis], mid)]
+        left = self._split(points, order, start, start + mid, nodes)
+        right = self._split(points, order, start + mid, end, nodes)
+        nodes[node_index] = (lo, hi, start, end, left, right)
+        return node_index
+
+
+def _box_distance_sq(query, lo, hi):
+    gap = np.maximum(lo - query, 0.0) + np.maximum(query - hi, 0.0)
+    return float(np.dot(gap, gap))
+
+
+def _chord_sq_to_km(chord_sq):
+    return 2.0 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2.0))
+
+
+pharmacy_index = PharmacyLocationIndex()
+
+
+def pharmacies_within(lat, lng, radius_km):
+    """
+    Return [(pharmacy_id, distance_km)] within radius_km, nearest first.
+
+    Served from the in-memory index when it is warm; otherwise answered from
+    the database and the index is built for subsequent calls once the
+    caller's transaction, which may hold row locks, has committed.
+    """
+    matches = pharmacy_index.within(lat, lng, radius_km)
+    if matches is not None:
+        return matches
+    from users.models import PharmacyProfile
+    rows = within_radius(
+        PharmacyProfile.objects.all(), lat, lng, radius_km
+    ).order_by('-proximity').values_list('id', 'proximity')
+    matches = [(pharmacy_id, proximity_to_km(proximity)) for pharmacy_id, proximity in rows]
+    transaction.on_commit(pharmacy_index.build)
+    return matches
@@ -0,0 +1,146 @@
+import bisect
+import heapq
+import threading
+import time
+
+from django.db.models import Count, Q
+
+from .models import Medicine
+from .search import normalize_name
+
+
+class MedicineNameIndex:
+    """
+    Process-local prefix index over distinct medicine names.
+
+    Keeps a sorted list of normalized names alongside per-name listing and
+    in-stock counts; the completions for a prefix are the matching range of
+    the sorted list ranked by availability. Ranked completions are memoized
+    per prefix and only the prefixes of a changed name are forgotten, so
+    repeated keystrokes are dictionary lookups.
+
+    The index is built lazily from the database, adjusted in place as
+    medicines are saved or deleted in this process (see pharmacy.signals),
+    and rebuilt after MAX_AGE seconds to pick up changes made elsewhere,
+    including bulk stock updates that bypass signals.
+    """
+    MAX_AGE = 600
+    MAX_LIMIT = 50
+    MAX_MEMOIZED = 20000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._built_at = None
+            self._names = []
+            self._entries = {}
+            self._top = {}
+
+    @property
+    def is_warm(self):
+        built_at = self._built_at
+        return built_at is not None and time.monotonic() - built_at < self.MAX_AGE
+
+    def build(self):
+        rows = Medicine.objects.values('name').annotate(
+            listings=Count('id'),
+            available=Count('id', filter=Q(stock__gt=0)),
+        )
+        entries = {}
+        for row in rows:
+            key = normalize_name(row['name'])
+            if not key:
+                continue
+            entry = entries.setdefault(key, [row['name'], 0, 0])
+            entry[1] += row['listings']
+            entry[2] += row['available']
+        with self._lock:
+            self._entries = entries
+            self._names = sorted(entries)
+            self._top = {}
+            self._built_at = time.monotonic()
+
+    def add(self, name, in_stock):
+        self._adjust(name, 1, 1 if in_stock else 0)
+
+    def discard(self, name, in_stock):
+        self._adjust(name, -1, -1 if in_stock else 0)
+
+    def _adjust(self, name, listings, available):
+        key = normalize_name(name)
+        if not key:
+            return
+        with self._lock:
+            if self._built_at is None:
+                return
+            entry = self._entries.get(key)
+            if entry is None:
+                if listings <= 0:
+                    return
+                entry = self._entries[key] = [name, 0, 0]
+                bisect.insort(self._names, key)
+            entry[1] += listings
+            entry[2] = max(entry[2] + available, 0)
+            if entry[1] <= 0:
+                del self._entries[key]
+                del self._names[bisect.bisect_left(self._names, key)]
+            for end in range(1, len(key) + 1):
+                self._top.pop(key[:end], None)
+
+    def _ranked(self, prefix):
+        """
+        Return the best MAX_LIMIT (key, display name, available) for prefix.
+        """
+        top = self._top.get(prefix)
+        if top is not None:
+            return top
+        with self._lock:
+            start = bisect.bisect_left(self._names, prefix)
+            end = bisect.bisect_left(self._names, prefix + '\uffff', lo=start)
+            entries = self._entries
+            best = heapq.nsmallest(
+                self.MAX_LIMIT, self._names[start:end],
+                key=lambda key: (-entries[key][2], -entries[key][1], key)
+            )
+            top = [(key, entries[key][0], entries[key][2]) for key in best]
+            if len(self._top) >= self.MAX_MEMOIZED:
+                self._top.clear()
+            self._top[prefix] = top
+        return top
+
+    def complete(self, prefix, limit=10, preferred=()):
+        """
+        Return up to `limit` completions of prefix as dicts with the display
+        name and in-stock listing count, most available first. Names starting
+        with any of the `preferred` terms (e.g. the user's recent searches)
+        are ranked ahead of the rest.
+        """
+        if not self.is_warm:
+            self.build()
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, self.MAX_LIMIT)
+
+        ranked = []
+        for term in preferred:
+            term = normalize_name(term)
+            if term.startswith(prefix):
+                ranked.extend(self._ranked(term))
+        ranked.extend(self._ranked(prefix))
+
+        results, seen = [], set()
+        for key, name, available in ranked:
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append({'name': name, 'available': available})
+            if len(results) == limit:
+                break
+        return results
+
+
+medicine_name_index = MedicineNameIndex()
@@ -0,0 +1,68 @@
+import logging
+from decimal import Decimal
+
+from celery import shared_task
+from django.db import transaction
+
+from outbox.events import notify_users
+from users.models import PharmacyProfile
+from .models import Order, Prescription
+from .spatial import pharmacies_within
+
+logger = logging.getLogger(__name__)
+
+FAN_OUT_RADIUS_KM = 10
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=10)
+def fan_out_prescription(self, prescription_id):
+    """
+    Route a new prescription: notify pharmacies within FAN_OUT_RADIUS_KM and
+    open a pending order with the nearest one (or any pharmacy when none is
+    near or the prescription has no location).
+
+    Queued through the outbox in the transaction that creates the
+    prescription. Safe to retry: the prescription row is locked and nothing
+    happens if it already has an order.
+    """
+    try:
+        with transaction.atomic():
+            prescription = Prescription.objects.select_for_update(of=('self',)).select_related('patient').filter(
+                pk=prescription_id
+            ).first()
+            if prescription is None or Order.objects.filter(prescription=prescription).exists():
+                return
+
+            nearby = []
+            if prescription.latitude is not None and prescription.longitude is not None:
+                nearby = pharmacies_within(float(prescription.latitude), float(prescription.longitude), FAN_OUT_RADIUS_KM)
+            if nearby:
+                pharmacy = PharmacyProfile.objects.filter(id=nearby[0][0]).first()
+            else:
+                pharmacy = PharmacyProfile.objects.first()
+            if pharmacy is None:
+                logger.warning('No pharmacy found to create order for prescription %s', prescription.id)
+                return
+            Order.objects.create(
+                patient=prescription.patient,
+                pharmacy=pharmacy,
+                prescription=prescription,
+                status='pending',
+                total_amount=Decimal('0.00'),
+                shipping_address=prescription.patient.address or 'N/A',
+            )
+            notify_nearby_pharmacies(prescription.id, nearby)
+    except Exception as error:
+        raise self.retry(exc=error)
+
+
+def notify_nearby_pharmacies(prescription_id, nearby):
+    user_ids = dict(PharmacyProfile.objects.filter(
+        id__in=[pharmacy_id for pharmacy_id, _ in nearby]
+    ).values_list('id', 'user_id'))
+    for pharmacy_id, distance in nearby:
+        notify_users([user_ids.get(pharmacy_id)], {
+            'type': 'prescription_nearby',
+            'id': prescription_id,
+            'distance': round(distance, 2),
+        })
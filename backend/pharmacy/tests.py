@@ -1,3 +1,926 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import random
+import threading
+from base64 import urlsafe_b64encode
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.db import connection
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from chat.models import ChatRoom
+from medconnect.geo import EARTH_RADIUS_KM, KM_PER_DEGREE_LAT, bounding_box, proximity_to_km, unit_vector
+from medconnect.streaming import aiter_json_array
+from users.models import User, PharmacyProfile, SearchHistory
+from .models import Medicine, Order, OrderItem, Prescription
+from .notifications import notification_group
+from .ordering import InsufficientStock, release_order_stock, set_order_items
+from .search import RELEVANCE_ORDERING, MedicineSearchFilter, search_medicines
+from .spatial import PharmacyLocationIndex, pharmacies_within, pharmacy_index
+from .suggest import medicine_name_index
+from .tasks import fan_out_prescription
+from .views import MedicineViewSet
+from outbox.dispatch import dispatch_pending
+from outbox.models import OutboxEvent
+
+
+def create_pharmacy(index, latitude, longitude):
+    user = User.objects.create_user(
+        username=f'pharmacy{index}',
+        email=f'pharmacy{index}@example.com',
+        password='testpass123',
+        user_type='pharmacy',
+        phone_number=f'09110000{index:02d}',
+        address=f'Pharmacy {index} Address, Addis Ababa',
+    )
+    return PharmacyProfile.objects.create(
+        user=user,
+        license_number=f'LIC{index:03d}',
+        business_name=f'Pharmacy {index}',
+        operating_hours='8:00-20:00',
+        latitude=Decimal(str(latitude)),
+        longitude=Decimal(str(longitude)),
+    )
+
+
+class GeoHelperTests(SimpleTestCase):
+    def assert_point(self, actual, expected):
+        for a, b in zip(actual, expected):
+            self.assertAlmostEqual(a, b, places=9)
+
+    def test_unit_vector(self):
+        self.assert_point(unit_vector(0, 0), (1, 0, 0))
+        self.assert_point(unit_vector(0, 90), (0, 1, 0))
+        self.assert_point(unit_vector(Decimal('90'), Decimal('38.74')), (0, 0, 1))
+        self.assert_point(unit_vector(-90, -120), (0, 0, -1))
+        # Both sides of the antimeridian are the same meridian
+        self.assert_point(unit_vector(9.03, 180), unit_vector(9.03, -180))
+        self.assertAlmostEqual(sum(c * c for c in unit_vector(9.03, 38.74)), 1.0)
+        self.assertEqual(unit_vector(None, 38.74), (None, None, None))
+        self.assertEqual(unit_vector(9.03, None), (None, None, None))
+
+    def test_bounding_box_encloses_the_circle(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(9.03, 38.74, 10)
+        lat_delta = 10 / KM_PER_DEGREE_LAT
+        self.assertAlmostEqual(min_lat, 9.03 - lat_delta)
+        self.assertAlmostEqual(max_lat, 9.03 + lat_delta)
+        # Meridians converge, so the box is wider in degrees than it is tall
+        self.assertGreater(max_lng - 38.74, lat_delta)
+        self.assertAlmostEqual(38.74 - min_lng, max_lng - 38.74)
+        for bearing in range(0, 360, 15):
+            lat, lng = self.destination(9.03, 38.74, 10, bearing)
+            self.assertTrue(min_lat <= lat <= max_lat and min_lng <= lng <= max_lng, bearing)
+
+    def test_bounding_box_near_the_poles_spans_all_longitudes(self):
+        self.assertEqual(bounding_box(89.95, 38.74, 10), (89.95 - 10 / KM_PER_DEGREE_LAT, 90.0, -180.0, 180.0))
+        self.assertEqual(bounding_box(-90, 0, 1)[:2], (-90.0, -90 + 1 / KM_PER_DEGREE_LAT))
+        self.assertEqual(bounding_box(-90, 0, 1)[2:], (-180.0, 180.0))
+
+    def test_bounding_box_across_the_antimeridian_spans_all_longitudes(self):
+        for lng in (179.99, -179.99):
+            min_lat, max_lat, min_lng, max_lng = bounding_box(0, lng, 10)
+            self.assertEqual((min_lng, max_lng), (-180.0, 180.0))
+            # The neighbour on the other side is kept
+            self.assertTrue(min_lng <= -lng <= max_lng)
+        # Close to, but not over, the antimeridian the box stays narrow
+        self.assertLess(bounding_box(0, 179.5, 10)[3], 180.0)
+
+    @staticmethod
+    def destination(lat, lng, distance_km, bearing):
+        lat, lng, bearing = math.radians(lat), math.radians(lng), math.radians(bearing)
+        angle = distance_km / EARTH_RADIUS_KM
+        dest_lat = math.asin(math.sin(lat) * math.cos(angle) + math.cos(lat) * math.sin(angle) * math.cos(bearing))
+        dest_lng = lng + math.atan2(
+            math.sin(bearing) * math.sin(angle) * math.cos(lat),
+            math.cos(angle) - math.sin(lat) * math.sin(dest_lat),
+        )
+        return math.degrees(dest_lat), math.degrees(dest_lng)
+
+    def test_proximity_to_km(self):
+        def distance(a, b):
+            return proximity_to_km(sum(x * y for x, y in zip(unit_vector(*a), unit_vector(*b))))
+
+        self.assertEqual(proximity_to_km(1.0), 0.0)
+        # Rounding can push the dot product just past 1 or -1
+        self.assertEqual(proximity_to_km(1.0 + 1e-12), 0.0)
+        self.assertAlmostEqual(proximity_to_km(-1.0 - 1e-12), math.pi * EARTH_RADIUS_KM)
+        self.assertAlmostEqual(distance((9.03, 38.74), (10.03, 38.74)), KM_PER_DEGREE_LAT, places=6)
+        self.assertAlmostEqual(distance((0, 179.99), (0, -179.99)), 0.02 * KM_PER_DEGREE_LAT, places=6)
+        self.assertAlmostEqual(distance((89.99, 0), (89.99, 180)), 0.02 * KM_PER_DEGREE_LAT, places=6)
+
+
+class PharmacyLocationIndexTests(TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        users = User.objects.bulk_create([
+            User(username=f'bulk{index}', email=f'bulk{index}@example.com', user_type='pharmacy')
+            for index in range(300)
+        ])
+        # Mostly around Addis Ababa, with a few far away to spread the tree
+        locations = [
+            (9.03 + rng.uniform(-0.3, 0.3), 38.74 + rng.uniform(-0.3, 0.3)) if index % 10
+            else (rng.uniform(-80, 80), rng.uniform(-180, 180))
+            for index in range(len(users))
+        ]
+        profiles = []
+        for user, (latitude, longitude) in zip(users, locations):
+            profile = PharmacyProfile(
+                user=user, license_number=f'BULK{user.id}', business_name=user.username, operating_hours='',
+                latitude=Decimal(f'{latitude:.6f}'), longitude=Decimal(f'{longitude:.6f}'),
+            )
+            profile.unit_x, profile.unit_y, profile.unit_z = unit_vector(profile.latitude, profile.longitude)
+            profiles.append(profile)
+        self.profiles = PharmacyProfile.objects.bulk_create(profiles)
+        self.locations = {
+            profile.id: (float(profile.latitude), float(profile.longitude)) for profile in self.profiles
+        }
+        self.index = PharmacyLocationIndex()
+        self.index.build()
+
+    def brute_force(self, lat, lng, radius_km):
+        query = unit_vector(lat, lng)
+        matches = []
+        for pharmacy_id, (latitude, longitude) in self.locations.items():
+            proximity = sum(a * b for a, b in zip(query, unit_vector(latitude, longitude)))
+            if proximity_to_km(proximity) <= radius_km:
+                matches.append(pharmacy_id)
+        return sorted(matches)
+
+    def assert_matches_brute_force(self, index=None):
+        index = index or self.index
+        for lat, lng, radius_km in [(9.03, 38.74, 5), (9.1, 38.8, 15), (9.0, 38.6, 40), (0, 0, 3000), (9.03, 38.74, 0.1)]:
+            matches = index.within(lat, lng, radius_km)
+            self.assertEqual(sorted(pharmacy_id for pharmacy_id, _ in matches), self.brute_force(lat, lng, radius_km))
+            distances = [distance for _, distance in matches]
+            self.assertEqual(distances, sorted(distances))
+
+    def test_within_matches_brute_force(self):
+        self.assert_matches_brute_force()
+        everything = self.index.within(0, 0, 25000)
+        self.assertEqual(len(everything), len(self.profiles))
+
+    def test_updates_and_removals_are_applied(self):
+        moved, removed = self.profiles[1], self.profiles[2]
+        self.index.update(moved.id, 9.5, 39.0)
+        self.locations[moved.id] = (9.5, 39.0)
+        self.index.remove(removed.id)
+        del self.locations[removed.id]
+        self.assertEqual([pharmacy_id for pharmacy_id, _ in self.index.within(9.5, 39.0, 0.5)], [moved.id])
+        self.assert_matches_brute_force()
+
+    def test_compaction_keeps_results(self):
+        self.index.MAX_PENDING = 4
+        for offset, profile in enumerate(self.profiles[1:20]):
+            self.index.update(profile.id, 8.9 + offset / 100, 38.7)
+            self.locations[profile.id] = (8.9 + offset / 100, 38.7)
+        for profile in self.profiles[20:25]:
+            self.index.remove(profile.id)
+            del self.locations[profile.id]
+        self.assertLessEqual(len(self.index._pending), self.index.MAX_PENDING)
+        self.assert_matches_brute_force()
+
+    def rebuild_with_changes_mid_read(self, index):
+        moved, removed = self.profiles[1], self.profiles[2]
+        read_locations = index._read_locations
+
+        def read_then_change():
+            rows = read_locations()
+            # Reported after the snapshot was taken
+            index.update(moved.id, 9.5, 39.0)
+            index.remove(removed.id)
+            return rows
+
+        with mock.patch.object(index, '_read_locations', read_then_change):
+            index.build()
+        self.locations[moved.id] = (9.5, 39.0)
+        del self.locations[removed.id]
+
+    def test_changes_during_a_rebuild_are_kept(self):
+        self.rebuild_with_changes_mid_read(self.index)
+        self.assert_matches_brute_force()
+
+    def test_changes_during_the_first_build_are_kept(self):
+        cold = PharmacyLocationIndex()
+        self.rebuild_with_changes_mid_read(cold)
+        self.assert_matches_brute_force(cold)
+
+    def test_changes_from_other_processes_make_the_index_cold(self):
+        self.index.update(self.profiles[1].id, 9.5, 39.0)
+        # Its own changes are already applied
+        self.assertTrue(self.index.is_warm)
+        PharmacyLocationIndex().remove(self.profiles[2].id)
+        self.assertIsNone(self.index.within(9.03, 38.74, 5))
+        self.index.build()
+        self.assertTrue(self.index.is_warm)
+
+    def test_cold_lookups_build_the_index_after_commit(self):
+        pharmacy_index.clear()
+        self.addCleanup(pharmacy_index.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            matches = pharmacies_within(9.03, 38.74, 5)
+            # Not while the caller's transaction may hold locks
+            self.assertFalse(pharmacy_index.is_warm)
+        self.assertTrue(pharmacy_index.is_warm)
+        expected = self.brute_force(9.03, 38.74, 5)
+        self.assertEqual(sorted(pharmacy_id for pharmacy_id, _ in matches), expected)
+        self.assertEqual(sorted(pharmacy_id for pharmacy_id, _ in pharmacy_index.within(9.03, 38.74, 5)), expected)
+
+
+class SearchNearbyTests(TestCase):
+    url = '/api/pharmacy/medicines/search_nearby/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def add_paracetamol(self, count):
+        start = PharmacyProfile.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(start, start + count):
+                pharmacy = create_pharmacy(index, 9.03 + index * 0.001, 38.74)
+                Medicine.objects.create(
+                    name='Paracetamol', description='Pain reliever', price=Decimal('25.00'),
+                    stock=10, pharmacy=pharmacy, requires_prescription=False,
+                )
+
+    def search(self, **params):
+        params = {'name': 'paracetamol', 'lat': 9.03, 'lng': 38.74, 'radius': 10, **params}
+        return self.client.get(self.url, params)
+
+    def test_returns_pharmacy_contact_details(self):
+        self.add_paracetamol(1)
+        response = self.search()
+        self.assertEqual(response.status_code, 200)
+        pharmacy = response.json()['results'][0]['pharmacy']
+        self.assertEqual(pharmacy['name'], 'Pharmacy 0')
+        self.assertEqual(pharmacy['address'], 'Pharmacy 0 Address, Addis Ababa')
+        self.assertEqual(pharmacy['phone'], '0911000000')
+
+    def test_query_count_does_not_grow_with_results(self):
+        self.add_paracetamol(1)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.search().json()['results']), 1)
+        self.add_paracetamol(30)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.search(page_size=100).json()['results']), 31)
+
+    def test_cached_results_are_reused_and_invalidated(self):
+        self.add_paracetamol(1)
+        self.search()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.search().json()['results']), 1)
+        # Nearby user in the same grid cell gets distances re-measured from their position
+        response = self.client.get(self.url, {'name': 'Paracetamol', 'lat': 9.0305, 'lng': 38.7405, 'radius': 10})
+        self.assertGreater(response.json()['results'][0]['distance'], 0)
+        medicine = Medicine.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            medicine.stock = 0
+            medicine.save()
+        self.assertEqual(self.search().json()['results'][0]['stock'], 0)
+
+    def test_moving_a_pharmacy_expires_results_at_both_locations(self):
+        self.add_paracetamol(1)
+        self.assertEqual(len(self.search().json()['results']), 1)
+        self.assertEqual(len(self.search(lat=10.5).json()['results']), 0)
+
+        pharmacy = PharmacyProfile.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            pharmacy.latitude = Decimal('10.5')
+            pharmacy.save()
+        self.assertEqual(len(self.search().json()['results']), 0)
+        self.assertEqual(len(self.search(lat=10.5).json()['results']), 1)
+
+    def test_cursor_pages_cover_results_in_order(self):
+        self.add_paracetamol(25)
+        response = self.search(page_size=10)
+        seen = []
+        while True:
+            body = response.json()
+            seen.extend(result['id'] for result in body['results'])
+            if body['next'] is None:
+                break
+            response = self.client.get(body['next'])
+        self.assertEqual(len(seen), 25)
+        distances = [result['distance'] for result in self.search(page_size=100).json()['results']]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(seen, [result['id'] for result in self.search(page_size=100).json()['results']])
+
+    def test_malformed_cursors_are_not_found(self):
+        self.add_paracetamol(3)
+        for cursor in [
+            'not base64!', ['distance'], ['distance', 5], ['distance', ['a']], ['distance', [0.5, [1]]],
+            ['distance', [0.5]], ['distance', ['a', 1]], ['distance', [True, 1]], ['price', [0.5, 1]],
+        ]:
+            if not isinstance(cursor, str):
+                cursor = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            self.assertEqual(self.search(cursor=cursor).status_code, 404, cursor)
+        # A well-formed cursor from an integral distance still works
+        cursor = urlsafe_b64encode(json.dumps(['distance', [0, 0]]).encode()).decode()
+        self.assertEqual(len(self.search(cursor=cursor).json()['results']), 3)
+
+
+class SearchBasketTests(TestCase):
+    url = '/api/pharmacy/medicines/search_basket/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def add_medicine(self, pharmacy, name, price, stock=10):
+        return Medicine.objects.create(
+            name=name, description=f'{name} tablets', price=Decimal(price),
+            stock=stock, pharmacy=pharmacy,
+        )
+
+    def test_ranks_pharmacies_by_items_stocked_then_total(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            near = create_pharmacy(0, 9.03, 38.74)
+            full = create_pharmacy(1, 9.05, 38.74)
+            far = create_pharmacy(2, 9.50, 38.74)
+            self.add_medicine(near, 'Paracetamol', '10.00')
+            self.add_medicine(near, 'Amoxicillin', '30.00', stock=0)
+            self.add_medicine(full, 'Paracetamol', '12.00')
+            self.add_medicine(full, 'Paracetamol', '11.00')
+            self.add_medicine(full, 'Amoxicillin', '20.00')
+            self.add_medicine(far, 'Paracetamol', '1.00')
+            self.add_medicine(far, 'Amoxicillin', '1.00')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {
+                'name': ['paracetamol', 'amoxicilin'], 'lat': 9.03, 'lng': 38.74, 'radius': 10,
+            })
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result['id'] for result in results], [full.id, near.id])
+
+        self.assertEqual(results[0]['matched_count'], 2)
+        self.assertEqual(results[0]['missing'], [])
+        self.assertEqual(Decimal(str(results[0]['total_price'])), Decimal('31.00'))
+        self.assertEqual([item['price'] for item in results[0]['items']], [11.0, 20.0])
+
+        self.assertEqual(results[1]['matched_count'], 1)
+        self.assertEqual(results[1]['missing'], ['amoxicilin'])
+        self.assertEqual(results[1]['distance'], 0.0)
+
+    def test_requires_names_and_location(self):
+        response = self.client.get(self.url, {'lat': 9.03, 'lng': 38.74})
+        self.assertEqual(response.status_code, 400)
+
+
+class MedicineSearchTests(TestCase):
+    def setUp(self):
+        pharmacy = create_pharmacy(0, 9.03, 38.74)
+        self.medicines = {
+            name: Medicine.objects.create(name=name, description=description, price=Decimal('5.00'), stock=5, pharmacy=pharmacy)
+            for name, description in [
+                ('Amoxicillin', 'Antibiotic capsules'),
+                ('Ibuprofen', 'Pain reliever, alternative to amoxicillin allergies'),
+                ('Paracetamol', 'Pain reliever and fever reducer'),
+            ]
+        }
+
+    def search(self, term):
+        return list(search_medicines(Medicine.objects.all(), term).order_by(*RELEVANCE_ORDERING))
+
+    def test_name_matches_outrank_description_matches(self):
+        results = self.search('amoxicillin')
+        self.assertEqual([medicine.name for medicine in results], ['Amoxicillin', 'Ibuprofen'])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_prefixes_and_stems_match(self):
+        self.assertEqual([medicine.name for medicine in self.search('parac')], ['Paracetamol'])
+        self.assertEqual([medicine.name for medicine in self.search('relievers')], ['Ibuprofen', 'Paracetamol'])
+
+    def test_misspellings_fall_back_to_trigrams(self):
+        results = self.search('amoxicilin')
+        self.assertEqual(results[0].name, 'Amoxicillin')
+        self.assertEqual(results[0].rank, 0)
+        self.assertGreater(results[0].similarity, 0.5)
+        self.assertEqual(self.search('zzzz'), [])
+
+    def test_filter_always_gives_the_paginator_an_ordering(self):
+        # DRF's CursorPagination asserts that a filter's ordering is not None
+        view = MedicineViewSet()
+        for params, ordering in [({}, ('-updated_at', '-id')), ({'search': '  '}, ('-updated_at', '-id')),
+                                 ({'search': 'amox'}, RELEVANCE_ORDERING)]:
+            request = Request(APIRequestFactory().get('/api/pharmacy/medicines/', params))
+            self.assertEqual(MedicineSearchFilter().get_ordering(request, Medicine.objects.all(), view), ordering)
+        response = APIClient().get('/api/pharmacy/medicines/', {'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_search_vector_is_written_with_the_row(self):
+        medicine = self.medicines['Paracetamol']
+        with CaptureQueriesContext(connection) as queries:
+            medicine.name = 'Acetaminophen'
+            medicine.save()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual([medicine.name for medicine in self.search('acetaminophen')], ['Acetaminophen'])
+        self.assertEqual(self.search('paracetamol'), [])
+
+
+class MedicineSuggestTests(TestCase):
+    url = '/api/pharmacy/medicines/suggest/'
+
+    def setUp(self):
+        medicine_name_index.clear()
+        self.pharmacies = [create_pharmacy(index, 9.03, 38.74) for index in range(3)]
+        for pharmacy in self.pharmacies:
+            self.add('Paracetamol 500mg', pharmacy)
+        self.add('Paracetamol Syrup', self.pharmacies[0])
+        self.add('Panadol', self.pharmacies[0], stock=0)
+        self.add('Ibuprofen', self.pharmacies[0])
+        self.client = APIClient()
+
+    def add(self, name, pharmacy, stock=10):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Medicine.objects.create(
+                name=name, description='', price=Decimal('5.00'), stock=stock, pharmacy=pharmacy,
+            )
+
+    def suggest(self, q, **params):
+        response = self.client.get(self.url, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_completes_prefixes_most_available_first(self):
+        self.assertEqual(self.suggest('PARA'), [
+            {'name': 'Paracetamol 500mg', 'available': 3},
+            {'name': 'Paracetamol Syrup', 'available': 1},
+        ])
+        self.assertEqual([row['name'] for row in self.suggest('pa')], [
+            'Paracetamol 500mg', 'Paracetamol Syrup', 'Panadol',
+        ])
+        self.assertEqual([row['name'] for row in self.suggest('pa', limit=1)], ['Paracetamol 500mg'])
+        self.assertEqual(self.suggest('xyz'), [])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_recent_searches_are_ranked_first(self):
+        patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123', user_type='patient',
+        )
+        SearchHistory.objects.create(user=patient, query='paracetamol syrup')
+        SearchHistory.objects.create(user=patient, query='ibuprofen')
+        self.client.force_authenticate(patient)
+        self.assertEqual([row['name'] for row in self.suggest('para')], ['Paracetamol Syrup', 'Paracetamol 500mg'])
+
+    def test_index_follows_renames_stock_and_deletes(self):
+        self.suggest('p')  # warm the index
+        syrup = Medicine.objects.get(name='Paracetamol Syrup')
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            syrup.name = 'Pediatric Syrup'
+            syrup.save()
+        # The previous listing comes from the loaded instance, not a SELECT
+        self.assertFalse([
+            query for query in queries if query['sql'].startswith('SELECT') and '"pharmacy_medicine"' in query['sql']
+        ])
+        self.assertEqual([row['name'] for row in self.suggest('para')], ['Paracetamol 500mg'])
+        self.assertEqual(self.suggest('ped'), [{'name': 'Pediatric Syrup', 'available': 1}])
+
+        listing = Medicine.objects.filter(name='Paracetamol 500mg').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            listing.stock = 0
+            listing.save()
+        self.assertEqual(self.suggest('para'), [{'name': 'Paracetamol 500mg', 'available': 2}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.get(name='Ibuprofen').delete()
+        self.assertEqual(self.suggest('ibu'), [])
+
+
+class StreamingListTests(TestCase):
+    def test_stream_returns_whole_list_as_json_array(self):
+        pharmacy = create_pharmacy(0, 9.03, 38.74)
+        for index in range(3):
+            Medicine.objects.create(
+                name=f'Medicine {index}', description='', price=Decimal('5.00'),
+                stock=1, pharmacy=pharmacy,
+            )
+        response = APIClient().get('/api/pharmacy/medicines/', {'stream': '1', 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(sorted(item['name'] for item in body), ['Medicine 0', 'Medicine 1', 'Medicine 2'])
+        self.assertNotIn('search_vector', body[0])
+
+    async def test_asgi_stream_is_sent_chunk_by_chunk(self):
+        pharmacy = await sync_to_async(create_pharmacy)(0, 9.03, 38.74)
+        for index in range(3):
+            await Medicine.objects.acreate(
+                name=f'Medicine {index}', description='', price=Decimal('5.00'),
+                stock=1, pharmacy=pharmacy,
+            )
+        with mock.patch.object(MedicineViewSet, 'stream_max_rows', 2):
+            response = await AsyncClient().get('/api/pharmacy/medicines/', {'stream': '1'})
+        # An async iterator, which the ASGI handler sends without buffering
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['X-Stream-Limit'], '2')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(body)), 2)
+
+    async def test_async_json_array_yields_before_reading_everything(self):
+        consumed = []
+
+        def items():
+            for index in range(10):
+                consumed.append(index)
+                yield {'id': index}
+
+        chunks = aiter_json_array(items(), pieces_per_chunk=3)
+        self.assertEqual(await anext(chunks), '[{"id": 0},{"id": 1}')
+        self.assertEqual(len(consumed), 2)
+        rest = ''.join([chunk async for chunk in chunks])
+        self.assertEqual(json.loads('[{"id": 0},{"id": 1}' + rest), [{'id': index} for index in range(10)])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class StatusNotificationTests(TestCase):
+    def setUp(self):
+        self.pharmacy = create_pharmacy(0, 9.03, 38.74)
+        self.patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123', user_type='patient',
+        )
+        self.layer = get_channel_layer()
+        self.patient_channel = self.listen(self.patient)
+        self.pharmacy_channel = self.listen(self.pharmacy.user)
+
+    def listen(self, user):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(notification_group(user.id), channel)
+        return channel
+
+    def receive(self, channel):
+        dispatch_pending()
+
+        async def receive():
+            return await asyncio.wait_for(self.layer.receive(channel), timeout=5)
+        return async_to_sync(receive)()['event']
+
+    def test_accept_pushes_status_and_chat_room_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            prescription = Prescription.objects.create(
+                patient=self.patient, prescription_image='https://example.com/rx.png'
+            )
+        self.receive(self.patient_channel)  # creation
+
+        client = APIClient()
+        client.force_authenticate(self.pharmacy.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f'/api/pharmacy/prescriptions/{prescription.id}/accept/')
+        self.assertEqual(response.status_code, 200)
+
+        expected = {
+            'type': 'prescription',
+            'id': prescription.id,
+            'status': 'accepted',
+            'pharmacy': self.pharmacy.id,
+            'chat_room_id': response.json()['chat_room_id'],
+        }
+        for channel in (self.patient_channel, self.pharmacy_channel):
+            event = self.receive(channel)
+            event.pop('updated_at')
+            self.assertEqual(event, expected)
+
+    def test_pharmacy_order_update_pushes_delta(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(
+                patient=self.patient, pharmacy=self.pharmacy, total_amount=Decimal('0.00'),
+                shipping_address='Addis Ababa',
+            )
+        self.receive(self.patient_channel)
+
+        client = APIClient()
+        client.force_authenticate(self.pharmacy.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/pharmacy/orders/{order.id}/', {'status': 'shipped'})
+        self.assertEqual(response.status_code, 200)
+        event = self.receive(self.patient_channel)
+        self.assertEqual((event['type'], event['id'], event['status']), ('order', order.id, 'shipped'))
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class PrescriptionFanOutTests(TestCase):
+    def setUp(self):
+        pharmacy_index.clear()
+        self.near = create_pharmacy(0, 9.03, 38.74)
+        self.farther = create_pharmacy(1, 9.06, 38.74)
+        self.far = create_pharmacy(2, 10.5, 38.74)
+        self.patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123',
+            user_type='patient', address='Bole, Addis Ababa',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.layer = get_channel_layer()
+
+    def listen(self, pharmacy):
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(notification_group(pharmacy.user_id), channel)
+        return channel
+
+    def received_types(self, channel):
+        queue = self.layer.channels.get(channel)
+        types = []
+        while queue is not None and not queue.empty():
+            types.append(async_to_sync(self.layer.receive)(channel)['event']['type'])
+        return types
+
+    def upload(self):
+        return self.client.post('/api/pharmacy/prescriptions/', {
+            'prescription_image': 'https://example.com/rx.png', 'latitude': '9.031', 'longitude': '38.741',
+        })
+
+    def test_fan_out_runs_after_commit(self):
+        channels = {pharmacy.id: self.listen(pharmacy) for pharmacy in (self.near, self.farther, self.far)}
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.upload()
+        self.assertEqual(response.status_code, 201)
+        # Nothing is routed inside the request, only recorded in the outbox
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(list(OutboxEvent.objects.filter(kind=OutboxEvent.TASK).values_list('targets', flat=True)), [
+            [fan_out_prescription.name],
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        dispatch_pending()
+        order = Order.objects.get()
+        self.assertEqual(
+            (order.prescription_id, order.pharmacy_id, order.status, order.shipping_address),
+            (response.json()['id'], self.near.id, 'pending', 'Bole, Addis Ababa'),
+        )
+        self.assertEqual(self.received_types(channels[self.near.id]), ['order', 'prescription_nearby'])
+        self.assertEqual(self.received_types(channels[self.farther.id]), ['prescription_nearby'])
+        self.assertEqual(self.received_types(channels[self.far.id]), [])
+
+    def test_fan_out_is_idempotent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            prescription_id = self.upload().json()['id']
+        dispatch_pending()
+        fan_out_prescription.apply(args=(prescription_id,))
+        self.assertEqual(Order.objects.filter(prescription_id=prescription_id).count(), 1)
+
+
+class PrescriptionInboxTests(TestCase):
+    def setUp(self):
+        self.pharmacy = create_pharmacy(0, 9.03, 38.74)
+        self.other = create_pharmacy(1, 9.05, 38.74)
+        self.patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123', user_type='patient',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacy.user)
+
+    def prescribe(self, latitude=None, longitude=None, **fields):
+        return Prescription.objects.create(
+            patient=self.patient, prescription_image='https://example.com/rx.png',
+            latitude=latitude, longitude=longitude, **fields,
+        )
+
+    def test_lists_nearby_pending_prescriptions_nearest_first(self):
+        farther = self.prescribe(9.05, 38.74)
+        near_old = self.prescribe(9.031, 38.74)
+        near_new = self.prescribe(9.031, 38.74)
+        self.prescribe(9.031, 38.74, pharmacy=self.other)
+        self.prescribe(9.031, 38.74, status='rejected')
+        self.prescribe()
+        self.prescribe(10.5, 38.74)
+
+        response = self.client.get('/api/pharmacy/prescriptions/inbox/')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([row['id'] for row in results], [near_new.id, near_old.id, farther.id])
+        self.assertAlmostEqual(results[0]['distance'], 0.11, places=2)
+        self.assertAlmostEqual(results[2]['distance'], 2.22, places=2)
+
+        response = self.client.get('/api/pharmacy/prescriptions/inbox/', {'radius': 1})
+        self.assertEqual([row['id'] for row in response.json()['results']], [near_new.id, near_old.id])
+
+    def test_pages_follow_the_cursor(self):
+        expected = [self.prescribe(9.03 + index / 1000, 38.74).id for index in range(5)]
+        seen = []
+        url = '/api/pharmacy/prescriptions/inbox/?page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                body = self.client.get(url).json()
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+            seen += [row['id'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(seen, expected)
+
+    def test_only_located_pharmacies_have_an_inbox(self):
+        PharmacyProfile.objects.filter(pk=self.pharmacy.pk).update(latitude=None, longitude=None)
+        self.client.force_authenticate(User.objects.get(pk=self.pharmacy.user_id))
+        self.assertEqual(self.client.get('/api/pharmacy/prescriptions/inbox/').status_code, 400)
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get('/api/pharmacy/prescriptions/inbox/').status_code, 403)
+
+
+class OrderItemsTests(TestCase):
+    def setUp(self):
+        self.pharmacy = create_pharmacy(0, 9.03, 38.74)
+        self.patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123', user_type='patient',
+        )
+        self.medicines = [
+            Medicine.objects.create(
+                name=f'Medicine {index}', description='', price=Decimal('2.50') * (index + 1),
+                stock=10, pharmacy=self.pharmacy,
+            )
+            for index in range(5)
+        ]
+        # e.g. a prescription order that already carries a fee
+        self.order = Order.objects.create(
+            patient=self.patient, pharmacy=self.pharmacy, total_amount=Decimal('10.00'),
+            shipping_address='Addis Ababa',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        self.url = f'/api/pharmacy/orders/{self.order.id}/set_items/'
+
+    def set_items(self, *lines):
+        return self.client.post(
+            self.url, {'items': [{'medicine': medicine.id, 'quantity': quantity} for medicine, quantity in lines]},
+            format='json',
+        )
+
+    def stock(self):
+        return [medicine.stock for medicine in Medicine.objects.filter(pharmacy=self.pharmacy).order_by('id')]
+
+    def test_sets_items_reserving_stock_and_updating_total(self):
+        response = self.set_items(*[(medicine, 2) for medicine in self.medicines])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), 5)
+        # 10.00 + 2 * (2.50 + 5.00 + 7.50 + 10.00 + 12.50)
+        self.assertEqual(Decimal(response.json()['total_amount']), Decimal('85.00'))
+        self.assertEqual(self.stock(), [8] * 5)
+
+        # Replacing the lines releases what is no longer ordered
+        response = self.set_items((self.medicines[0], 5))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [5, 10, 10, 10, 10])
+        self.assertEqual(Decimal(response.json()['total_amount']), Decimal('22.50'))
+
+    def test_query_count_does_not_grow_with_lines(self):
+        with CaptureQueriesContext(connection) as one_line:
+            self.set_items((self.medicines[0], 1))
+        self.set_items()
+        with CaptureQueriesContext(connection) as five_lines:
+            self.set_items(*[(medicine, 1) for medicine in self.medicines])
+        self.assertEqual(len(five_lines), len(one_line))
+
+    def test_insufficient_stock_changes_nothing(self):
+        response = self.set_items((self.medicines[0], 3), (self.medicines[1], 11))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['medicines'], [self.medicines[1].id])
+        self.assertEqual(self.stock(), [10] * 5)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('10.00'))
+        self.assertFalse(self.order.items.exists())
+
+    def test_rejects_medicines_from_other_pharmacies(self):
+        other = Medicine.objects.create(
+            name='Elsewhere', description='', price=Decimal('1.00'), stock=5, pharmacy=create_pharmacy(1, 9.0, 38.7),
+        )
+        response = self.set_items((self.medicines[0], 1), (other, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['medicines'], [other.id])
+
+    def test_add_item_reserves_stock_and_cancel_releases_it(self):
+        response = self.client.post(
+            f'/api/pharmacy/orders/{self.order.id}/add_item/', {'medicine': self.medicines[2].id, 'quantity': 4},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_amount, Decimal('40.00'))
+        self.assertEqual(self.stock()[2], 6)
+
+        self.client.patch(f'/api/pharmacy/orders/{self.order.id}/', {'status': 'cancelled'})
+        self.client.patch(f'/api/pharmacy/orders/{self.order.id}/', {'status': 'cancelled'})
+        self.assertEqual(self.stock()[2], 10)
+        self.assertEqual(self.set_items((self.medicines[0], 1)).status_code, 409)
+
+    def test_cancelled_orders_cannot_be_reopened_to_release_stock_again(self):
+        self.set_items((self.medicines[0], 4))
+        self.assertEqual(self.client.patch(f'/api/pharmacy/orders/{self.order.id}/', {'status': 'cancelled'}).status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/pharmacy/orders/{self.order.id}/', {'status': 'pending'}).status_code, 409)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'cancelled')
+        self.client.patch(f'/api/pharmacy/orders/{self.order.id}/', {'status': 'cancelled'})
+        self.assertEqual(self.stock()[0], 10)
+        # Items are kept for the record but no longer hold stock
+        self.assertEqual(list(self.order.items.values_list('stock_reserved', flat=True)), [False])
+        release_order_stock(self.order)
+        self.assertEqual(self.stock()[0], 10)
+
+    def test_deleting_an_order_releases_its_stock(self):
+        self.set_items((self.medicines[0], 4), (self.medicines[1], 2))
+        self.assertEqual(self.client.delete(f'/api/pharmacy/orders/{self.order.id}/').status_code, 204)
+        self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+        self.assertEqual(self.stock(), [10] * 5)
+
+    def test_items_that_hold_no_stock_release_none(self):
+        # e.g. lines added before stock was reserved
+        OrderItem.objects.create(order=self.order, medicine=self.medicines[0], quantity=3, price=Decimal('2.50'),
+                                 stock_reserved=False)
+        self.assertEqual(self.set_items((self.medicines[0], 1)).status_code, 200)
+        self.assertEqual(self.stock()[0], 9)
+        OrderItem.objects.create(order=self.order, medicine=self.medicines[1], quantity=2, price=Decimal('5.00'),
+                                 stock_reserved=False)
+        release_order_stock(self.order)
+        self.assertEqual(self.stock()[:2], [10, 10])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class StockReservationRaceTests(TransactionTestCase):
+    def test_concurrent_orders_never_oversell(self):
+        pharmacy = create_pharmacy(0, 9.03, 38.74)
+        medicine = Medicine.objects.create(
+            name='Scarce', description='', price=Decimal('5.00'), stock=3, pharmacy=pharmacy,
+        )
+        orders = [
+            Order.objects.create(
+                patient=User.objects.create_user(
+                    username=f'patient{index}', email=f'patient{index}@example.com', password='testpass123',
+                ),
+                pharmacy=pharmacy, total_amount=Decimal('0.00'), shipping_address='Addis Ababa',
+            )
+            for index in range(6)
+        ]
+        barrier = threading.Barrier(len(orders))
+        outcomes = []
+
+        def place(order):
+            try:
+                barrier.wait()
+                set_order_items(order, [(medicine.id, 1)])
+                outcomes.append('reserved')
+            except InsufficientStock:
+                outcomes.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=place, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(outcomes), ['reserved'] * 3 + ['short'] * 3)
+        medicine.refresh_from_db()
+        self.assertEqual(medicine.stock, 0)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PrescriptionClaimRaceTests(TransactionTestCase):
+    def test_exactly_one_pharmacy_claims_a_prescription(self):
+        pharmacies = [create_pharmacy(index, 9.03, 38.74) for index in range(8)]
+        patient = User.objects.create_user(
+            username='patient', email='patient@example.com', password='testpass123', user_type='patient',
+        )
+        prescription = Prescription.objects.create(patient=patient, prescription_image='https://example.com/rx.png')
+        OutboxEvent.objects.all().delete()
+        barrier = threading.Barrier(len(pharmacies))
+        outcomes = {}
+
+        def accept(pharmacy):
+            try:
+                client = APIClient()
+                client.force_authenticate(pharmacy.user)
+                barrier.wait()
+                outcomes[pharmacy.id] = client.post(f'/api/pharmacy/prescriptions/{prescription.id}/accept/')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=accept, args=(pharmacy,)) for pharmacy in pharmacies]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [pharmacy_id for pharmacy_id, response in outcomes.items() if response.status_code == 200]
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(sorted(response.status_code for response in outcomes.values()), [200] + [409] * 7)
+        prescription.refresh_from_db()
+        self.assertEqual((prescription.pharmacy_id, prescription.status), (winners[0], 'accepted'))
+        self.assertEqual(outcomes[winners[0]].json()['chat_room_id'], ChatRoom.objects.get().id)
+        # Only the winner's claim is announced
+        event, = OutboxEvent.objects.all()
+        self.assertEqual(event.payload['event']['pharmacy'], winners[0])
+
+    def test_unknown_prescription_is_not_found(self):
+        pharmacy = create_pharmacy(0, 9.03, 38.74)
+        client = APIClient()
+        client.force_authenticate(pharmacy.user)
+        self.assertEqual(client.post('/api/pharmacy/prescriptions/999/accept/').status_code, 404)
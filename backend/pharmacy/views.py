@@ -1,24 +1,49 @@
+from django.db import transaction
+from django.utils import timezone
 from django.shortcuts import render
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from django.db.models import F, FloatField
-from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
-from django.db.models.functions import ACos, Cos, Radians, Sin
 from .models import Medicine, Prescription, Order, OrderItem
-from .serializers import MedicineSerializer, PrescriptionSerializer, OrderSerializer, OrderItemSerializer
+from .serializers import (
+    MedicineSerializer, PrescriptionSerializer, InboxPrescriptionSerializer, OrderSerializer,
+    OrderItemSerializer, OrderLineSerializer, OrderItemsSerializer,
+)
+from .ordering import (
+    InsufficientStock, InvalidOrderItems, OrderNotEditable,
+    add_order_item, release_order_stock, set_order_items,
+)
+from .search import MedicineSearchFilter, NEARBY_SORTS, basket_pharmacy_results
+from .cache import nearby_medicine_results, cache_stats
+from .pagination import InboxCursorPagination, MedicineCursorPagination, SortedListCursorPagination
+from .notifications import record_prescription_status
+from .suggest import medicine_name_index
+from .tasks import FAN_OUT_RADIUS_KM, fan_out_prescription
+from outbox.events import enqueue_task
+from medconnect.geo import within_radius
+from medconnect.streaming import StreamingListMixin, stream_requested, streaming_json_response
 
 # Create your views here.
 
-class MedicineViewSet(viewsets.ModelViewSet):
+MAX_BASKET_ITEMS = 10
+MAX_BASKET_PHARMACIES = 20
+MAX_INBOX_RADIUS_KM = 50
+MAX_STREAMED_MEDICINES = 10000
+
+class MedicineViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = Medicine.objects.all()
     serializer_class = MedicineSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['name', 'description']
+    filter_backends = [MedicineSearchFilter]
+    pagination_class = MedicineCursorPagination
+    # The list is public; don't let one request stream the whole catalog
+    stream_max_rows = MAX_STREAMED_MEDICINES
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'search_nearby']:
+        if self.action in ['list', 'retrieve', 'search_nearby', 'search_basket', 'suggest']:
             return [permissions.AllowAny()]
+        if self.action == 'search_cache_stats':
+            return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticated()]
 
     def get_queryset(self):
@@ -45,7 +70,9 @@ class MedicineViewSet(viewsets.ModelViewSet):
         lat = request.query_params.get('lat')
         lng = request.query_params.get('lng')
         radius = float(request.query_params.get('radius', 10.0))  # Default 10km radius
-        sort = request.query_params.get('sort', 'distance')  # New: sort param
+        sort = request.query_params.get('sort', 'distance')  # distance, price or relevance
+        if sort not in NEARBY_SORTS:
+            sort = 'distance'
         
         if not all([name, lat, lng]):
             return Response(
@@ -62,51 +89,68 @@ class MedicineViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Calculate distance using Haversine formula with explicit output_field
-        distance_formula = (
-            6371.0 * ACos(
-                Cos(Radians(lat, output_field=FloatField())) * 
-                Cos(Radians(F('pharmacy__latitude'), output_field=FloatField())) * 
-                Cos(Radians(F('pharmacy__longitude'), output_field=FloatField()) - Radians(lng, output_field=FloatField())) + 
-                Sin(Radians(lat, output_field=FloatField())) * Sin(Radians(F('pharmacy__latitude'), output_field=FloatField())),
-                output_field=FloatField()
+        results = nearby_medicine_results(name, lat, lng, radius, sort)
+        if stream_requested(request):
+            return streaming_json_response((result for _, result in results), request)
+        paginator = SortedListCursorPagination()
+        page = paginator.paginate_list(results, request, scope=sort)
+        return paginator.get_paginated_response(page)
+
+    @action(detail=False, methods=['get'])
+    def search_basket(self, request):
+        """
+        Find pharmacies near a location that stock the most items of a basket.
+        Pass each medicine as a separate `name` parameter.
+        """
+        names = [name.strip() for name in request.query_params.getlist('name') if name.strip()]
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+
+        if not all([names, lat, lng]):
+            return Response(
+                {'error': 'At least one name, latitude and longitude are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(names) > MAX_BASKET_ITEMS:
+            return Response(
+                {'error': f'A basket can contain at most {MAX_BASKET_ITEMS} medicines'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            lat = float(lat)
+            lng = float(lng)
+            radius = float(request.query_params.get('radius', 10.0))
+        except ValueError:
+            return Response(
+                {'error': 'Invalid latitude, longitude or radius'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        )
 
-        queryset = Medicine.objects.annotate(
-            distance=distance_formula
-        ).filter(
-            name__icontains=name,
-            distance__lte=radius
-        ).select_related('pharmacy')
+        results = basket_pharmacy_results(names, lat, lng, radius)
+        return Response(results[:MAX_BASKET_PHARMACIES])
 
-        # Sort by distance or price
-        if sort == 'price':
-            queryset = queryset.order_by('price')
-        else:
-            queryset = queryset.order_by('distance')
-
-        # Include pharmacy information in the response
-        results = []
-        for medicine in queryset:
-            results.append({
-                'id': medicine.id,
-                'name': medicine.name,
-                'price': medicine.price,
-                'stock': medicine.stock,
-                'requires_prescription': medicine.requires_prescription,
-                'pharmacy': {
-                    'id': medicine.pharmacy.id,
-                    'name': medicine.pharmacy.business_name,
-                    'address': medicine.pharmacy.user.address,
-                    'phone': medicine.pharmacy.user.phone_number,
-                    'latitude': medicine.pharmacy.latitude,
-                    'longitude': medicine.pharmacy.longitude,
-                },
-                'distance': round(medicine.distance, 2)
-            })
-
-        return Response(results)
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Autocomplete medicine names by prefix, biased towards the user's recent searches
+        """
+        prefix = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        preferred = ()
+        if request.user.is_authenticated:
+            preferred = request.user.search_histories.order_by('-date').values_list('query', flat=True)[:20]
+        return Response(medicine_name_index.complete(prefix, limit=limit, preferred=preferred))
+
+    @action(detail=False, methods=['get'])
+    def search_cache_stats(self, request):
+        """
+        Hit/miss counters of the search_nearby result cache
+        """
+        return Response(cache_stats())
 
 class PrescriptionViewSet(viewsets.ModelViewSet):
     queryset = Prescription.objects.all()
@@ -124,7 +168,8 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         if not self.request.user.is_authenticated:
             return Prescription.objects.none()
         if self.request.user.user_type == 'pharmacy':
-            # Show all pending prescriptions that are not yet assigned to a pharmacy
+            # Show all pending prescriptions that are not yet assigned to a
+            # pharmacy; the inbox action lists only the nearby ones, paginated
             return Prescription.objects.filter(status='pending', pharmacy__isnull=True)
         elif self.request.user.user_type == 'patient':
             return Prescription.objects.filter(patient=self.request.user)
@@ -133,74 +178,79 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         latitude = self.request.data.get('latitude')
         longitude = self.request.data.get('longitude')
-        instance = serializer.save(patient=self.request.user, latitude=latitude, longitude=longitude)
-        from users.models import PharmacyProfile
-        nearest_pharmacy = None
-        if latitude and longitude:
-            from django.db.models import F, FloatField
-            from django.db.models.functions import ACos, Cos, Radians, Sin
-            lat = float(latitude)
-            lng = float(longitude)
-            distance_formula = (
-                6371.0 * ACos(
-                    Cos(Radians(lat, output_field=FloatField())) * 
-                    Cos(Radians(F('latitude'), output_field=FloatField())) * 
-                    Cos(Radians(F('longitude'), output_field=FloatField()) - Radians(lng, output_field=FloatField())) + 
-                    Sin(Radians(lat, output_field=FloatField())) * Sin(Radians(F('latitude'), output_field=FloatField())),
-                    output_field=FloatField()
-                )
-            )
-            nearby_pharmacies = PharmacyProfile.objects.annotate(
-                distance=distance_formula
-            ).filter(distance__lte=10).order_by('distance')
-            for pharmacy in nearby_pharmacies:
-                print(f"Notify pharmacy {pharmacy.business_name} (ID: {pharmacy.id}) about new prescription {instance.id}")
-            if nearby_pharmacies.exists():
-                nearest_pharmacy = nearby_pharmacies.first()
-        if not nearest_pharmacy:
-            nearest_pharmacy = PharmacyProfile.objects.first()
-        if nearest_pharmacy:
-            from decimal import Decimal
-            Order.objects.create(
-                patient=self.request.user,
-                pharmacy=nearest_pharmacy,
-                prescription=instance,
-                status='pending',
-                total_amount=Decimal('0.00'),
-                shipping_address=getattr(self.request.user, 'address', '') or 'N/A',
+        with transaction.atomic():
+            instance = serializer.save(patient=self.request.user, latitude=latitude, longitude=longitude)
+            # Routing to a pharmacy and notifying nearby ones happens in the background
+            enqueue_task(fan_out_prescription.name, instance.id)
+
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """
+        Pending, unassigned prescriptions within ?radius= km (default: the
+        fan-out radius, so the inbox matches the prescription_nearby
+        notifications) of the pharmacy, nearest and then newest first, each
+        with its distance. Cursor paginated. Prescriptions uploaded without a
+        location are routed by the fan-out and never listed here.
+        """
+        if request.user.user_type != 'pharmacy':
+            return Response({'detail': 'Only pharmacies have a prescription inbox.'}, status=status.HTTP_403_FORBIDDEN)
+        pharmacy = request.user.pharmacy_profile
+        if pharmacy.latitude is None or pharmacy.longitude is None:
+            return Response(
+                {'detail': 'Set the pharmacy location to see nearby prescriptions.'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        else:
-            print(f"No pharmacy found to create order for prescription {instance.id}")
+        try:
+            radius = float(request.query_params.get('radius', FAN_OUT_RADIUS_KM))
+        except ValueError:
+            return Response({'error': 'Invalid radius'}, status=status.HTTP_400_BAD_REQUEST)
+        radius = min(max(radius, 0.0), MAX_INBOX_RADIUS_KM)
+
+        # The filter matches the partial index rx_pending_unassigned_idx
+        pending = Prescription.objects.filter(status='pending', pharmacy__isnull=True)
+        prescriptions = within_radius(pending, float(pharmacy.latitude), float(pharmacy.longitude), radius)
+        paginator = InboxCursorPagination()
+        page = paginator.paginate_queryset(prescriptions, request, view=self)
+        serializer = InboxPrescriptionSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def accept(self, request, pk=None):
         """
         Pharmacy accepts a prescription: assign it to this pharmacy and update status to 'accepted'.
         Also, create a chat room between the pharmacy and the patient if it doesn't exist.
-        Returns the chat room ID and URL in the response.
+        Returns the chat room ID and URL in the response, or 409 if another
+        pharmacy got the prescription first.
         """
         if request.user.user_type != 'pharmacy':
             return Response({'detail': 'Only pharmacies can accept prescriptions.'}, status=status.HTTP_403_FORBIDDEN)
-        prescription = self.get_object()
-        if prescription.pharmacy is not None:
-            return Response({'detail': 'Prescription already assigned to a pharmacy.'}, status=status.HTTP_400_BAD_REQUEST)
-        prescription.pharmacy = request.user.pharmacy_profile
-        prescription.status = 'accepted'
-        prescription.save()
-        # Create chat room if not exists
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise NotFound()
         from chat.models import ChatRoom
-        patient = prescription.patient
-        pharmacy_user = request.user
-        chat_room = ChatRoom.objects.filter(participants=patient).filter(participants=pharmacy_user).first()
-        if not chat_room:
-            chat_room = ChatRoom.objects.create()
-            chat_room.participants.add(patient, pharmacy_user)
+        with transaction.atomic():
+            # Claim with one conditional UPDATE: of any number of pharmacies
+            # accepting at once, exactly one matches the still-unassigned row
+            claimed = Prescription.objects.filter(pk=pk, status='pending', pharmacy__isnull=True).update(
+                pharmacy=request.user.pharmacy_profile, status='accepted', updated_at=timezone.now(),
+            )
+            if not claimed:
+                if not Prescription.objects.filter(pk=pk).exists():
+                    raise NotFound()
+                return Response({'detail': 'Prescription already assigned to a pharmacy.'}, status=status.HTTP_409_CONFLICT)
+            prescription = Prescription.objects.select_related('patient', 'pharmacy').get(pk=pk)
+            # Create chat room if not exists (before recording the status
+            # notification, so it can point to it)
+            chat_room, _ = ChatRoom.get_or_create_for_pair(prescription.patient, request.user)
+            # update() sends no post_save, so record the notification here
+            record_prescription_status(prescription)
         data = self.get_serializer(prescription).data
         data['chat_room_id'] = chat_room.id
         data['chat_room_url'] = f"/api/chat/rooms/{chat_room.id}/"  # Add chat room API URL
         return Response(data)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(StreamingListMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -211,19 +261,84 @@ class OrderViewSet(viewsets.ModelViewSet):
         if not self.request.user.is_authenticated:
             return Order.objects.none()
         if self.request.user.user_type == 'pharmacy':
-            return Order.objects.filter(pharmacy=self.request.user.pharmacy_profile)
+            return Order.objects.filter(pharmacy=self.request.user.pharmacy_profile).prefetch_related('items')
         elif self.request.user.user_type == 'patient':
-            return Order.objects.filter(patient=self.request.user)
+            return Order.objects.filter(patient=self.request.user).prefetch_related('items')
         return Order.objects.none()
 
+    def update(self, request, *args, **kwargs):
+        try:
+            return super().update(request, *args, **kwargs)
+        except OrderNotEditable:
+            return Response(
+                {'error': 'A cancelled order cannot be reopened'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # Lock so that concurrent cancellations release the stock only once
+            previous_status = Order.objects.select_for_update().values_list('status', flat=True).get(
+                pk=serializer.instance.pk
+            )
+            # Cancelling is final: its stock has gone back and is not reserved again
+            if previous_status == 'cancelled' and serializer.validated_data.get('status', 'cancelled') != 'cancelled':
+                raise OrderNotEditable(previous_status)
+            order = serializer.save()
+            if order.status == 'cancelled' and previous_status != 'cancelled':
+                release_order_stock(order)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # The items go with the order, so put back whatever stock they still hold
+            release_order_stock(instance)
+            instance.delete()
+
     @action(detail=True, methods=['post'])
     def add_item(self, request, pk=None):
         """
-        Add an item to the order
+        Add an item to the order, reserving its stock
+        """
+        order = self.get_object()
+        serializer = OrderLineSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        line = serializer.validated_data
+        try:
+            item = add_order_item(order, line['medicine'], line['quantity'])
+        except (OrderNotEditable, InvalidOrderItems, InsufficientStock) as error:
+            return self.order_items_error(error)
+        return Response(OrderItemSerializer(item).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def set_items(self, request, pk=None):
+        """
+        Replace the order's items in one request: {"items": [{"medicine": id,
+        "quantity": n}, ...]}. Stock is reserved for all lines or none.
         """
         order = self.get_object()
-        serializer = OrderItemSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(order=order)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer = OrderItemsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        lines = [(line['medicine'], line['quantity']) for line in serializer.validated_data['items']]
+        try:
+            set_order_items(order, lines)
+        except (OrderNotEditable, InvalidOrderItems, InsufficientStock) as error:
+            return self.order_items_error(error)
+        return Response(self.get_serializer(self.get_queryset().get(pk=order.pk)).data)
+
+    def order_items_error(self, error):
+        if isinstance(error, OrderNotEditable):
+            return Response(
+                {'error': f'Items of a {error.args[0]} order cannot be changed'},
+                status=status.HTTP_409_CONFLICT
+            )
+        if isinstance(error, InvalidOrderItems):
+            return Response(
+                {'error': "Medicines not available from this order's pharmacy", 'medicines': error.medicine_ids},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'error': 'Insufficient stock', 'medicines': error.medicine_ids},
+            status=status.HTTP_409_CONFLICT
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_searchhistory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pharmacyprofile',
+            index=models.Index(fields=['latitude', 'longitude'], name='pharmacy_lat_lng_idx'),
+        ),
+    ]
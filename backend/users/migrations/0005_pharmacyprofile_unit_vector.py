@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 00:36
+
+from django.db import migrations, models
+
+from medconnect.geo import unit_vector
+
+
+def backfill_unit_vectors(apps, schema_editor):
+    PharmacyProfile = apps.get_model('users', 'PharmacyProfile')
+    rows = PharmacyProfile.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for row in rows.iterator():
+        row.unit_x, row.unit_y, row.unit_z = unit_vector(row.latitude, row.longitude)
+        row.save(update_fields=['unit_x', 'unit_y', 'unit_z'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_pharmacyprofile_lat_lng_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacyprofile',
+            name='unit_x',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pharmacyprofile',
+            name='unit_y',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='pharmacyprofile',
+            name='unit_z',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_unit_vectors, migrations.RunPython.noop),
+    ]
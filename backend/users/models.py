@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from medconnect.geo import unit_vector
 
 class User(AbstractUser):
     USER_TYPE_CHOICES = (
@@ -31,7 +32,31 @@ class PharmacyProfile(models.Model):
     is_verified = models.BooleanField(default=False)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True)
-    
+    # Unit-sphere coordinates derived from latitude/longitude on save
+    unit_x = models.FloatField(null=True, editable=False)
+    unit_y = models.FloatField(null=True, editable=False)
+    unit_z = models.FloatField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Serves the bounding-box prefilter used by nearby searches
+            models.Index(fields=['latitude', 'longitude'], name='pharmacy_lat_lng_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Where the pharmacy was, so moving it can expire caches for both places
+        instance._loaded_location = (instance.__dict__.get('latitude'), instance.__dict__.get('longitude'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.unit_x, self.unit_y, self.unit_z = unit_vector(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'unit_x', 'unit_y', 'unit_z'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.business_name
 
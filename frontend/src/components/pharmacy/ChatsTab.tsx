@@ -2,6 +2,11 @@ import React, { useState, useEffect, useRef } from 'react';
 import { MessageSquare, Search, Send } from 'lucide-react';
 import { useToast } from '../../contexts/ToastContext';
 import chatService, { ChatRoom, ChatMessage } from '../../services/chat.service';
+import { webSocketUrl } from '../../services/notifications.service';
+
+// Matches the server's CHAT_TYPING_INTERVAL / CHAT_TYPING_TTL defaults
+const TYPING_SEND_INTERVAL_MS = 2000;
+const TYPING_TTL_MS = 6000;
 
 const ChatsTab = () => {
   const [chats, setChats] = useState<ChatRoom[]>([]);
@@ -12,10 +17,13 @@ const ChatsTab = () => {
   const [searchTerm, setSearchTerm] = useState('');
   const [loading, setLoading] = useState(true);
   const [sendingMessage, setSendingMessage] = useState(false);
+  const [onlineUsers, setOnlineUsers] = useState<number[]>([]);
+  const [typingUsers, setTypingUsers] = useState<Record<number, number>>({}); // user id -> expiry (ms)
   
   const { showToast } = useToast();
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const wsRef = useRef<WebSocket | null>(null);
+  const lastTypingSentRef = useRef(0);
 
   // Load chats
   useEffect(() => {
@@ -97,6 +105,8 @@ const ChatsTab = () => {
   // Select a chat
   const handleSelectChat = async (chat: ChatRoom) => {
     setSelectedChat(chat);
+    setOnlineUsers([]);
+    setTypingUsers({});
 
     // Close previous WebSocket if any
     if (wsRef.current) {
@@ -110,14 +120,47 @@ const ChatsTab = () => {
       setMessages(chatMessages.reverse());
 
       // Open WebSocket connection
-      const wsProto = window.location.protocol === 'https:' ? 'wss' : 'ws';
-      const wsUrl = `${wsProto}://${window.location.host}/ws/chat/rooms/${chat.id}/`;
+      const wsUrl = webSocketUrl(`/ws/chat/rooms/${chat.id}/`);
       const ws = new window.WebSocket(wsUrl);
       wsRef.current = ws;
 
       ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
         if (data.error) return;
+        if (data.type === 'messages_persisted') {
+          // Swap provisional ids of write-behind messages for their database ids
+          const ids = new Map(data.messages.map((m: { provisional_id: string; id: number; created_at: string }) => [m.provisional_id, m]));
+          setMessages(prev => prev.map(msg => {
+            const persisted: any = ids.get(String(msg.id));
+            return persisted ? { ...msg, id: persisted.id, created_at: persisted.created_at } : msg;
+          }));
+          return;
+        }
+        if (data.type === 'messages_failed') {
+          setMessages(prev => prev.filter(msg => !data.provisional_ids.includes(String(msg.id))));
+          return;
+        }
+        if (data.type === 'presence') {
+          if (data.online) {
+            // Snapshot sent when the socket opens
+            setOnlineUsers(data.online);
+            setTypingUsers(Object.fromEntries(data.typing.map((userId: number) => [userId, Date.now() + TYPING_TTL_MS])));
+          } else {
+            setOnlineUsers(prev => data.status === 'online' ? [...prev.filter(u => u !== data.user), data.user] : prev.filter(u => u !== data.user));
+          }
+          return;
+        }
+        if (data.type === 'typing') {
+          setTypingUsers(prev => ({ ...prev, [data.user]: data.typing ? Date.now() + data.expires_in * 1000 : 0 }));
+          return;
+        }
+        if (data.type === 'resync') {
+          // The server dropped frames we were too slow to take; reload history
+          chatService.getChatMessages(chat.id).then(msgs => setMessages(msgs.reverse())).catch(() => {});
+          return;
+        }
+        if (data.type) return;
+        setTypingUsers(prev => ({ ...prev, [data.sender.id]: 0 }));
         setMessages(prev => [...prev, data]);
       };
       ws.onclose = () => {
@@ -132,6 +175,27 @@ const ChatsTab = () => {
     }
   };
 
+  // Drop typing indicators once they expire
+  useEffect(() => {
+    if (!Object.values(typingUsers).some(until => until > Date.now())) return;
+    const timer = setTimeout(() => {
+      setTypingUsers(prev => Object.fromEntries(Object.entries(prev).filter(([, until]) => until > Date.now())));
+    }, 1000);
+    return () => clearTimeout(timer);
+  }, [typingUsers]);
+
+  // Tell the room we're typing, at most every TYPING_SEND_INTERVAL_MS
+  const notifyTyping = () => {
+    const now = Date.now();
+    if (wsRef.current && wsRef.current.readyState === 1 && now - lastTypingSentRef.current > TYPING_SEND_INTERVAL_MS) {
+      wsRef.current.send(JSON.stringify({ type: 'typing' }));
+      lastTypingSentRef.current = now;
+    }
+  };
+
+  const patientOnline = selectedChat?.patient ? onlineUsers.includes(selectedChat.patient.id) : false;
+  const patientTyping = selectedChat?.patient ? (typingUsers[selectedChat.patient.id] || 0) > Date.now() : false;
+
   // Send a message
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -143,6 +207,7 @@ const ChatsTab = () => {
     try {
       if (wsRef.current && wsRef.current.readyState === 1) {
         wsRef.current.send(JSON.stringify({ content: newMessage.trim() }));
+        lastTypingSentRef.current = 0;
         setNewMessage('');
       } else {
         // fallback to REST if websocket not connected
@@ -237,6 +302,7 @@ const ChatsTab = () => {
               </h3>
               <p className="text-xs text-gray-500">
                 {selectedChat.patient?.phone_number || ''}
+                <span className={`ml-2 ${patientOnline ? 'text-green-600' : ''}`}>{patientOnline ? 'Online' : 'Offline'}</span>
               </p>
             </div>
             
@@ -268,6 +334,7 @@ const ChatsTab = () => {
                   <p className="text-sm mt-2">Start the conversation by sending a message</p>
                 </div>
               )}
+              {patientTyping && <p className="text-xs text-gray-500 italic">{selectedChat.patient.first_name} is typing…</p>}
               <div ref={messagesEndRef} />
             </div>
             
@@ -277,7 +344,10 @@ const ChatsTab = () => {
                 <input
                   type="text"
                   value={newMessage}
-                  onChange={(e) => setNewMessage(e.target.value)}
+                  onChange={(e) => {
+                    setNewMessage(e.target.value);
+                    notifyTyping();
+                  }}
                   placeholder="Type your message..."
                   className="input flex-grow"
                   disabled={sendingMessage}
@@ -19,6 +19,7 @@ function getAxiosError(error: unknown): { response?: { status?: number; data?: {
 
 const PrescriptionsTab = () => {
   const [prescriptions, setPrescriptions] = useState<PrescriptionResponse[]>([]);
+  const [nextPage, setNextPage] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
   const [viewPrescription, setViewPrescription] = useState<PrescriptionResponse | null>(null);
   const [responseModal, setResponseModal] = useState<PrescriptionResponse | null>(null);
@@ -36,9 +37,10 @@ const PrescriptionsTab = () => {
     const fetchPrescriptions = async () => {
       try {
         setLoading(true);
-        const data = await pharmacyService.getPrescriptions();
+        const page = await pharmacyService.getPrescriptionInbox();
         if (isMounted) {
-          setPrescriptions(data);
+          setPrescriptions(page.results);
+          setNextPage(page.next);
         }
       } catch (error: unknown) {
         const err = getAxiosError(error);
@@ -64,6 +66,17 @@ const PrescriptionsTab = () => {
     };
   }, [showToast]);
 
+  const loadMore = async () => {
+    if (!nextPage) return;
+    try {
+      const page = await pharmacyService.getPrescriptionInbox(nextPage);
+      setPrescriptions(prev => [...prev, ...page.results]);
+      setNextPage(page.next);
+    } catch (error: unknown) {
+      showToast(getAxiosError(error).message || 'Failed to load prescriptions', 'error');
+    }
+  };
+
   // Format date
   const formatDate = (dateString: string) => {
     return new Date(dateString).toLocaleDateString('en-US', { 
@@ -131,6 +144,12 @@ const PrescriptionsTab = () => {
       );
       showToast('Prescription accepted! You can now chat with the patient.', 'success');
     } catch (error: unknown) {
+      if (getAxiosError(error).response?.status === 409) {
+        // Another pharmacy claimed it first
+        setPrescriptions(prev => prev.filter(p => p.id !== prescriptionId));
+        showToast('Another pharmacy has already accepted this prescription.', 'error');
+        return;
+      }
       showToast((error as Error).message || 'Failed to accept prescription', 'error');
     }
   };
@@ -175,6 +194,7 @@ const PrescriptionsTab = () => {
                   
                   <p className="text-sm text-gray-500 mb-3">
                     Uploaded: {formatDate(prescription.created_at)}
+                    {prescription.distance !== undefined && ` · ${prescription.distance.toFixed(1)} km away`}
                   </p>
                   
                   {prescription.notes && (
@@ -213,6 +233,11 @@ const PrescriptionsTab = () => {
                 </div>
               </div>
             ))}
+            {nextPage && (
+              <button onClick={loadMore} className="btn-outline md:col-span-2 py-2">
+                Load more
+              </button>
+            )}
           </div>
         ) : (
           <div className="text-center py-12">
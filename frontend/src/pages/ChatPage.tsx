@@ -4,9 +4,13 @@ import { Send, Phone, MapPin, AlertCircle } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
 import { useToast } from '../contexts/ToastContext';
 import chatService, { ChatRoom, ChatMessage } from '../services/chat.service';
+import { webSocketUrl } from '../services/notifications.service';
 import clsx from 'clsx';
 
 const MAX_MESSAGES_PER_USER = 5;
+// Matches the server's CHAT_TYPING_INTERVAL / CHAT_TYPING_TTL defaults
+const TYPING_SEND_INTERVAL_MS = 2000;
+const TYPING_TTL_MS = 6000;
 
 const ChatPage = () => {
   const { id } = useParams<{ id: string }>();
@@ -19,7 +23,10 @@ const ChatPage = () => {
   const [userMessageCount, setUserMessageCount] = useState(0);
   const [pharmacyMessageCount, setPharmacyMessageCount] = useState(0);
   const [chatEnded, setChatEnded] = useState(false);
+  const [onlineUsers, setOnlineUsers] = useState<number[]>([]);
+  const [typingUsers, setTypingUsers] = useState<Record<number, number>>({}); // user id -> expiry (ms)
   const wsRef = useRef<WebSocket | null>(null);
+  const lastTypingSentRef = useRef(0);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const { user } = useAuth();
   const { showToast } = useToast();
@@ -64,14 +71,47 @@ const ChatPage = () => {
   // WebSocket connection for real-time chat
   useEffect(() => {
     if (!id || !user) return;
-    const wsProto = window.location.protocol === 'https:' ? 'wss' : 'ws';
-    const wsUrl = `${wsProto}://${window.location.host}/ws/chat/rooms/${id}/`;
+    const wsUrl = webSocketUrl(`/ws/chat/rooms/${id}/`);
     const ws = new window.WebSocket(wsUrl);
     wsRef.current = ws;
 
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.error) return;
+      if (data.type === 'messages_persisted') {
+        // Swap provisional ids of write-behind messages for their database ids
+        const ids = new Map(data.messages.map((m: { provisional_id: string; id: number; created_at: string }) => [m.provisional_id, m]));
+        setMessages(prev => prev.map(msg => {
+          const persisted: any = ids.get(String(msg.id));
+          return persisted ? { ...msg, id: persisted.id, created_at: persisted.created_at } : msg;
+        }));
+        return;
+      }
+      if (data.type === 'messages_failed') {
+        setMessages(prev => prev.filter(msg => !data.provisional_ids.includes(String(msg.id))));
+        return;
+      }
+      if (data.type === 'presence') {
+        if (data.online) {
+          // Snapshot sent when the socket opens
+          setOnlineUsers(data.online);
+          setTypingUsers(Object.fromEntries(data.typing.map((userId: number) => [userId, Date.now() + TYPING_TTL_MS])));
+        } else {
+          setOnlineUsers(prev => data.status === 'online' ? [...prev.filter(u => u !== data.user), data.user] : prev.filter(u => u !== data.user));
+        }
+        return;
+      }
+      if (data.type === 'typing') {
+        setTypingUsers(prev => ({ ...prev, [data.user]: data.typing ? Date.now() + data.expires_in * 1000 : 0 }));
+        return;
+      }
+      if (data.type === 'resync') {
+        // The server dropped frames we were too slow to take; reload history
+        chatService.getChatMessages(Number(id)).then(msgs => setMessages(msgs.reverse())).catch(() => {});
+        return;
+      }
+      if (data.type) return;
+      setTypingUsers(prev => ({ ...prev, [data.sender.id]: 0 }));
       setMessages(prev => [...prev, data]);
       scrollToBottom();
     };
@@ -87,6 +127,24 @@ const ChatPage = () => {
     scrollToBottom();
   }, [messages]);
 
+  // Drop typing indicators once they expire
+  useEffect(() => {
+    if (!Object.values(typingUsers).some(until => until > Date.now())) return;
+    const timer = setTimeout(() => {
+      setTypingUsers(prev => Object.fromEntries(Object.entries(prev).filter(([, until]) => until > Date.now())));
+    }, 1000);
+    return () => clearTimeout(timer);
+  }, [typingUsers]);
+
+  // Tell the room we're typing, at most every TYPING_SEND_INTERVAL_MS
+  const notifyTyping = () => {
+    const now = Date.now();
+    if (wsRef.current && wsRef.current.readyState === 1 && now - lastTypingSentRef.current > TYPING_SEND_INTERVAL_MS) {
+      wsRef.current.send(JSON.stringify({ type: 'typing' }));
+      lastTypingSentRef.current = now;
+    }
+  };
+
   // Send a message
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
@@ -95,6 +153,7 @@ const ChatPage = () => {
     try {
       if (wsRef.current && wsRef.current.readyState === 1) {
         wsRef.current.send(JSON.stringify({ content: messageText.trim() }));
+        lastTypingSentRef.current = 0;
         setMessageText('');
       } else {
         // fallback to REST if websocket not connected
@@ -137,6 +196,9 @@ const ChatPage = () => {
     });
   };
 
+  const pharmacyOnline = pharmacy ? onlineUsers.includes(pharmacy.id) : false;
+  const pharmacyTyping = pharmacy ? (typingUsers[pharmacy.id] || 0) > Date.now() : false;
+
   if (loading) {
     return (
       <div className="flex justify-center items-center h-screen">
@@ -154,6 +216,10 @@ const ChatPage = () => {
             <div className="flex justify-between items-center">
               <div>
                 <h1 className="text-xl font-bold">{pharmacy.first_name} {pharmacy.last_name}</h1>
+                <div className="flex items-center text-xs mt-1">
+                  <span className={clsx('h-2 w-2 rounded-full mr-1', pharmacyOnline ? 'bg-green-500' : 'bg-gray-300')} />
+                  <span className="text-gray-500">{pharmacyOnline ? 'Online' : 'Offline'}</span>
+                </div>
                 <div className="flex items-center text-gray-600 text-sm mt-1">
                   <MapPin className="h-4 w-4 mr-1" />
                   <span>{pharmacy.address}</span>
@@ -191,6 +257,7 @@ const ChatPage = () => {
           <div className="p-4 space-y-2" style={{ maxHeight: 400, overflowY: 'auto' }}>
             {messages.length === 0 && <div className="text-gray-400 text-center">No messages yet.</div>}
             {renderMessages()}
+            {pharmacyTyping && <div className="text-xs text-gray-500 italic mt-2">{pharmacy.first_name} is typing…</div>}
             <div ref={messagesEndRef} />
           </div>
           
@@ -210,7 +277,10 @@ const ChatPage = () => {
                   className="flex-1 border rounded px-3 py-2"
                   placeholder="Type your message..."
                   value={messageText}
-                  onChange={e => setMessageText(e.target.value)}
+                  onChange={e => {
+                    setMessageText(e.target.value);
+                    notifyTyping();
+                  }}
                   disabled={messageSending}
                 />
                 <button type="submit" className="btn-primary flex items-center gap-1" disabled={messageSending || !messageText.trim()}>
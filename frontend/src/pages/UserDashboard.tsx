@@ -6,8 +6,7 @@ import { useToast } from '../contexts/ToastContext';
 import userService, { Prescription, SearchHistory, Order } from '../services/user.service';
 import MapView from '../components/MapView';
 import chatService, { ChatRoom } from '../services/chat.service';
-
-const REFRESH_INTERVAL = 60000; // Refresh every 60 seconds instead of 30
+import { subscribeToNotifications, NotificationEvent } from '../services/notifications.service';
 
 const UserDashboard = () => {
   const [activeTab, setActiveTab] = useState<'searches' | 'prescriptions' | 'chats'>('searches');
@@ -83,14 +82,32 @@ const UserDashboard = () => {
     fetchTabData(true);
   }, [activeTab, user, fetchTabData]);
     
-  // Auto-refresh all data
+  // Apply status changes pushed by the server instead of polling
   useEffect(() => {
     if (!user) return;
-    const intervalId = setInterval(() => {
-      fetchAllData(false);
-    }, REFRESH_INTERVAL);
-    return () => clearInterval(intervalId);
-  }, [user, fetchAllData]);
+    const applyEvent = (event: NotificationEvent) => {
+      if (event.type !== 'prescription') return;
+      setPrescriptions(prev => {
+        if (!prev.some(p => p.id === event.id)) {
+          // A prescription we have not loaded yet; fetch the list once
+          userService.getPrescriptions().then(prescs => setPrescriptions(prescs || [])).catch(() => {});
+          return prev;
+        }
+        return prev.map(p => p.id === event.id
+          ? {
+              ...p,
+              status: event.status as typeof p.status,
+              updated_at: event.updated_at,
+              chat_room_id: event.chat_room_id ?? p.chat_room_id,
+            }
+          : p);
+      });
+    };
+    // Events sent while disconnected are not replayed, so resync after reconnecting
+    return subscribeToNotifications(applyEvent, () => {
+      userService.getPrescriptions().then(prescs => setPrescriptions(prescs || [])).catch(() => {});
+    });
+  }, [user]);
 
   // Add effect to get user location
   useEffect(() => {
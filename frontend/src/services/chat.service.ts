@@ -1,13 +1,32 @@
 import api from './api';
 import { UserProfile } from './user.service';
 
+export interface ChatParticipant {
+  id: number;
+  username: string;
+  first_name: string;
+  last_name: string;
+  user_type: 'patient' | 'pharmacy';
+  business_name: string | null;
+}
+
+export interface ChatMessagePreview {
+  id: number;
+  sender: number;
+  content: string;
+  created_at: string;
+}
+
 export interface ChatRoom {
   id: number;
   patient: UserProfile;
   pharmacy: UserProfile;
+  participants: ChatParticipant[];
   created_at: string;
   updated_at: string;
-  last_message?: ChatMessage;
+  last_message: ChatMessagePreview | null;
+  last_read_message_id: number;
+  unread_count: number;
 }
 
 export interface ChatMessage {
@@ -17,6 +36,15 @@ export interface ChatMessage {
   content: string;
   created_at: string;
   is_read: boolean;
+  // Set on WebSocket broadcasts that are not stored yet (write-behind mode)
+  provisional_id?: string;
+}
+
+// A page of message history, newest first; `next` loads older messages
+export interface MessagePage {
+  next: string | null;
+  previous: string | null;
+  results: ChatMessage[];
 }
 
 const chatService = {
@@ -32,9 +60,15 @@ const chatService = {
     return response.data;
   },
 
-  // Get messages for a chat room
+  // Get the most recent messages for a chat room, newest first
   getChatMessages: async (roomId: number): Promise<ChatMessage[]> => {
-    const response = await api.get(`/chat/rooms/${roomId}/messages/`);
+    const page = await chatService.getChatMessagePage(roomId);
+    return page.results;
+  },
+
+  // Get a page of message history; pass a page's `next` link to load older messages
+  getChatMessagePage: async (roomId: number, pageUrl?: string | null): Promise<MessagePage> => {
+    const response = await api.get<MessagePage>(pageUrl || `/chat/rooms/${roomId}/messages/`);
     return response.data;
   },
 
@@ -50,9 +84,15 @@ const chatService = {
     return response.data;
   },
 
-  // Get unread message count
+  // Mark a room read up to a message (default: the latest one)
+  markRead: async (roomId: number, messageId?: number): Promise<number> => {
+    const response = await api.post(`/chat/rooms/${roomId}/read/`, messageId ? { message_id: messageId } : {});
+    return response.data.last_read_message_id;
+  },
+
+  // Get unread message count across all rooms
   getUnreadCount: async (): Promise<number> => {
-    const response = await api.get('/chat/unread-count/');
+    const response = await api.get('/chat/rooms/unread-count/');
     return response.data.count;
   }
 };
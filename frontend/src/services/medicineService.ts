@@ -21,14 +21,44 @@ export interface Medicine {
   distance: number;
 }
 
+// Cursor-paginated list responses
+export interface CursorPage<T> {
+  next: string | null;
+  previous?: string | null;
+  results: T[];
+}
+
+export interface MedicineSuggestion {
+  name: string;
+  available: number;
+}
+
+export interface BasketItem {
+  query: string;
+  medicine_id: number;
+  name: string;
+  price: number;
+  stock: number;
+}
+
+export interface BasketPharmacy extends Pharmacy {
+  distance: number;
+  items: BasketItem[];
+  matched_count: number;
+  missing: string[];
+  total_price: number;
+}
+
 // Function to search medicines by name (for autocomplete)
 export const searchMedicines = async (query: string): Promise<string[]> => {
   try {
-    const response = await axios.get<Medicine[]>(`${API_URL}/pharmacy/medicines/`, {
-      params: { search: query }
+    const token = localStorage.getItem('access_token');
+    const response = await axios.get<MedicineSuggestion[]>(`${API_URL}/pharmacy/medicines/suggest/`, {
+      params: { q: query },
+      // Signed-in users get suggestions biased towards their search history
+      headers: token ? { Authorization: `Bearer ${token}` } : undefined
     });
-    // Extract unique medicine names from the response
-    return [...new Set(response.data.map((med: Medicine) => med.name))];
+    return response.data.map((suggestion) => suggestion.name);
   } catch (error) {
     console.error('Error searching medicines:', error);
     return [];
@@ -44,7 +74,7 @@ export const searchNearbyPharmacies = async (
   sort: 'distance' | 'price' = 'distance'
 ): Promise<Medicine[]> => {
   try {
-    const response = await axios.get<Medicine[]>(`${API_URL}/pharmacy/medicines/search_nearby/`, {
+    const response = await axios.get<CursorPage<Medicine>>(`${API_URL}/pharmacy/medicines/search_nearby/`, {
       params: {
         name,
         lat: latitude,
@@ -53,9 +83,29 @@ export const searchNearbyPharmacies = async (
         sort
       }
     });
-    return response.data;
+    return response.data.results;
   } catch (error) {
     console.error('Error searching nearby pharmacies:', error);
     throw error;
   }
-}; 
\ No newline at end of file
+}; 
+// Function to find nearby pharmacies stocking as much of a basket of medicines as possible
+export const searchBasket = async (
+  names: string[],
+  latitude: number,
+  longitude: number,
+  radius: number = 10
+): Promise<BasketPharmacy[]> => {
+  try {
+    const params = new URLSearchParams();
+    names.forEach((name) => params.append('name', name));
+    params.append('lat', String(latitude));
+    params.append('lng', String(longitude));
+    params.append('radius', String(radius));
+    const response = await axios.get<BasketPharmacy[]>(`${API_URL}/pharmacy/medicines/search_basket/`, { params });
+    return response.data;
+  } catch (error) {
+    console.error('Error searching basket:', error);
+    throw error;
+  }
+};
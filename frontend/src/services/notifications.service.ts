@@ -0,0 +1,86 @@
+import { Order, Prescription } from './user.service';
+
+// Compact deltas pushed on /ws/notifications/ after a change is committed
+export interface PrescriptionEvent {
+  type: 'prescription';
+  id: number;
+  status: Prescription['status'] | 'accepted';
+  pharmacy: number | null;
+  chat_room_id: number | null;
+  updated_at: string;
+}
+
+export interface OrderEvent {
+  type: 'order';
+  id: number;
+  status: Order['status'];
+  prescription: number | null;
+  total_amount: string;
+  updated_at: string;
+}
+
+// Sent to pharmacies near a newly uploaded prescription
+export interface NearbyPrescriptionEvent {
+  type: 'prescription_nearby';
+  id: number;
+  distance: number;
+}
+
+// Sent to the other participants of a room when a message is stored
+export interface ChatMessageEvent {
+  type: 'chat_message';
+  id: number;
+  room: number;
+  sender: number;
+}
+
+export type NotificationEvent = PrescriptionEvent | OrderEvent | NearbyPrescriptionEvent | ChatMessageEvent;
+
+const MAX_RETRY_DELAY = 30000;
+
+// Build a WebSocket URL for the backend, authenticated with the stored access token
+export const webSocketUrl = (path: string): string => {
+  const wsProto = window.location.protocol === 'https:' ? 'wss' : 'ws';
+  const token = localStorage.getItem('access_token');
+  const query = token ? `?token=${encodeURIComponent(token)}` : '';
+  return `${wsProto}://${window.location.host}${path}${query}`;
+};
+
+// Subscribe to the user's notifications. `onReconnect` runs whenever the socket
+// comes back after a drop, so callers can refetch anything they may have missed.
+// Returns a function that closes the subscription.
+export const subscribeToNotifications = (
+  onEvent: (event: NotificationEvent) => void,
+  onReconnect?: () => void
+): (() => void) => {
+  let socket: WebSocket | null = null;
+  let retryDelay = 1000;
+  let retryTimer: ReturnType<typeof setTimeout> | null = null;
+  let closed = false;
+  let connectedBefore = false;
+
+  const connect = () => {
+    socket = new window.WebSocket(webSocketUrl('/ws/notifications/'));
+    socket.onopen = () => {
+      retryDelay = 1000;
+      if (connectedBefore && onReconnect) onReconnect();
+      connectedBefore = true;
+    };
+    socket.onmessage = (message) => {
+      onEvent(JSON.parse(message.data));
+    };
+    socket.onclose = () => {
+      socket = null;
+      if (closed) return;
+      retryTimer = setTimeout(connect, retryDelay);
+      retryDelay = Math.min(retryDelay * 2, MAX_RETRY_DELAY);
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    if (retryTimer) clearTimeout(retryTimer);
+    socket?.close();
+  };
+};
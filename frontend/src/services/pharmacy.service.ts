@@ -1,5 +1,6 @@
 import api from './api';
 import { Order } from './user.service';
+import { CursorPage } from './medicineService';
 
 export interface Medicine {
   id: number;
@@ -28,6 +29,7 @@ export interface PrescriptionResponse {
   created_at: string;
   updated_at?: string;
   chat_room_id?: number;
+  distance?: number; // km from the pharmacy, in inbox listings
 }
 
 export interface OrderItem {
@@ -51,8 +53,15 @@ const pharmacyService = {
   // Medicine management
   getMedicines: async (): Promise<Medicine[]> => {
     try {
-      const response = await api.get('/pharmacy/medicines/');
-      return response.data;
+      // The list is cursor-paginated; follow `next` to load the whole inventory
+      const medicines: Medicine[] = [];
+      let url: string | null = '/pharmacy/medicines/';
+      while (url) {
+        const response: { data: CursorPage<Medicine> } = await api.get(url);
+        medicines.push(...response.data.results);
+        url = response.data.next;
+      }
+      return medicines;
     } catch (error) {
       console.error('Error fetching medicines:', error);
       throw error;
@@ -100,8 +109,9 @@ const pharmacyService = {
   },
 
   // Prescription management
-  getPrescriptions: async (): Promise<PrescriptionResponse[]> => {
-    const response = await api.get('/pharmacy/prescriptions/');
+  // Nearby pending prescriptions, nearest first; pass the previous page's `next` to continue
+  getPrescriptionInbox: async (url: string = '/pharmacy/prescriptions/inbox/'): Promise<CursorPage<PrescriptionResponse>> => {
+    const response = await api.get(url);
     return response.data;
   },
 
@@ -131,6 +141,13 @@ const pharmacyService = {
     return response.data;
   },
 
+  // Replace an order's items in one request; stock is reserved for all lines
+  // or none (409 with the short medicine ids otherwise)
+  setOrderItems: async (orderId: number, items: { medicine: number; quantity: number }[]): Promise<Order> => {
+    const response = await api.post(`/pharmacy/orders/${orderId}/set_items/`, { items });
+    return response.data;
+  },
+
   // Search medicines
   searchMedicines: async (query: string): Promise<Medicine[]> => {
     const response = await api.get('/pharmacy/medicines/search/', {